@@ -1,31 +1,90 @@
+import asyncio
 import smtplib
+import threading
+import time
+import uuid
 from email.mime.text import MIMEText
-import requests
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import httpx
 from .config import (
-    WECOM_ENABLED, WECOM_WEBHOOK, 
-    DINGTALK_ENABLED, DINGTALK_WEBHOOK, 
+    WECOM_ENABLED, WECOM_WEBHOOK,
+    DINGTALK_ENABLED, DINGTALK_WEBHOOK,
     EMAIL_ENABLED, SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS, MAIL_TO
 )
+from .config import ALERT_RETRIES, ALERT_BACKOFF, ALERT_DEDUPE_WINDOW, ALERT_BATCH_WINDOW, ALERT_BATCH_MAX, ALERT_SMTP_IDLE
+from .config import CACHE_BACKEND, CACHE_PATH
+from .cache import fingerprint, make_cache
+from .telemetry import span, ERRORS
 
-def send_wecom(text: str) -> bool:
-    if not (WECOM_ENABLED and WECOM_WEBHOOK):
-        return False
-    try:
-        r = requests.post(WECOM_WEBHOOK, json={"msgtype": "text", "text": {"content": text}}, timeout=10)
-        return r.status_code == 200
-    except Exception as e:
-        print(f"WeCom Alert Error: {e}")
-        return False
+CHANNELS = ("wecom", "dingtalk", "email")
+RESULTS_KEPT = 500
+RESULTS_TTL = 24 * 3600
 
-def send_dingtalk(text: str) -> bool:
-    if not (DINGTALK_ENABLED and DINGTALK_WEBHOOK):
-        return False
-    try:
-        r = requests.post(DINGTALK_WEBHOOK, json={"msgtype": "text", "text": {"content": text}}, timeout=10)
-        return r.status_code == 200
-    except Exception as e:
-        print(f"DingTalk Alert Error: {e}")
-        return False
+_async_client = None
+
+def get_async_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(timeout=10)
+    return _async_client
+
+async def aclose():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    await asyncio.get_running_loop().run_in_executor(None, smtp.close)
+
+class SmtpConnection:
+    """One logged-in SMTP connection reused across messages.
+
+    Reconnects when the connection has been idle longer than `idle` seconds
+    (servers drop idle clients) or when a send finds it disconnected.
+    """
+
+    def __init__(self, idle: float = ALERT_SMTP_IDLE):
+        self.idle = idle
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._used = 0.0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> smtplib.SMTP:
+        s = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=10)
+        try:
+            s.starttls()
+        except Exception:
+            pass
+        s.login(SMTP_USER, SMTP_PASS)
+        return s
+
+    def send(self, msg: MIMEText):
+        with self._lock:
+            for attempt in range(2):
+                if self._smtp is None or time.time() - self._used > self.idle:
+                    self._close()
+                    self._smtp = self._connect()
+                try:
+                    self._smtp.sendmail(SMTP_USER, [MAIL_TO], msg.as_string())
+                    self._used = time.time()
+                    return
+                except (smtplib.SMTPServerDisconnected, OSError):
+                    self._close()
+                    if attempt:
+                        raise
+
+    def _close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+smtp = SmtpConnection()
 
 def send_email(subject: str, body: str) -> bool:
     if not (EMAIL_ENABLED and SMTP_HOST and SMTP_USER and SMTP_PASS and MAIL_TO):
@@ -35,14 +94,198 @@ def send_email(subject: str, body: str) -> bool:
         msg["Subject"] = subject
         msg["From"] = SMTP_USER
         msg["To"] = MAIL_TO
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as s:
-            try:
-                s.starttls()
-            except Exception:
-                pass
-            s.login(SMTP_USER, SMTP_PASS)
-            s.sendmail(SMTP_USER, [MAIL_TO], msg.as_string())
+        smtp.send(msg)
         return True
     except Exception as e:
         print(f"Email Alert Error: {e}")
         return False
+
+async def _post_text_async(webhook: str, text: str, name: str) -> bool:
+    try:
+        r = await get_async_client().post(webhook, json={"msgtype": "text", "text": {"content": text}})
+        return r.status_code == 200
+    except Exception as e:
+        print(f"{name} Alert Error: {e}")
+        return False
+
+async def send_wecom_async(text: str) -> bool:
+    if not (WECOM_ENABLED and WECOM_WEBHOOK):
+        return False
+    return await _post_text_async(WECOM_WEBHOOK, text, "WeCom")
+
+async def send_dingtalk_async(text: str) -> bool:
+    if not (DINGTALK_ENABLED and DINGTALK_WEBHOOK):
+        return False
+    return await _post_text_async(DINGTALK_WEBHOOK, text, "DingTalk")
+
+async def send_email_async(subject: str, body: str) -> bool:
+    # smtplib has no async API; keep it off the event loop
+    return await asyncio.get_running_loop().run_in_executor(None, send_email, subject, body)
+
+def enabled_channels() -> Dict[str, Callable[[str, str], Awaitable[bool]]]:
+    """Configured channels as send(subject, text) coroutines"""
+    channels = {}
+    if WECOM_ENABLED and WECOM_WEBHOOK:
+        channels["wecom"] = lambda subject, text: send_wecom_async(text)
+    if DINGTALK_ENABLED and DINGTALK_WEBHOOK:
+        channels["dingtalk"] = lambda subject, text: send_dingtalk_async(text)
+    if EMAIL_ENABLED and SMTP_HOST and SMTP_USER and SMTP_PASS and MAIL_TO:
+        channels["email"] = send_email_async
+    return channels
+
+def format_alert(res: Dict[str, Any]) -> Tuple[str, str]:
+    """(title, message) for an analysis result"""
+    title = res.get("title", "告警分析")
+    msg = (
+        f"{title}\n"
+        f"级别: {res.get('level', '未知')}\n"
+        f"状态: {res.get('current_status', '')}\n"
+        f"分析: {res.get('analysis', '')}\n"
+        f"建议: {res.get('action', '')}"
+    )
+    return title, msg
+
+def format_digest(items: List[Dict[str, Any]]) -> Tuple[str, str]:
+    title = f"【告警汇总】{len(items)} 条告警"
+    index = "\n".join(f"{i}. {it['title']} ({it['level']})" for i, it in enumerate(items, 1))
+    details = "\n\n".join(it["message"] for it in items)
+    return title, f"{title}\n{index}\n\n{details}"
+
+class AlertDispatcher:
+    """Queue in front of the alert channels.
+
+    submit() returns immediately. A single worker drains the queue: alerts that
+    arrive within `batch_window` seconds of each other go out as one digest
+    (at most `batch_max` per message), every channel is sent concurrently, and a
+    failed channel is retried with exponential backoff without resending to the
+    channels that succeeded. An alert for the same series (metric and labels)
+    with the same title and level as one sent in the last `dedupe_window`
+    seconds is dropped; an alert that reached no channel does not count as
+    sent, so the next one goes out again.
+
+    Delivery status and the dedupe window live in caches of the configured
+    backend, so with several workers (sqlite) /alerts/{id} answers from any of
+    them and the same alert raised by two workers goes out once.
+    """
+
+    def __init__(self, retries: int = ALERT_RETRIES, backoff: float = ALERT_BACKOFF, dedupe_window: float = ALERT_DEDUPE_WINDOW,
+                 batch_window: float = ALERT_BATCH_WINDOW, batch_max: int = ALERT_BATCH_MAX):
+        self.retries = retries
+        self.backoff = backoff
+        self.dedupe_window = dedupe_window
+        self.batch_window = batch_window
+        self.batch_max = max(1, batch_max)
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._recent = make_cache(CACHE_BACKEND, CACHE_PATH, 4096, dedupe_window, table="alert_dedupe")
+        self.results = make_cache(CACHE_BACKEND, CACHE_PATH, RESULTS_KEPT, RESULTS_TTL, table="alert_results")
+        self.stats = {"queued": 0, "deduplicated": 0, "messages": 0, "digests": 0, "retries": 0, "failed": 0}
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self, timeout: float = 10):
+        """Give queued alerts up to `timeout` seconds to go out, then cancel the worker"""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Alert dispatcher: {self._queue.qsize()} alerts not sent before shutdown")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def submit(self, res: Dict[str, Any], metric: str = "", labels: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """Enqueue the alert for analysis `res` of the series `metric`{`labels`}"""
+        self.start()
+        title, message = format_alert(res)
+        level = res.get("level", "未知")
+        key = fingerprint(metric, labels or {}, title, level)
+        now = time.time()
+        if self._recent.get(key) is not None:
+            self.stats["deduplicated"] += 1
+            return {"id": None, "queued": False, "deduplicated": True}
+        self._recent.set(key, now)
+        alert_id = uuid.uuid4().hex[:12]
+        self.results.set(alert_id, {"state": "queued", "title": title, "queued_at": now, "sent": {}})
+        self._queue.put_nowait({"id": alert_id, "title": title, "level": level, "message": message, "key": key})
+        self.stats["queued"] += 1
+        return {"id": alert_id, "queued": True, "deduplicated": False}
+
+    def _update(self, alert_id: str, **changes):
+        state = self.results.get(alert_id)
+        if state is not None:
+            state.update(changes)
+            self.results.set(alert_id, state)
+
+    async def _loop(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.batch_max:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._deliver(batch)
+            except Exception as e:
+                print(f"Alert dispatch error: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _deliver(self, batch: List[Dict[str, Any]]):
+        if len(batch) == 1:
+            title, message = batch[0]["title"], batch[0]["message"]
+        else:
+            title, message = format_digest(batch)
+            self.stats["digests"] += 1
+        for it in batch:
+            self._update(it["id"], state="sending")
+        channels = enabled_channels()
+        outcome = await asyncio.gather(*(self._send(name, fn, f"AIOps Alert: {title}", message) for name, fn in channels.items()))
+        sent = {name: False for name in CHANNELS}
+        sent.update(zip(channels, outcome))
+        self.stats["messages"] += 1
+        if channels and not any(outcome):
+            self.stats["failed"] += 1
+        if not any(outcome):
+            # Nothing went out: don't let the dedupe window swallow the next attempt
+            for it in batch:
+                self._recent.delete(it["key"])
+        for it in batch:
+            self._update(it["id"], state="done", sent=sent, digest=len(batch) > 1, sent_at=time.time())
+
+    async def _send(self, channel: str, fn: Callable[[str, str], Awaitable[bool]], subject: str, text: str) -> bool:
+        for attempt in range(self.retries + 1):
+            with span("alert_send", channel=channel):
+                ok = await fn(subject, text)
+            if ok:
+                return True
+            ERRORS.inc(component=f"alert_{channel}")
+            if attempt < self.retries:
+                self.stats["retries"] += 1
+                await asyncio.sleep(self.backoff * (2 ** attempt))
+        return False
+
+    def status(self, alert_id: str = None) -> Dict[str, Any]:
+        if alert_id is not None:
+            return self.results.get(alert_id) or {"state": "unknown"}
+        return {
+            "running": self._task is not None,
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "channels": list(enabled_channels()),
+            "stats": dict(self.stats),
+        }
+
+dispatcher = AlertDispatcher()
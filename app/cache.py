@@ -0,0 +1,163 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+class TTLCache:
+    """Thread-safe in-memory cache with per-entry TTL and LRU eviction"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.time():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: str, value: Any, ttl: float = None):
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def items(self) -> Dict[str, Any]:
+        """Unexpired entries, without touching LRU order or hit counts"""
+        now = time.time()
+        with self._lock:
+            return {k: v for k, (expires, v) in self._data.items() if expires >= now}
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+class SqliteCache:
+    """On-disk variant of TTLCache for JSON-serializable values.
+
+    Survives restarts and can be shared by several worker processes on one host.
+    """
+
+    def __init__(self, path: str, maxsize: int = 1024, ttl: float = 300, table: str = "cache"):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.table = table
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with self._conn() as c:
+            c.execute(f"CREATE TABLE IF NOT EXISTS {table} (k TEXT PRIMARY KEY, v TEXT, expires REAL, used REAL)")
+            c.execute(f"CREATE INDEX IF NOT EXISTS {table}_used ON {table} (used)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        c = self._conn()
+        row = c.execute(f"SELECT v, expires FROM {self.table} WHERE k = ?", (key,)).fetchone()
+        if row is None or row[1] < now:
+            if row is not None:
+                c.execute(f"DELETE FROM {self.table} WHERE k = ?", (key,))
+            self.misses += 1
+            return None
+        c.execute(f"UPDATE {self.table} SET used = ? WHERE k = ?", (now, key))
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: float = None):
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else ttl)
+        c = self._conn()
+        c.execute(f"INSERT OR REPLACE INTO {self.table} (k, v, expires, used) VALUES (?, ?, ?, ?)",
+                  (key, json.dumps(value, ensure_ascii=False), expires, now))
+        (count,) = c.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        if count > self.maxsize:
+            c.execute(f"DELETE FROM {self.table} WHERE expires < ?", (now,))
+            c.execute(f"DELETE FROM {self.table} WHERE k IN (SELECT k FROM {self.table} ORDER BY used ASC LIMIT ?)",
+                      (max(0, count - self.maxsize),))
+
+    def delete(self, key: str):
+        self._conn().execute(f"DELETE FROM {self.table} WHERE k = ?", (key,))
+
+    def items(self) -> Dict[str, Any]:
+        rows = self._conn().execute(f"SELECT k, v FROM {self.table} WHERE expires >= ?", (time.time(),)).fetchall()
+        return {k: json.loads(v) for k, v in rows}
+
+    def __len__(self) -> int:
+        (count,) = self._conn().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        return count
+
+def make_cache(backend: str, path: str, maxsize: int, ttl: float, table: str = "cache"):
+    if backend == "sqlite":
+        try:
+            return SqliteCache(path, maxsize=maxsize, ttl=ttl, table=table)
+        except Exception as e:
+            print(f"Cache: sqlite backend unavailable ({e}), using memory")
+    return TTLCache(maxsize=maxsize, ttl=ttl)
+
+class SingleFlight:
+    """Coalesce concurrent async calls with the same key into one execution"""
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.coalesced += 1
+            return await asyncio.shield(fut)
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            res = await fn()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                fut.cancel()
+            else:
+                fut.set_exception(e)
+                fut.exception()  # mark retrieved when nobody else was waiting
+            raise
+        else:
+            fut.set_result(res)
+            return res
+        finally:
+            self._inflight.pop(key, None)
+
+def fingerprint(*parts: Any) -> str:
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
@@ -0,0 +1,148 @@
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from .config import CATALOG_TTL, CATALOG_REFRESH_INTERVAL, CATALOG_MAX_INSTANCES, CACHE_BACKEND, CACHE_PATH
+from .cache import fingerprint, make_cache
+from .prometheus_adapter import fetch_targets, fetch_all_metric_names
+
+class Entry:
+    """One cached listing, sorted by `keys` so prefix search is a bisect"""
+
+    __slots__ = ("items", "keys", "etag", "fetched_at")
+
+    def __init__(self, items: List[Any], key: Callable[[Any], str], fetched_at: float = None):
+        pairs = sorted(((key(it) or "", it) for it in items), key=lambda p: p[0])
+        self.keys = [k for k, _ in pairs]
+        self.items = [it for _, it in pairs]
+        self.etag = fingerprint(self.items)[:16]
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+
+    def search(self, prefix: str = "", offset: int = 0, limit: int = None) -> Tuple[List[Any], int]:
+        """(page, total matches) of the items whose key starts with prefix"""
+        lo = bisect.bisect_left(self.keys, prefix) if prefix else 0
+        hi = bisect.bisect_left(self.keys, prefix + "\U0010ffff") if prefix else len(self.keys)
+        start = lo + max(0, offset)
+        end = hi if limit is None else min(hi, start + max(0, limit))
+        return self.items[start:end], hi - lo
+
+class Catalog:
+    """In-memory copy of the Prometheus target list and metric names.
+
+    Listings are served from memory. An entry older than `ttl` is still served
+    while a background refresh replaces it, and a refresh thread re-fetches
+    the target list, the full metric-name list and the `max_instances` most
+    recently used per-instance lists every `refresh_interval` seconds, so page
+    loads never wait on Prometheus once warm. A failed refresh keeps the old
+    entry.
+
+    With several workers, `shared` (a sqlite cache) holds the last fetch of
+    every listing: only the leader worker runs the refresh thread, and the
+    others load fresh listings from there instead of asking Prometheus.
+    """
+
+    def __init__(self, ttl: float = CATALOG_TTL, refresh_interval: float = CATALOG_REFRESH_INTERVAL, max_instances: int = CATALOG_MAX_INSTANCES,
+                 shared=None):
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.max_instances = max_instances
+        self.shared = shared
+        self._entries: "OrderedDict[Tuple, Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading: Dict[Tuple, threading.Lock] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"hits": 0, "misses": 0, "refreshes": 0, "shared_loads": 0, "errors": 0}
+
+    def start(self):
+        if self._thread is None and self.refresh_interval > 0:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._refresh_loop, name="catalog-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _fetch(self, key: Tuple, force: bool = False) -> Entry:
+        sort_key = (lambda t: t.get("instance")) if key[0] == "targets" else (lambda name: name)
+        shared_key = f"{key[0]}:{key[1] or ''}"
+        if self.shared is not None and not force:
+            data = self.shared.get(shared_key)
+            if data is not None and time.time() - data["fetched_at"] < self.ttl:
+                self.stats["shared_loads"] += 1
+                return Entry(data["items"], sort_key, data["fetched_at"])
+        items = fetch_targets(strict=True) if key[0] == "targets" else fetch_all_metric_names(key[1])
+        entry = Entry(items, sort_key)
+        self.stats["refreshes"] += 1
+        if self.shared is not None:
+            self.shared.set(shared_key, {"items": items, "fetched_at": entry.fetched_at})
+        return entry
+
+    def _load(self, key: Tuple, force: bool = False) -> Optional[Entry]:
+        with self._lock:
+            loading = self._loading.setdefault(key, threading.Lock())
+        with loading:
+            # Another thread may have loaded it while we waited
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is not None and not force and time.time() - entry.fetched_at < self.ttl:
+                return entry
+            try:
+                entry = self._fetch(key, force)
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"Catalog refresh failed for {key}: {e}")
+                return None
+            with self._lock:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                instances = [k for k in self._entries if k[0] == "metrics" and k[1]]
+                for k in instances[:max(0, len(instances) - self.max_instances)]:
+                    del self._entries[k]
+                    self._loading.pop(k, None)
+            return entry
+
+    def get(self, kind: str, instance: str = None) -> Optional[Entry]:
+        """kind "targets" or "metrics" (all names, or those of one instance); None if Prometheus is unreachable and nothing is cached"""
+        key = (kind, instance or None) if kind == "metrics" else ("targets", None)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return self._load(key)
+        self.stats["hits"] += 1
+        if time.time() - entry.fetched_at >= self.ttl and not self._loading.get(key, threading.Lock()).locked():
+            # Stale: answer now, refresh behind the response
+            threading.Thread(target=self._load, args=(key,), daemon=True).start()
+        return entry
+
+    def warm(self):
+        """Load the listings every page load needs, so the first request doesn't wait for them"""
+        for key in (("targets", None), ("metrics", None)):
+            self._load(key)
+
+    def _refresh_loop(self):
+        self.warm()
+        while not self._stop.wait(self.refresh_interval):
+            with self._lock:
+                keys = list(self._entries)
+            for key in keys:
+                if self._stop.is_set():
+                    return
+                with self._lock:
+                    entry = self._entries.get(key)
+                if entry is not None and time.time() - entry.fetched_at >= self.refresh_interval * 0.5:
+                    self._load(key, force=True)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            sizes = {f"{k[0]}:{k[1] or '*'}": len(e.items) for k, e in self._entries.items()}
+        return {"entries": len(sizes), "sizes": sizes, **self.stats}
+
+catalog = Catalog(shared=make_cache(CACHE_BACKEND, CACHE_PATH, CATALOG_MAX_INSTANCES + 2, CATALOG_TTL, table="catalog") if CACHE_BACKEND == "sqlite" else None)
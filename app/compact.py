@@ -0,0 +1,120 @@
+import time
+from typing import Dict, Any, List, Optional
+import numpy as np
+from .series import Series
+
+# Prompt compaction: shrink the recent window before it is written into the
+# LLM prompt. Downsampling keeps the visually important points, timestamps are
+# written as offsets from the window start and values are rounded, with a
+# statistics header so the model still sees the exact extremes.
+
+STRATEGIES = ("lttb", "minmax", "uniform")
+
+def lttb_indices(ts: np.ndarray, vals: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: keeps the points that shape the line chart"""
+    n = len(ts)
+    if n_out >= n or n_out < 3:
+        return np.arange(n) if n_out >= n else np.linspace(0, n - 1, max(n_out, 1)).astype(np.int64)
+    x = ts.astype(np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], max(edges[i + 1], edges[i] + 1)
+        nlo, nhi = hi, (edges[i + 2] if i + 2 < len(edges) else n)
+        nhi = max(nhi, nlo + 1)
+        cx, cy = x[nlo:nhi].mean(), vals[nlo:nhi].mean()
+        area = np.abs((x[a] - cx) * (vals[lo:hi] - vals[a]) - (x[a] - x[lo:hi]) * (cy - vals[a]))
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+def minmax_indices(ts: np.ndarray, vals: np.ndarray, n_out: int) -> np.ndarray:
+    """Min and max of every bucket; never drops a spike, at the cost of two points per bucket"""
+    n = len(ts)
+    if n_out >= n:
+        return np.arange(n)
+    buckets = max(1, (n_out - 2) // 2)
+    starts = np.linspace(0, n, buckets + 1).astype(np.int64)[:-1]
+    seg = np.repeat(np.arange(buckets), np.diff(np.append(starts, n)))
+    # Position of each bucket's min/max: sort by (bucket, value) and take the ends
+    order = np.lexsort((vals, seg))
+    last = np.append(starts[1:], n) - 1
+    idx = np.concatenate([[0, n - 1], order[starts], order[last]])
+    return np.unique(idx)
+
+def uniform_indices(ts: np.ndarray, vals: np.ndarray, n_out: int) -> np.ndarray:
+    n = len(ts)
+    if n_out >= n:
+        return np.arange(n)
+    return np.unique(np.linspace(0, n - 1, max(n_out, 2)).round().astype(np.int64))
+
+_PICKERS = {"lttb": lttb_indices, "minmax": minmax_indices, "uniform": uniform_indices}
+
+def downsample(series: Series, max_points: int, strategy: str = "lttb") -> Series:
+    picker = _PICKERS.get(strategy)
+    if picker is None:
+        raise ValueError(f"Unknown compaction strategy {strategy}, expected one of {list(STRATEGIES)}")
+    ok = np.isfinite(series.vals)
+    ts, vals = series.ts[ok], series.vals[ok]
+    idx = picker(ts, vals, max_points)
+    return Series(series.labels, ts[idx], vals[idx])
+
+def fmt(x: float, digits: int = 4) -> str:
+    return f"{x:.{digits}g}"
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count: ~3 ASCII chars (digits, punctuation) per token, one per CJK char"""
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return (ascii_chars + 2) // 3 + (len(text) - ascii_chars)
+
+def stats_header(series: Series, digits: int = 4) -> Dict[str, Any]:
+    a = series.vals[np.isfinite(series.vals)]
+    if not len(a):
+        return {"n": 0}
+    return {
+        "n": int(len(a)),
+        "min": float(fmt(a.min(), digits)),
+        "max": float(fmt(a.max(), digits)),
+        "mean": float(fmt(a.mean(), digits)),
+        "p95": float(fmt(np.percentile(a, 95), digits)),
+        "last": float(fmt(a[-1], digits)),
+    }
+
+def encode_points(series: Series, digits: int = 4) -> str:
+    """Points as offsets from the first timestamp; values only when the spacing is regular"""
+    if not len(series):
+        return "[]"
+    rel = (series.ts - series.ts[0]).tolist()
+    vals = [fmt(v, digits) for v in series.vals.tolist()]
+    steps = np.diff(series.ts)
+    if len(steps) and (steps == steps[0]).all():
+        return f"步长{int(steps[0])}秒, 值: [{','.join(vals)}]"
+    return "[相对起点秒数,值]: [" + ",".join(f"[{t},{v}]" for t, v in zip(rel, vals)) + "]"
+
+def compact_window(series: Series, max_points: int, strategy: str = "lttb", digits: int = 4) -> str:
+    """Prompt text for the recent window: time range, statistics header and the downsampled points"""
+    if not len(series):
+        return "无数据"
+    header = stats_header(series, digits)
+    small = downsample(series, max_points, strategy)
+    t0, t1 = int(series.ts[0]), int(series.ts[-1])
+    start = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t0))
+    stats = ", ".join(f"{k}={v}" for k, v in header.items())
+    return (
+        f"起点 {start} (ts={t0}), 时长 {t1 - t0} 秒; 统计: {stats}; "
+        f"降采样为 {len(small)} 点, {encode_points(small, digits)}"
+    )
+
+def compact_context(context: List[Dict[str, Any]], digits: int = 4, shape: bool = True) -> List[Dict[str, Any]]:
+    out = []
+    for c in context:
+        item: Dict[str, Any] = {"metric_name": c.get("metric_name"), "start_ts": c.get("start_ts"), "end_ts": c.get("end_ts")}
+        if c.get("distance") is not None:
+            item["distance"] = float(fmt(c["distance"], 3))
+        summary: Optional[Dict[str, Any]] = c.get("summary")
+        if summary:
+            item["summary"] = summary if shape else {k: v for k, v in summary.items() if k != "shape"}
+        out.append(item)
+    return out
@@ -2,7 +2,9 @@ import os
 import yaml
 
 # Load config.yaml
-CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "config.yaml")
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+# AIPROM_CONFIG points at another config file (e.g. the one bench.bench_suite generates)
+CONFIG_PATH = os.environ.get("AIPROM_CONFIG") or os.path.join(BASE_DIR, "config.yaml")
 
 try:
     with open(CONFIG_PATH, "r", encoding="utf-8") as f:
@@ -14,11 +16,52 @@ except FileNotFoundError:
 def get_cfg(section, key, default):
     return config_data.get(section, {}).get(key, default)
 
+def resolve_path(path):
+    # Relative paths in config.yaml are relative to the project root
+    return path if os.path.isabs(path) else os.path.join(BASE_DIR, path)
+
+# Worker processes (uvicorn --workers, set through WORKERS in run.sh). With more than one,
+# state shared between requests (caches, alert status, catalog) lives in sqlite next to CACHE_PATH
+WORKERS = int(os.environ.get("WEB_CONCURRENCY", "1"))
+# Startup warmup (vector collection, catalog, Ollama model) and the lock that picks the one worker
+# running the monitor, catalog refresh and Ollama keep-alive
+WARMUP_ENABLED = bool(get_cfg("server", "warmup", os.environ.get("WARMUP_ENABLED", "1") not in ("0", "false", "False")))
+LEADER_LOCK_PATH = resolve_path(get_cfg("server", "leader_lock", os.environ.get("LEADER_LOCK_PATH", "data/leader.lock")))
+
 # Prometheus
 PROMETHEUS_URL = get_cfg("prometheus", "url", os.environ.get("PROMETHEUS_URL", "http://localhost:9090"))
 DEFAULT_QUERY = get_cfg("prometheus", "default_query", os.environ.get("DEFAULT_QUERY", "up"))
 RANGE_STEP = get_cfg("prometheus", "range_step", os.environ.get("RANGE_STEP", "60s"))
 INGEST_DAYS = int(get_cfg("prometheus", "ingest_days", os.environ.get("INGEST_DAYS", "15")))
+# Range fetching: max points per query_range chunk, parallel chunk requests, retries per chunk
+FETCH_CHUNK_POINTS = int(get_cfg("prometheus", "chunk_points", os.environ.get("FETCH_CHUNK_POINTS", "10000")))
+FETCH_CONCURRENCY = int(get_cfg("prometheus", "fetch_concurrency", os.environ.get("FETCH_CONCURRENCY", "4")))
+FETCH_RETRIES = int(get_cfg("prometheus", "fetch_retries", os.environ.get("FETCH_RETRIES", "3")))
+FETCH_BACKOFF = float(get_cfg("prometheus", "fetch_backoff", os.environ.get("FETCH_BACKOFF", "0.5")))
+# Range cache in front of fetch_range: step-aligned blocks of block_points steps, at most max_points
+# samples in memory (LRU), historical blocks kept history_ttl and the still-filling head block recent_ttl;
+# samples younger than settle seconds are never cached
+RANGE_CACHE_ENABLED = bool(get_cfg("range_cache", "enabled", os.environ.get("RANGE_CACHE_ENABLED", "1") not in ("0", "false", "False")))
+RANGE_CACHE_BLOCK_POINTS = int(get_cfg("range_cache", "block_points", os.environ.get("RANGE_CACHE_BLOCK_POINTS", "120")))
+RANGE_CACHE_MAX_POINTS = int(get_cfg("range_cache", "max_points", os.environ.get("RANGE_CACHE_MAX_POINTS", "2000000")))
+RANGE_CACHE_HISTORY_TTL = float(get_cfg("range_cache", "history_ttl", os.environ.get("RANGE_CACHE_HISTORY_TTL", "21600")))
+RANGE_CACHE_RECENT_TTL = float(get_cfg("range_cache", "recent_ttl", os.environ.get("RANGE_CACHE_RECENT_TTL", "600")))
+RANGE_CACHE_SETTLE = float(get_cfg("range_cache", "settle", os.environ.get("RANGE_CACHE_SETTLE", "120")))
+
+# Ingest pipeline: segments per vector-store insert, batches buffered ahead of the writer, chunks fetched ahead
+INGEST_BATCH_SIZE = int(get_cfg("ingest", "batch_size", os.environ.get("INGEST_BATCH_SIZE", "512")))
+INGEST_QUEUE_BATCHES = int(get_cfg("ingest", "queue_batches", os.environ.get("INGEST_QUEUE_BATCHES", "2")))
+INGEST_PREFETCH_CHUNKS = int(get_cfg("ingest", "prefetch_chunks", os.environ.get("INGEST_PREFETCH_CHUNKS", "4")))
+# Segmentation: window sizes (seconds, one resolution each), stride as a fraction of the window,
+# gap threshold in steps, minimum share of a window's samples, and redundancy pruning (0 disables)
+INGEST_SEGMENT_WINDOWS = [int(w) for w in get_cfg("ingest", "segment_windows", None) or os.environ.get("INGEST_SEGMENT_WINDOWS", "3600,21600").split(",")]
+INGEST_SEGMENT_STRIDE = float(get_cfg("ingest", "segment_stride", os.environ.get("INGEST_SEGMENT_STRIDE", "1.0")))
+INGEST_GAP_FACTOR = float(get_cfg("ingest", "gap_factor", os.environ.get("INGEST_GAP_FACTOR", "3")))
+INGEST_MIN_COVERAGE = float(get_cfg("ingest", "min_coverage", os.environ.get("INGEST_MIN_COVERAGE", "0.25")))
+INGEST_DEDUPE_Z = float(get_cfg("ingest", "dedupe_z", os.environ.get("INGEST_DEDUPE_Z", "3.0")))
+INGEST_DEDUPE_MAX_SKIP = int(get_cfg("ingest", "dedupe_max_skip", os.environ.get("INGEST_DEDUPE_MAX_SKIP", "11")))
+# Per-series high-water marks for incremental ingest
+INGEST_STATE_PATH = resolve_path(get_cfg("ingest", "state_path", os.environ.get("INGEST_STATE_PATH", "data/ingest_state.db")))
 
 # Host Mapping
 HOST_MAPPING = config_data.get("hosts", {})
@@ -27,10 +70,80 @@ HOST_MAPPING = config_data.get("hosts", {})
 MILVUS_HOST = get_cfg("milvus", "host", os.environ.get("MILVUS_HOST", "127.0.0.1"))
 MILVUS_PORT = int(get_cfg("milvus", "port", os.environ.get("MILVUS_PORT", "19530")))
 MILVUS_COLLECTION = get_cfg("milvus", "collection_name", "metric_series")
+# Seconds between background flushes of inserted data, and between connection health checks
+MILVUS_FLUSH_INTERVAL = float(get_cfg("milvus", "flush_interval", os.environ.get("MILVUS_FLUSH_INTERVAL", "30")))
+MILVUS_HEALTH_INTERVAL = float(get_cfg("milvus", "health_check_interval", os.environ.get("MILVUS_HEALTH_INTERVAL", "30")))
+# Worker threads for blocking pymilvus calls made from async request handlers
+MILVUS_THREADS = int(get_cfg("milvus", "threads", os.environ.get("MILVUS_THREADS", "8")))
+# Store a downsampled summary next to each vector (only applies when the collection is created)
+MILVUS_STORE_PREVIEW = bool(get_cfg("milvus", "store_preview", os.environ.get("MILVUS_STORE_PREVIEW", "1") not in ("0", "false", "False")))
+# Vector index profile (FLAT | IVF_FLAT | IVF_SQ8 | HNSW) plus optional build/search parameter overrides
+MILVUS_INDEX_PROFILE = str(config_data.get("milvus", {}).get("index", {}).get("profile", os.environ.get("MILVUS_INDEX_PROFILE", "IVF_FLAT")))
+MILVUS_INDEX_PARAMS = config_data.get("milvus", {}).get("index", {}).get("params", {}) or {}
+MILVUS_SEARCH_PARAMS = config_data.get("milvus", {}).get("index", {}).get("search_params", {}) or {}
+
+# Vector store backend: milvus | local | auto (Milvus, falling back to the embedded index while it is down)
+VECTOR_STORE_BACKEND = get_cfg("vector_store", "backend", os.environ.get("VECTOR_STORE_BACKEND", "auto"))
+VECTOR_STORE_PATH = resolve_path(get_cfg("vector_store", "path", os.environ.get("VECTOR_STORE_PATH", "data/vectors")))
+# The embedded index switches from exact search to IVF above this many vectors
+LOCAL_IVF_MIN_VECTORS = int(get_cfg("vector_store", "ivf_min_vectors", os.environ.get("LOCAL_IVF_MIN_VECTORS", "50000")))
+LOCAL_IVF_NPROBE = int(get_cfg("vector_store", "nprobe", os.environ.get("LOCAL_IVF_NPROBE", "8")))
+
+# Segment embedding: resample | paa | sax | fft | multiscale (see app/embedding.py) and vector dimension
+EMBEDDING_METHOD = get_cfg("embedding", "method", os.environ.get("EMBEDDING_METHOD", "resample"))
+EMBEDDING_DIM = int(get_cfg("embedding", "dim", os.environ.get("EMBEDDING_DIM", "128")))
+
+# Prompt compaction: downsampling strategy (lttb | minmax | uniform), point limits, significant digits and token budget
+PROMPT_COMPACT = bool(get_cfg("prompt", "compact", os.environ.get("PROMPT_COMPACT", "1") not in ("0", "false", "False")))
+PROMPT_STRATEGY = get_cfg("prompt", "strategy", os.environ.get("PROMPT_STRATEGY", "lttb"))
+PROMPT_MAX_POINTS = int(get_cfg("prompt", "max_points", os.environ.get("PROMPT_MAX_POINTS", "60")))
+PROMPT_MIN_POINTS = int(get_cfg("prompt", "min_points", os.environ.get("PROMPT_MIN_POINTS", "12")))
+PROMPT_DIGITS = int(get_cfg("prompt", "digits", os.environ.get("PROMPT_DIGITS", "4")))
+PROMPT_TOKEN_BUDGET = int(get_cfg("prompt", "token_budget", os.environ.get("PROMPT_TOKEN_BUDGET", "1500")))
+
+# Target / metric-name catalog served from memory: entry TTL, background refresh interval,
+# how many per-instance metric lists to keep, and the default/maximum page size
+CATALOG_TTL = float(get_cfg("catalog", "ttl", os.environ.get("CATALOG_TTL", "300")))
+CATALOG_REFRESH_INTERVAL = float(get_cfg("catalog", "refresh_interval", os.environ.get("CATALOG_REFRESH_INTERVAL", "120")))
+CATALOG_MAX_INSTANCES = int(get_cfg("catalog", "max_instances", os.environ.get("CATALOG_MAX_INSTANCES", "256")))
+CATALOG_PAGE_SIZE = int(get_cfg("catalog", "page_size", os.environ.get("CATALOG_PAGE_SIZE", "200")))
+CATALOG_MAX_PAGE_SIZE = int(get_cfg("catalog", "max_page_size", os.environ.get("CATALOG_MAX_PAGE_SIZE", "5000")))
 
 # Ollama
 OLLAMA_HOST = get_cfg("ollama", "host", os.environ.get("OLLAMA_HOST", "http://localhost:11434"))
 OLLAMA_MODEL = get_cfg("ollama", "model", os.environ.get("OLLAMA_MODEL", "qwen2:latest"))
+# How long Ollama keeps the model loaded after a request ("30m", seconds, or -1 for forever), how often
+# the leader worker pings it while idle (0 disables), and how long the startup model load may take
+OLLAMA_KEEP_ALIVE = get_cfg("ollama", "keep_alive", os.environ.get("OLLAMA_KEEP_ALIVE", "30m"))
+OLLAMA_KEEPALIVE_INTERVAL = float(get_cfg("ollama", "keepalive_interval", os.environ.get("OLLAMA_KEEPALIVE_INTERVAL", "600")))
+OLLAMA_WARMUP_TIMEOUT = float(get_cfg("ollama", "warmup_timeout", os.environ.get("OLLAMA_WARMUP_TIMEOUT", "120")))
+
+# Statistical pre-screen: only windows that trip one of these checks are sent to the LLM
+PRESCREEN_ENABLED = bool(get_cfg("prescreen", "enabled", True))
+PRESCREEN_RECENT_POINTS = int(get_cfg("prescreen", "recent_points", 5))
+PRESCREEN_ROBUST_Z = float(get_cfg("prescreen", "robust_z", 3.5))
+PRESCREEN_EWMA_ALPHA = float(get_cfg("prescreen", "ewma_alpha", 0.3))
+PRESCREEN_EWMA_Z = float(get_cfg("prescreen", "ewma_z", 4.0))
+PRESCREEN_CUSUM_H = float(get_cfg("prescreen", "cusum_h", 10.0))
+
+# Analysis cache: results keyed by (metric, labels, quantized window end, model, prompt version)
+CACHE_BACKEND = get_cfg("cache", "backend", os.environ.get("CACHE_BACKEND", "auto"))  # memory | sqlite | auto
+if CACHE_BACKEND == "auto":
+    # In-process memory is private to each worker; several workers share through sqlite
+    CACHE_BACKEND = "sqlite" if WORKERS > 1 else "memory"
+CACHE_PATH = resolve_path(get_cfg("cache", "path", os.environ.get("CACHE_PATH", "data/cache.db")))
+ANALYSIS_CACHE_TTL = float(get_cfg("cache", "analysis_ttl", os.environ.get("ANALYSIS_CACHE_TTL", "300")))
+ANALYSIS_CACHE_SIZE = int(get_cfg("cache", "analysis_max_entries", os.environ.get("ANALYSIS_CACHE_SIZE", "1024")))
+ANALYSIS_WINDOW_QUANTUM = int(get_cfg("cache", "window_quantum", os.environ.get("ANALYSIS_WINDOW_QUANTUM", "60")))
+
+# Continuous monitoring: evaluate these selectors every `interval` seconds and alert on `alert_levels`
+MONITOR_ENABLED = bool(get_cfg("monitor", "enabled", False))
+MONITOR_METRICS = get_cfg("monitor", "metrics", []) or []
+MONITOR_INTERVAL = float(get_cfg("monitor", "interval", 300))
+MONITOR_JITTER = float(get_cfg("monitor", "jitter", 0.1))
+MONITOR_CONCURRENCY = int(get_cfg("monitor", "concurrency", 4))
+MONITOR_TICK_BUDGET = float(get_cfg("monitor", "tick_budget", 0)) or None
+MONITOR_ALERT_LEVELS = get_cfg("monitor", "alert_levels", ["高风险", "中风险"])
 
 # Alerts - WeCom
 WECOM_ENABLED = config_data.get("alerts", {}).get("wecom", {}).get("enabled", False)
@@ -47,3 +160,12 @@ SMTP_PORT = int(config_data.get("alerts", {}).get("email", {}).get("smtp_port",
 SMTP_USER = config_data.get("alerts", {}).get("email", {}).get("smtp_user", os.environ.get("SMTP_USER", ""))
 SMTP_PASS = config_data.get("alerts", {}).get("email", {}).get("smtp_pass", os.environ.get("SMTP_PASS", ""))
 MAIL_TO = config_data.get("alerts", {}).get("email", {}).get("mail_to", os.environ.get("MAIL_TO", ""))
+
+# Alert dispatch queue: per-channel retries with exponential backoff, duplicate suppression window,
+# burst batching into digests, and how long an idle SMTP connection is reused
+ALERT_RETRIES = int(get_cfg("alerts", "retries", os.environ.get("ALERT_RETRIES", "3")))
+ALERT_BACKOFF = float(get_cfg("alerts", "backoff", os.environ.get("ALERT_BACKOFF", "2")))
+ALERT_DEDUPE_WINDOW = float(get_cfg("alerts", "dedupe_window", os.environ.get("ALERT_DEDUPE_WINDOW", "600")))
+ALERT_BATCH_WINDOW = float(get_cfg("alerts", "batch_window", os.environ.get("ALERT_BATCH_WINDOW", "5")))
+ALERT_BATCH_MAX = int(get_cfg("alerts", "batch_max", os.environ.get("ALERT_BATCH_MAX", "20")))
+ALERT_SMTP_IDLE = float(get_cfg("alerts", "smtp_idle", os.environ.get("ALERT_SMTP_IDLE", "60")))
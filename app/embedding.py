@@ -0,0 +1,205 @@
+from typing import Callable, Dict, Tuple
+import numpy as np
+from .config import EMBEDDING_METHOD, EMBEDDING_DIM
+
+# Every method maps N time-sorted segments of a ragged (ts, vals, offsets)
+# buffer to a float32 (N, dim) matrix in one vectorized pass, so vectors of one
+# method and dim are comparable under L2 whatever the segment lengths.
+Embedder = Callable[[np.ndarray, np.ndarray, np.ndarray, int], np.ndarray]
+
+SAX_ALPHABET = 8
+# Gaussian quantiles splitting N(0, 1) into SAX_ALPHABET equiprobable symbols,
+# and the conditional mean of each symbol used as its numeric value
+_SAX_BREAKS = np.array([-1.1503, -0.6745, -0.3186, 0.0, 0.3186, 0.6745, 1.1503])
+_SAX_LEVELS = np.array([-1.6365, -0.8853, -0.4887, -0.1573, 0.1573, 0.4887, 0.8853, 1.6365])
+SIDE_CHANNELS = 6
+
+def _znorm(vec: np.ndarray) -> np.ndarray:
+    vec = vec - vec.mean(axis=1, keepdims=True)
+    return vec / (vec.std(axis=1, keepdims=True) + 1e-9)
+
+def _layout(ts: np.ndarray, offsets: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """(lengths, seg_id per sample, segment start time, segment time span)"""
+    n = len(offsets) - 1
+    lengths = np.diff(offsets)
+    nonempty = lengths > 0
+    x0 = np.zeros(n, dtype=np.float64)
+    x1 = np.zeros(n, dtype=np.float64)
+    x0[nonempty] = ts[offsets[:-1][nonempty]]
+    x1[nonempty] = ts[offsets[1:][nonempty] - 1]
+    return lengths, np.repeat(np.arange(n), lengths), x0, x1 - x0
+
+def resample(ts: np.ndarray, vals: np.ndarray, offsets: np.ndarray, dim: int) -> np.ndarray:
+    """Linear interpolation onto `dim` evenly spaced times, z-normalized (shape only).
+
+    Segments with a single distinct timestamp become constant rows of their
+    mean, empty segments become zeros.
+    """
+    n = len(offsets) - 1
+    if n == 0 or len(ts) == 0:
+        return np.zeros((n, dim), dtype=np.float32)
+    lengths, seg_id, x0, span = _layout(ts, offsets)
+    starts = offsets[:-1]
+    nonempty = lengths > 0
+    ok = span > 0
+
+    # Map every segment onto its own [0, 1] interval, shifted by 2*i so the
+    # concatenated x axis stays increasing and a single np.interp covers all rows.
+    scale = np.where(ok, span, 1.0)
+    xs = ts - x0[seg_id]
+    xs /= scale[seg_id]
+    xs += 2.0 * seg_id
+    rows = np.flatnonzero(ok)
+    target = np.add.outer(2.0 * rows, np.linspace(0.0, 1.0, dim))
+    vec = np.interp(target.ravel(), xs, vals).reshape(len(rows), dim)
+    vec = _znorm(vec)
+    if len(rows) == n:
+        return vec.astype(np.float32)
+
+    out = np.zeros((n, dim), dtype=np.float32)
+    out[rows] = vec
+    flat = np.flatnonzero(~ok & nonempty)
+    if len(flat):
+        # Only empty segments lie between consecutive non-empty starts, so reduceat sums exactly one segment each
+        sums = np.zeros(n, dtype=np.float64)
+        sums[nonempty] = np.add.reduceat(vals, starts[nonempty])
+        out[flat] = (sums[flat] / lengths[flat])[:, None]
+    return out
+
+def bucket_means(ts: np.ndarray, vals: np.ndarray, offsets: np.ndarray, buckets: int) -> np.ndarray:
+    """Mean value per equal-width *time* bucket of each segment, (N, buckets) float64.
+
+    Buckets are placed by timestamp rather than sample index, so scrape gaps
+    leave buckets empty instead of stretching the neighbors; empty buckets are
+    linearly interpolated from the nearest filled ones on each side.
+    """
+    n = len(offsets) - 1
+    if n == 0 or len(ts) == 0:
+        return np.zeros((n, buckets))
+    lengths, seg_id, x0, span = _layout(ts, offsets)
+    pos = (ts - x0[seg_id]) / np.where(span > 0, span, 1.0)[seg_id]
+    b = np.minimum((pos * buckets).astype(np.int64), buckets - 1)
+    flat = seg_id * buckets + b
+    sums = np.bincount(flat, weights=vals, minlength=n * buckets).reshape(n, buckets)
+    cnts = np.bincount(flat, minlength=n * buckets).reshape(n, buckets)
+    filled = cnts > 0
+    means = sums / np.maximum(cnts, 1)
+    if filled.all():
+        return means
+
+    j = np.arange(buckets)
+    left = np.maximum.accumulate(np.where(filled, j, -1), axis=1)
+    right = np.minimum.accumulate(np.where(filled, j, buckets)[:, ::-1], axis=1)[:, ::-1]
+    has_left, has_right = left >= 0, right < buckets
+    li, ri = np.clip(left, 0, buckets - 1), np.clip(right, 0, buckets - 1)
+    lv = np.take_along_axis(means, li, axis=1)
+    rv = np.take_along_axis(means, ri, axis=1)
+    w = np.where(has_left & has_right, (j - left) / np.maximum(right - left, 1), 0.0)
+    interp = np.where(has_left, lv + w * (rv - lv), rv)
+    interp = np.where(has_left | has_right, interp, 0.0)
+    return np.where(filled, means, interp)
+
+def paa(ts: np.ndarray, vals: np.ndarray, offsets: np.ndarray, dim: int) -> np.ndarray:
+    """Piecewise aggregate approximation: z-normalized time-bucket means"""
+    return _znorm(bucket_means(ts, vals, offsets, dim)).astype(np.float32)
+
+def sax(ts: np.ndarray, vals: np.ndarray, offsets: np.ndarray, dim: int) -> np.ndarray:
+    """SAX: PAA quantized to SAX_ALPHABET equiprobable symbols, each stored as its Gaussian mean.
+
+    Coarser than PAA but robust to small jitter; vectors stay numeric so L2 search still applies.
+    """
+    z = _znorm(bucket_means(ts, vals, offsets, dim))
+    return _SAX_LEVELS[np.searchsorted(_SAX_BREAKS, z)].astype(np.float32)
+
+def fft(ts: np.ndarray, vals: np.ndarray, offsets: np.ndarray, dim: int) -> np.ndarray:
+    """Lowest dim/2 Fourier coefficients (real, imag interleaved) of the z-normalized shape.
+
+    Scaled per Parseval so L2 between vectors approximates L2 between the
+    low-passed shapes; drops high-frequency noise that PAA keeps.
+    """
+    grid = 1 << max(int(np.ceil(np.log2(dim))), 4)
+    z = _znorm(bucket_means(ts, vals, offsets, grid))
+    coef = np.fft.rfft(z, axis=1)[:, : (dim + 1) // 2] * np.sqrt(2.0 / grid)
+    out = np.empty((len(z), 2 * coef.shape[1]), dtype=np.float32)
+    out[:, 0::2] = coef.real
+    out[:, 1::2] = coef.imag
+    return out[:, :dim]
+
+def side_channels(ts: np.ndarray, vals: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Per-segment level/scale features that z-normalization throws away, (N, SIDE_CHANNELS).
+
+    Signed log level, log spread, trend (in spreads per segment), log range,
+    fraction of the window with no samples and log sample count. Logs keep
+    metrics that differ by orders of magnitude comparable.
+    """
+    n = len(offsets) - 1
+    out = np.zeros((n, SIDE_CHANNELS))
+    lengths = np.diff(offsets)
+    ne = np.flatnonzero(lengths > 0)
+    if not len(ne):
+        return out
+    _, seg_id, x0, span = _layout(ts, offsets)
+    starts = offsets[:-1][ne]
+    cnt = lengths[ne].astype(np.float64)
+    mean = np.add.reduceat(vals, starts) / cnt
+    var = np.maximum(np.add.reduceat(vals * vals, starts) / cnt - mean * mean, 0.0)
+    std = np.sqrt(var)
+    t = (ts - x0[seg_id]) / np.where(span > 0, span, 1.0)[seg_id]
+    tm = np.add.reduceat(t, starts) / cnt
+    cov = np.add.reduceat(t * vals, starts) / cnt - tm * mean
+    tvar = np.add.reduceat(t * t, starts) / cnt - tm * tm
+    slope = np.where(tvar > 1e-12, cov / np.maximum(tvar, 1e-12), 0.0)
+    rng = np.maximum.reduceat(vals, starts) - np.minimum.reduceat(vals, starts)
+    dt = np.diff(ts).astype(np.float64)
+    step = np.zeros(n)
+    gaps = np.zeros(n)
+    if len(dt):
+        same = seg_id[1:] == seg_id[:-1]
+        d = np.where(same, dt, 0.0)
+        # Median-free step estimate: span / (count - 1); a gap is any interval over twice that
+        step[ne] = np.where(cnt > 1, span[ne] / np.maximum(cnt - 1, 1), 0.0)
+        over = same & (d > 2 * step[seg_id[1:]]) & (step[seg_id[1:]] > 0)
+        gaps = np.bincount(seg_id[1:][over], weights=d[over], minlength=n)
+    out[ne, 0] = np.sign(mean) * np.log1p(np.abs(mean))
+    out[ne, 1] = np.log1p(std)
+    out[ne, 2] = np.clip(slope / (std + 1e-9), -10, 10)
+    out[ne, 3] = np.log1p(rng)
+    out[ne, 4] = np.where(span[ne] > 0, gaps[ne] / np.where(span[ne] > 0, span[ne], 1.0), 0.0)
+    out[ne, 5] = np.log1p(cnt)
+    return out
+
+def multiscale(ts: np.ndarray, vals: np.ndarray, offsets: np.ndarray, dim: int) -> np.ndarray:
+    """Multi-resolution PAA (dyadic, Haar-like pyramid) plus level/variance side channels.
+
+    Each scale is weighted to carry equal energy, so the coarse trend counts
+    as much as fine detail; the side channels let two incidents with the same
+    shape but a different magnitude (e.g. load 0.5 vs 50) land apart.
+    """
+    body = dim - SIDE_CHANNELS
+    if body < 4:
+        raise ValueError(f"multiscale embedding needs dim >= {SIDE_CHANNELS + 4}")
+    sizes = []
+    left = body
+    size = max(2, body // 2)
+    while left > 0:
+        size = min(size, left)
+        sizes.append(size)
+        left -= size
+        size = max(2, size // 2)
+    parts = [_znorm(bucket_means(ts, vals, offsets, s)) * np.sqrt(body / (len(sizes) * s)) for s in sizes]
+    side = side_channels(ts, vals, offsets)
+    return np.concatenate(parts + [side], axis=1).astype(np.float32)
+
+METHODS: Dict[str, Embedder] = {
+    "resample": resample,
+    "paa": paa,
+    "sax": sax,
+    "fft": fft,
+    "multiscale": multiscale,
+}
+
+def embed(ts: np.ndarray, vals: np.ndarray, offsets: np.ndarray, dim: int = EMBEDDING_DIM, method: str = EMBEDDING_METHOD) -> np.ndarray:
+    fn = METHODS.get(method)
+    if fn is None:
+        raise ValueError(f"Unknown embedding method {method}, expected one of {sorted(METHODS)}")
+    return fn(ts, vals, offsets, dim)
@@ -0,0 +1,373 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+from typing import List, Dict, Any, Tuple, Iterator, Sequence
+import numpy as np
+from .config import INGEST_BATCH_SIZE, INGEST_QUEUE_BATCHES, INGEST_PREFETCH_CHUNKS, INGEST_STATE_PATH
+from .config import INGEST_SEGMENT_WINDOWS, INGEST_SEGMENT_STRIDE, INGEST_GAP_FACTOR, INGEST_MIN_COVERAGE, INGEST_DEDUPE_Z, INGEST_DEDUPE_MAX_SKIP
+from .embedding import bucket_means
+from .milvus_client import window_ids
+from .prometheus_adapter import iter_range_chunks, parse_step
+from .series import Series, labels_key, to_columnar
+from .vector_store import insert_segments
+
+MIN_SEGMENT_POINTS = 4
+SIGNATURE_BUCKETS = 8
+
+# A cut segment and its place on the grid: (window size, window index, piece within the window)
+Segment = Tuple[Series, Tuple[int, int, int]]
+# Per series: (high-water mark, next window index per window size)
+Marks = Dict[Tuple, Tuple[int, Dict[int, int]]]
+
+class IngestInsertError(Exception):
+    """Raised when the vector store rejects a batch; the fetch side was fine."""
+
+def estimate_step(ts: np.ndarray) -> float:
+    """Typical sample interval (median), 0 with fewer than two samples"""
+    return float(np.median(np.diff(ts))) if len(ts) > 1 else 0.0
+
+def estimate_noise(vals: np.ndarray) -> float:
+    """Sample noise level from the MAD of first differences; trends and single spikes barely move it"""
+    if len(vals) < 3:
+        return 0.0
+    return float(np.median(np.abs(np.diff(vals)))) * 1.4826 / np.sqrt(2.0)
+
+class SeriesState:
+    """Per-series Segmenter state: samples of the windows not cut yet and, per window size,
+    the next window index, the last piece's signature and the current run of skipped pieces"""
+
+    __slots__ = ("labels", "ts", "vals", "step", "next_k", "prev", "run")
+
+    def __init__(self, labels: Dict[str, str], ts: np.ndarray, vals: np.ndarray, next_k: List[int]):
+        self.labels = labels
+        self.ts = ts
+        self.vals = vals
+        self.step = 0.0
+        self.next_k = next_k
+        self.prev: List[Any] = [None] * len(next_k)
+        self.run = [0] * len(next_k)
+
+class Segmenter:
+    """Cuts series into windows incrementally, carrying unfinished windows across chunks.
+
+    Every size in `windows` (seconds) tiles time on a fixed grid: window k
+    covers [k * stride * size, k * stride * size + size), so chunk boundaries
+    and incremental runs cut the same segments, and stride < 1 overlaps them.
+    Several sizes index the same history at several resolutions.
+
+    A window never spans a scrape gap (an interval over `gap_factor` times the
+    series' step): it is split there, and pieces with fewer than `min_coverage`
+    of the samples the window should hold are dropped. A piece whose
+    time-bucket means are within `dedupe_z` standard errors of its
+    predecessor's (flat or repeating stretches) adds nothing to the index and
+    is skipped, but no more than `max_skip` in a row, so slow drifts still get
+    a vector now and then. dedupe_z=0 keeps every piece.
+
+    `skip_before` maps a series key to its high-water mark: earlier samples were
+    already ingested and are dropped. `resume` maps it to the next window index
+    per size, so windows an earlier run already cut are never cut again (the
+    mark is the earliest open window over all sizes, which the smaller sizes
+    are already past).
+    """
+
+    def __init__(self, windows: Sequence[int] = INGEST_SEGMENT_WINDOWS, stride: float = INGEST_SEGMENT_STRIDE,
+                 gap_factor: float = INGEST_GAP_FACTOR, min_coverage: float = INGEST_MIN_COVERAGE,
+                 dedupe_z: float = INGEST_DEDUPE_Z, max_skip: int = INGEST_DEDUPE_MAX_SKIP,
+                 min_points: int = MIN_SEGMENT_POINTS, skip_before: Dict[Tuple, int] = None, resume: Dict[Tuple, Dict[int, int]] = None):
+        self.windows = [int(w) for w in windows]
+        self.strides = [max(1, int(round(w * stride))) for w in self.windows]
+        self.gap_factor = gap_factor
+        self.min_coverage = min_coverage
+        self.dedupe_z = dedupe_z
+        self.max_skip = max(0, max_skip)
+        self.min_points = min_points
+        self.skip_before = skip_before or {}
+        self.resume = resume or {}
+        self.open: Dict[Tuple, SeriesState] = {}
+        self.last_ts: Dict[Tuple, int] = {}
+        # Series present in this run, including those with nothing past their mark yet
+        self.seen: set = set()
+        self.stats = {"segments": 0, "sparse": 0, "redundant": 0}
+
+    def feed(self, series: Series) -> Iterator[Segment]:
+        key = labels_key(series.labels)
+        ts, vals = series.ts, series.vals
+        if len(ts):
+            self.seen.add(key)
+        mark = self.skip_before.get(key)
+        if mark is not None:
+            keep = ts >= mark
+            ts, vals = ts[keep], vals[keep]
+        if not len(ts):
+            return
+        state = self.open.get(key)
+        if state is None:
+            # Resume at the window the last run left open, otherwise at the first whole window
+            origin = mark if mark is not None else int(ts[0])
+            done = self.resume.get(key, {})
+            next_k = [max(done.get(w, 0), -(-origin // s)) for w, s in zip(self.windows, self.strides)]
+            state = self.open[key] = SeriesState(series.labels, ts[:0], vals[:0], next_k)
+        else:
+            # Adjacent chunks share their boundary sample
+            keep = ts > self.last_ts[key]
+            ts = np.concatenate([state.ts, ts[keep]])
+            vals = np.concatenate([state.vals, vals[keep]])
+        self.last_ts[key] = int(ts[-1])
+        if not state.step:
+            state.step = estimate_step(ts)
+        # A window is complete once a sample at or past its end has arrived
+        yield from self._cut(state, ts, vals, lambda w, s: (int(ts[-1]) - w) // s)
+        self._carry(state, ts, vals)
+
+    def flush(self, now: int = None) -> Iterator[Segment]:
+        """Cut the remaining windows.
+
+        With `now`, only windows that have fully elapsed are cut; the rest stay
+        open so an incremental run can complete them later.
+        """
+        for key, state in list(self.open.items()):
+            if now is None:
+                yield from self._cut(state, state.ts, state.vals, lambda w, s: self.last_ts[key] // s)
+                # Keep next_k for marks(), drop the samples
+                state.ts, state.vals = state.ts[:0], state.vals[:0]
+            else:
+                yield from self._cut(state, state.ts, state.vals, lambda w, s: -(-(now - w) // s) - 1)
+                self._carry(state, state.ts, state.vals)
+
+    def _carry(self, state: SeriesState, ts: np.ndarray, vals: np.ndarray):
+        # Copy so the carried tail does not pin the whole chunk in memory
+        i = int(np.searchsorted(ts, min(k * s for k, s in zip(state.next_k, self.strides))))
+        state.ts, state.vals = ts[i:].copy(), vals[i:].copy()
+
+    def _cut(self, state: SeriesState, ts: np.ndarray, vals: np.ndarray, last_k) -> Iterator[Segment]:
+        noise = None
+        for r, (w, s) in enumerate(zip(self.windows, self.strides)):
+            ks = np.arange(state.next_k[r], last_k(w, s) + 1, dtype=np.int64)
+            if not len(ks):
+                continue
+            state.next_k[r] = int(ks[-1]) + 1
+            starts, ends, win, piece = self._pieces(state, ts, ks * s, ks * s + w)
+            win = ks[win]
+            min_pts = self.min_points
+            if state.step > 0:
+                min_pts = max(min_pts, int(np.ceil(self.min_coverage * w / state.step)))
+            ok = ends - starts >= min_pts
+            self.stats["sparse"] += int(np.count_nonzero(~ok & (ends > starts)))
+            starts, ends, win, piece = starts[ok], ends[ok], win[ok], piece[ok]
+            if not len(starts):
+                continue
+            if self.dedupe_z > 0:
+                if noise is None:
+                    noise = estimate_noise(vals)
+                keep = self._novel(state, r, ts, vals, starts, ends, noise)
+                self.stats["redundant"] += int(np.count_nonzero(~keep))
+                starts, ends, win, piece = starts[keep], ends[keep], win[keep], piece[keep]
+            self.stats["segments"] += len(starts)
+            for i, j, k, p in zip(starts.tolist(), ends.tolist(), win.tolist(), piece.tolist()):
+                yield Series(state.labels, ts[i:j], vals[i:j]), (w, k, p)
+
+    def _pieces(self, state: SeriesState, ts: np.ndarray, lo_ts: np.ndarray, hi_ts: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Sample index ranges [start, end) of the windows [lo_ts, hi_ts) split at gaps,
+        with the window (position in lo_ts) and piece number of each range"""
+        lo = np.searchsorted(ts, lo_ts)
+        hi = np.searchsorted(ts, hi_ts)
+        whole = (lo, hi, np.arange(len(lo)), np.zeros(len(lo), dtype=np.int64))
+        if state.step <= 0 or len(ts) < 2:
+            return whole
+        gaps = np.flatnonzero(np.diff(ts) > self.gap_factor * state.step) + 1
+        if not len(gaps):
+            return whole
+        # Gaps strictly inside each window add one piece each
+        a = np.searchsorted(gaps, lo, side="right")
+        c = np.maximum(np.searchsorted(gaps, hi, side="left") - a, 0)
+        n = c + 1
+        win = np.repeat(np.arange(len(lo)), n)
+        rank = np.arange(len(win)) - np.repeat(np.cumsum(n) - n, n)
+        g = a[win] + rank
+        starts = np.where(rank == 0, lo[win], gaps[np.clip(g - 1, 0, len(gaps) - 1)])
+        ends = np.where(rank == c[win], hi[win], gaps[np.clip(g, 0, len(gaps) - 1)])
+        return starts, ends, win, rank
+
+    def _novel(self, state: SeriesState, r: int, ts: np.ndarray, vals: np.ndarray, starts: np.ndarray, ends: np.ndarray, noise: float) -> np.ndarray:
+        """Mask of the pieces that differ from their predecessor by more than noise"""
+        lengths = ends - starts
+        offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        idx = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        sig = bucket_means(ts[idx], vals[idx], offsets, SIGNATURE_BUCKETS)
+        n = lengths.astype(np.float64)
+
+        prev_sig, prev_n = np.roll(sig, 1, axis=0), np.roll(n, 1)
+        has_prev = np.ones(len(starts), dtype=bool)
+        if state.prev[r] is None:
+            has_prev[0] = False
+        else:
+            prev_sig[0], prev_n[0] = state.prev[r]
+        state.prev[r] = (sig[-1], n[-1])
+        diff = np.abs(sig - prev_sig).max(axis=1)
+        # Standard error of a difference of two bucket means
+        se = noise * np.sqrt(SIGNATURE_BUCKETS / n + SIGNATURE_BUCKETS / prev_n)
+        eps = 1e-9 * np.maximum(1.0, np.abs(sig).max(axis=1))
+        redundant = has_prev & (diff <= self.dedupe_z * se + eps)
+
+        # Length of the run of redundant pieces ending at each piece, continuing the last chunk's run
+        pos = np.arange(len(starts))
+        last_novel = np.maximum.accumulate(np.where(redundant, -1, pos))
+        run = np.where(redundant, pos - last_novel, 0)
+        run = np.where(redundant & (last_novel < 0), run + state.run[r], run)
+        state.run[r] = int(run[-1])
+        return ~redundant | (run % (self.max_skip + 1) == 0)
+
+    def marks(self) -> Marks:
+        """Progress per series seen in this run: the high-water mark (start of its earliest
+        open window, or just past the last sample) and the next window index per size"""
+        out = {key: (self.skip_before[key], self.resume.get(key, {})) for key in self.seen if key in self.skip_before}
+        for key, state in self.open.items():
+            pending = min(k * s for k, s in zip(state.next_k, self.strides))
+            out[key] = (min(self.last_ts[key] + 1, pending), dict(zip(self.windows, state.next_k)))
+        return out
+
+    def rewind(self, marks: Marks, before: int) -> Marks:
+        """`marks` moved back so that nothing from `before` on counts as ingested: windows
+        reaching past it are cut again next run (their ids are stable, so they are replaced)"""
+        first_k = {w: (before - w) // s + 1 for w, s in zip(self.windows, self.strides)}
+        starts = dict(zip(self.windows, self.strides))
+        out = {}
+        for key, (mark, windows) in marks.items():
+            windows = {w: min(k, first_k[w]) if w in first_k else k for w, k in windows.items()}
+            out[key] = (min([mark, before] + [k * starts[w] for w, k in windows.items() if w in starts]), windows)
+        return out
+
+class HighWaterMarks:
+    """Per (metric, label set) ingest progress, persisted in sqlite"""
+
+    def __init__(self, path: str):
+        self.path = path
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with self._conn() as c:
+            c.execute("CREATE TABLE IF NOT EXISTS hwm (metric TEXT, labels TEXT, mark INTEGER, windows TEXT, PRIMARY KEY (metric, labels))")
+            if "windows" not in [row[1] for row in c.execute("PRAGMA table_info(hwm)")]:
+                # State files from before per-window progress: those series resume from their mark
+                c.execute("ALTER TABLE hwm ADD COLUMN windows TEXT")
+
+    def _conn(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10)
+
+    def load(self, metric: str) -> Marks:
+        with self._conn() as c:
+            rows = c.execute("SELECT labels, mark, windows FROM hwm WHERE metric = ?", (metric,)).fetchall()
+        return {tuple(tuple(kv) for kv in json.loads(labels)): (mark, {int(w): k for w, k in json.loads(windows or "{}").items()})
+                for labels, mark, windows in rows}
+
+    def save(self, metric: str, marks: Marks):
+        """Replace the metric's marks: series missing from `marks` stopped reporting and must not hold back the next run"""
+        rows = [(metric, json.dumps(key, ensure_ascii=False), int(mark), json.dumps(windows)) for key, (mark, windows) in marks.items()]
+        with self._conn() as c:
+            c.execute("DELETE FROM hwm WHERE metric = ?", (metric,))
+            c.executemany("INSERT OR REPLACE INTO hwm (metric, labels, mark, windows) VALUES (?, ?, ?, ?)", rows)
+
+def iter_segments(metric: str, start_ts: int, end_ts: int, step: str, segmenter: Segmenter = None, keep_open: bool = False,
+                  errors: List[Tuple[int, int, str]] = None) -> Iterator[Segment]:
+    """fetch chunk -> parse -> segment, one chunk in memory at a time; failed chunks go to `errors`"""
+    segmenter = segmenter or Segmenter()
+    for chunk in iter_range_chunks(metric, start_ts, end_ts, step, prefetch=INGEST_PREFETCH_CHUNKS, errors=errors):
+        for series in to_columnar(chunk):
+            yield from segmenter.feed(series)
+    yield from segmenter.flush(now=end_ts if keep_open else None)
+
+_marks = None
+
+def get_marks() -> HighWaterMarks:
+    global _marks
+    if _marks is None:
+        _marks = HighWaterMarks(INGEST_STATE_PATH)
+    return _marks
+
+def run_ingest(metric: str, start_ts: int, end_ts: int, step: str, batch_size: int = INGEST_BATCH_SIZE, incremental: bool = True) -> Dict[str, Any]:
+    """Stream segments into the vector store in batches of `batch_size`.
+
+    Vectorize + insert runs on a writer thread fed through a bounded queue; when
+    the writer falls behind the producer blocks, so peak memory is bounded by
+    (INGEST_QUEUE_BATCHES + 1) batches plus the prefetched chunks.
+
+    Incremental runs resume every series from its high-water mark and leave the
+    still-open trailing segment for the next run; the marks are only advanced
+    once every batch was accepted. Marks of series that no longer report are
+    dropped at the end of a run, so they don't keep the next run starting early.
+
+    When some chunks could not be fetched the run still ingests the rest, but
+    no mark moves past the start of the first failed chunk, so the next run
+    fetches that span again; the result then has complete=False and the
+    failed ranges under "errors".
+    """
+    progress = get_marks().load(metric) if incremental else {}
+    marks = {key: mark for key, (mark, _) in progress.items()}
+    if marks:
+        resume = min(marks.values())
+        if resume < start_ts:
+            print(f"Ingest {metric}: resume point {resume} is older than the ingest range, starting at {start_ts}; earlier data is skipped")
+        start_ts = max(start_ts, resume)
+    # On the step grid, so every run samples the series at the same timestamps
+    step_sec = parse_step(step)
+    start_ts = start_ts // step_sec * step_sec
+    segmenter = Segmenter(skip_before=marks, resume={key: windows for key, (_, windows) in progress.items()})
+    batches: "queue.Queue" = queue.Queue(maxsize=max(1, INGEST_QUEUE_BATCHES))
+    state: Dict[str, Any] = {"inserted": 0, "error": None}
+    errors: List[Tuple[int, int, str]] = []
+
+    def writer():
+        while True:
+            batch = batches.get()
+            if batch is None:
+                return
+            if state["error"] is not None:
+                continue  # drain so the producer never blocks forever
+            try:
+                segments = [seg for seg, _ in batch]
+                state["inserted"] += insert_segments(metric, segments, window_ids(metric, segments, [w for _, w in batch]))
+            except Exception as e:
+                state["error"] = e
+
+    def put(item):
+        while True:
+            try:
+                batches.put(item, timeout=1)
+                return
+            except queue.Full:
+                if not t.is_alive():
+                    return
+
+    t = threading.Thread(target=writer, name="ingest-writer", daemon=True)
+    t.start()
+    try:
+        batch: List[Segment] = []
+        for seg in iter_segments(metric, start_ts, end_ts, step, segmenter, keep_open=incremental, errors=errors):
+            batch.append(seg)
+            if len(batch) >= batch_size:
+                put(batch)
+                batch = []
+                if state["error"] is not None:
+                    break
+        if batch and state["error"] is None:
+            put(batch)
+    finally:
+        put(None)
+        t.join()
+    if state["error"] is not None:
+        raise IngestInsertError(str(state["error"])) from state["error"]
+    new_marks = segmenter.marks()
+    if errors:
+        failed_from = min(s for s, _, _ in errors)
+        # Series whose only samples were in the failed chunks keep their old progress
+        new_marks = segmenter.rewind({**progress, **new_marks}, failed_from)
+        print(f"Ingest {metric}: {len(errors)} chunks failed, marks held at {failed_from}")
+    get_marks().save(metric, new_marks)
+    result = {"inserted": state["inserted"], "start_ts": start_ts, "end_ts": end_ts, "incremental": bool(marks),
+              "segments": dict(segmenter.stats), "complete": not errors}
+    if errors:
+        result["errors"] = [{"start_ts": s, "end_ts": e, "error": msg} for s, e, msg in errors]
+    return result
@@ -1,11 +1,47 @@
 import json
-from typing import List, Tuple, Dict, Any
+import time
+from typing import List, Tuple, Dict, Any, Union, AsyncIterator
+import httpx
 import requests
-from .config import OLLAMA_HOST, OLLAMA_MODEL
+from .config import OLLAMA_HOST, OLLAMA_MODEL, OLLAMA_KEEP_ALIVE, OLLAMA_WARMUP_TIMEOUT
+from .config import PROMPT_COMPACT, PROMPT_STRATEGY, PROMPT_MAX_POINTS, PROMPT_MIN_POINTS, PROMPT_DIGITS, PROMPT_TOKEN_BUDGET
+from .compact import compact_window, compact_context, estimate_tokens
+from .series import Series, as_series
+from .telemetry import timed, span, ERRORS, LLM_FIRST_TOKEN
 
+# Bump whenever build_prompt changes so cached analyses from the old prompt are not reused
+PROMPT_VERSION = 2
+
+_async_client = None
+
+def get_async_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None:
+        # Same 5 minute budget as call_llm for slow generations
+        _async_client = httpx.AsyncClient(base_url=OLLAMA_HOST, timeout=httpx.Timeout(300, connect=10))
+    return _async_client
+
+async def aclose():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+async def warmup() -> bool:
+    """Have Ollama load the model (a request without a prompt only loads it) and keep it for OLLAMA_KEEP_ALIVE"""
+    try:
+        r = await get_async_client().post("/api/generate", json={"model": OLLAMA_MODEL, "keep_alive": OLLAMA_KEEP_ALIVE},
+                                          timeout=OLLAMA_WARMUP_TIMEOUT)
+        r.raise_for_status()
+        return True
+    except Exception as e:
+        print(f"Ollama warmup failed: {e}")
+        return False
+
+@timed("call_llm")
 def call_llm(prompt: str) -> str:
     url = f"{OLLAMA_HOST}/api/generate"
-    payload = {"model": OLLAMA_MODEL, "prompt": prompt, "stream": False}
+    payload = {"model": OLLAMA_MODEL, "prompt": prompt, "stream": False, "keep_alive": OLLAMA_KEEP_ALIVE}
     r = requests.post(
         url,
         json=payload,
@@ -15,74 +51,247 @@ def call_llm(prompt: str) -> str:
     data = r.json()
     return data.get("response", "")
 
-def build_prompt(metric_name: str, recent_points: List[Tuple[int, float]], context: List[Dict[str, Any]], env_info: Dict[str, str]) -> str:
-    pts = [{"ts": ts, "val": val} for ts, val in recent_points[-200:]]
-    ctx = [{"metric_name": c.get("metric_name"), "start_ts": c.get("start_ts"), "end_ts": c.get("end_ts"), "distance": c.get("distance")} for c in context]
-    
+@timed("call_llm")
+async def call_llm_async(prompt: str) -> str:
+    """Same as call_llm() without blocking the event loop while the model generates"""
+    payload = {"model": OLLAMA_MODEL, "prompt": prompt, "stream": False, "keep_alive": OLLAMA_KEEP_ALIVE}
+    r = await get_async_client().post("/api/generate", json=payload)
+    r.raise_for_status()
+    data = r.json()
+    return data.get("response", "")
+
+async def stream_llm_async(prompt: str) -> AsyncIterator[str]:
+    """Yield response text pieces as Ollama generates them"""
+    payload = {"model": OLLAMA_MODEL, "prompt": prompt, "stream": True, "keep_alive": OLLAMA_KEEP_ALIVE}
+    t0 = time.perf_counter()
+    first = True
+    with span("call_llm"):
+        async with get_async_client().stream("POST", "/api/generate", json=payload) as r:
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                piece = data.get("response", "")
+                if piece:
+                    if first:
+                        LLM_FIRST_TOKEN.observe(time.perf_counter() - t0)
+                        first = False
+                    yield piece
+                if data.get("done"):
+                    break
+
+class JsonFieldStream:
+    """Incremental parser for a streamed top-level JSON object.
+
+    feed() returns the (key, value) members completed by the new text, so each
+    field can be delivered as soon as the model finishes writing it. Text before
+    the first '{' (code fences, preamble) is ignored.
+    """
+
+    def __init__(self):
+        self.buf = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.member_start = None
+        self.done = False
+
+    def feed(self, text: str) -> List[Tuple[str, Any]]:
+        out: List[Tuple[str, Any]] = []
+        if self.done:
+            return out
+        self.buf += text
+        buf = self.buf
+        i = self.pos
+        while i < len(buf):
+            ch = buf[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                if self.depth > 0:
+                    self.in_string = True
+            elif ch in "{[":
+                self.depth += 1
+                if self.depth == 1:
+                    self.member_start = i + 1
+            elif ch in "}]" and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    out.extend(self._member(buf[self.member_start:i]))
+                    self.done = True
+                    break
+            elif ch == "," and self.depth == 1:
+                out.extend(self._member(buf[self.member_start:i]))
+                self.member_start = i + 1
+            i += 1
+        self.pos = i
+        return out
+
+    @staticmethod
+    def _member(text: str) -> List[Tuple[str, Any]]:
+        if not text.strip():
+            return []
+        try:
+            return list(json.loads("{" + text + "}").items())
+        except ValueError:
+            return []
+
+def _prompt_text(metric_name: str, data: str, ctx: List[Dict[str, Any]], env_info: Dict[str, str], relative: bool) -> str:
     env_str = f"环境: {env_info.get('env', '未知环境')}\n服务: {env_info.get('service', '未知服务')}"
-    
-    prompt = (
+    if relative:
+        points_spec = "  - prediction_points: 数组，预测未来5个点 [[相对最后一个数据点的秒数, val], ...]，用于绘图。\n"
+    else:
+        points_spec = "  - prediction_points: 数组，预测未来5个点 [[ts, val], ...]，用于绘图。\n"
+    return (
         "你是SRE告警分析助手。基于Prometheus指标进行异常识别、趋势预测和根因推断。\n"
         f"指标: {metric_name}\n"
         f"{env_str}\n"
-        f"最近数据点(JSON): {json.dumps(pts, ensure_ascii=False)}\n"
-        f"相似历史片段(JSON): {json.dumps(ctx, ensure_ascii=False)}\n"
+        f"{data}\n"
+        f"相似历史片段(JSON, summary 为该片段的统计摘要与降采样形状): {json.dumps(ctx, ensure_ascii=False, separators=(',', ':') if relative else None)}\n"
         "请返回JSON格式，内容言简意赅，不要啰嗦:\n"
         "  - thought: 字符串，简要的分析思路。\n"
         "  - title: 字符串，简短的告警标题 (如 '【异常】订单服务内存飙升')。\n"
         "  - current_status: 字符串，仅描述当前值和状态。\n"
         "  - level: 字符串，异常级别 (如 '高风险', '中风险', '低风险', '正常')。\n"
         "  - prediction: 字符串，预测结论 (如 '预计10分钟后达到阈值')。\n"
-        "  - prediction_points: 数组，预测未来5个点 [[ts, val], ...]，用于绘图。\n"
+        f"{points_spec}"
         "  - analysis: 字符串，核心原因分析。禁止罗列具体数据点坐标。\n"
         "  - action: 字符串，关键建议。\n"
         "不要包含 Markdown 代码块，直接返回 JSON。"
     )
+
+def build_prompt(metric_name: str, recent_points: Union[Series, List[Tuple[int, float]]], context: List[Dict[str, Any]], env_info: Dict[str, str],
+                 compact: bool = PROMPT_COMPACT) -> str:
+    recent = as_series(recent_points).tail(200)
+    if not compact:
+        pts = [{"ts": ts, "val": val} for ts, val in recent.points]
+        ctx = [{"metric_name": c.get("metric_name"), "start_ts": c.get("start_ts"), "end_ts": c.get("end_ts"), "distance": c.get("distance"), "summary": c.get("summary")} for c in context]
+        return _prompt_text(metric_name, f"最近数据点(JSON): {json.dumps(pts, ensure_ascii=False)}", ctx, env_info, False)
+
+    # Shrink the window until the prompt fits the token budget, then drop the neighbor shapes
+    max_points = PROMPT_MAX_POINTS
+    ctx = compact_context(context, PROMPT_DIGITS)
+    while True:
+        data = "最近数据: " + compact_window(recent, max_points, PROMPT_STRATEGY, PROMPT_DIGITS)
+        prompt = _prompt_text(metric_name, data, ctx, env_info, True)
+        if estimate_tokens(prompt) <= PROMPT_TOKEN_BUDGET or max_points <= PROMPT_MIN_POINTS:
+            break
+        max_points = max(PROMPT_MIN_POINTS, int(max_points * 0.7))
+    if estimate_tokens(prompt) > PROMPT_TOKEN_BUDGET and context:
+        prompt = _prompt_text(metric_name, data, compact_context(context, PROMPT_DIGITS, shape=False), env_info, True)
     return prompt
 
-def analyze(metric_name: str, recent_points: List[Tuple[int, float]], context: List[Dict[str, Any]], env_info: Dict[str, str] = None) -> Dict[str, Any]:
+def absolute_predictions(result: Dict[str, Any], t_end: int) -> Dict[str, Any]:
+    """Turn prediction_points written as offsets from the last point (compact prompts) into epoch timestamps"""
+    pts = result.get("prediction_points")
+    if not isinstance(pts, list):
+        return result
+    out = []
+    for p in pts:
+        try:
+            dt, val = float(p[0]), float(p[1])
+        except (TypeError, ValueError, IndexError):
+            continue
+        # Models sometimes answer with epoch timestamps anyway; keep those as they are
+        out.append([int(dt) if dt > 1e9 else int(t_end + dt), val])
+    return dict(result, prediction_points=out)
+
+def parse_response(text: str) -> Dict[str, Any]:
+    # Clean up potential markdown code blocks
+    clean_text = text.strip()
+    if clean_text.startswith("```json"):
+        clean_text = clean_text[7:]
+    if clean_text.startswith("```"):
+        clean_text = clean_text[3:]
+    if clean_text.endswith("```"):
+        clean_text = clean_text[:-3]
+    clean_text = clean_text.strip()
+
+    try:
+        return json.loads(clean_text)
+    except Exception as e:
+        print(f"JSON Parse Error: {e}, text: {text}")
+        return {"title": "分析失败", "level": "未知", "thought": "解析JSON失败", "analysis": text, "degraded": True}
+
+def fallback_analysis(metric_name: str, recent: Series) -> Dict[str, Any]:
+    if not len(recent):
+        return {"title": "数据缺失", "level": "未知", "thought": "无数据", "analysis": "无法获取数据", "degraded": True}
+
+    # Fallback simple logic
+    a = recent.vals
+    diff = float(a[-1] - a[0])
+    trend = "上涨" if diff > 0.05 else "下降" if diff < -0.05 else "稳定"
+    z = float((a[-1] - a.mean()) / (a.std() + 1e-9))
+    is_anomaly = abs(z) > 2.0
+    level = "中风险" if is_anomaly else "正常"
+
+    return {
+        "title": f"【系统降级】{metric_name} 统计分析",
+        "current_status": f"当前值 {a[-1]:.2f}, 趋势 {trend}",
+        "baseline": f"均值 {a.mean():.2f}",
+        "level": level,
+        "analysis": "LLM不可用，仅提供统计分析。",
+        "action": "检查LLM服务状态",
+        "thought": "LLM服务异常，降级处理",
+        "degraded": True
+    }
+
+def _finish(result: Dict[str, Any], recent: Series) -> Dict[str, Any]:
+    if PROMPT_COMPACT and len(recent):
+        return absolute_predictions(result, int(recent.ts[-1]))
+    return result
+
+def analyze(metric_name: str, recent_points: Union[Series, List[Tuple[int, float]]], context: List[Dict[str, Any]], env_info: Dict[str, str] = None) -> Dict[str, Any]:
     if env_info is None:
         env_info = {}
-    prompt = build_prompt(metric_name, recent_points, context, env_info)
+    recent = as_series(recent_points).tail(200)
+    prompt = build_prompt(metric_name, recent, context, env_info)
     try:
         text = call_llm(prompt)
-        # Clean up potential markdown code blocks
-        clean_text = text.strip()
-        if clean_text.startswith("```json"):
-            clean_text = clean_text[7:]
-        if clean_text.startswith("```"):
-            clean_text = clean_text[3:]
-        if clean_text.endswith("```"):
-            clean_text = clean_text[:-3]
-        clean_text = clean_text.strip()
-            
-        try:
-            data = json.loads(clean_text)
-            return data
-        except Exception as e:
-            print(f"JSON Parse Error: {e}, text: {text}")
-            return {"title": "分析失败", "level": "未知", "thought": "解析JSON失败", "analysis": text}
     except Exception as e:
         print(f"LLM Call Error: {e}")
-        vals = [v for _, v in recent_points[-200:]] if recent_points else []
-        if not vals:
-            return {"title": "数据缺失", "level": "未知", "thought": "无数据", "analysis": "无法获取数据"}
-        
-        # Fallback simple logic
-        import numpy as np
-        a = np.array(vals, dtype=np.float64)
-        diff = float(a[-1] - a[0])
-        trend = "上涨" if diff > 0.05 else "下降" if diff < -0.05 else "稳定"
-        z = float((a[-1] - a.mean()) / (a.std() + 1e-9))
-        is_anomaly = abs(z) > 2.0
-        level = "中风险" if is_anomaly else "正常"
-        
-        return {
-            "title": f"【系统降级】{metric_name} 统计分析",
-            "current_status": f"当前值 {a[-1]:.2f}, 趋势 {trend}",
-            "baseline": f"均值 {a.mean():.2f}",
-            "level": level,
-            "analysis": "LLM不可用，仅提供统计分析。",
-            "action": "检查LLM服务状态",
-            "thought": "LLM服务异常，降级处理"
-        }
+        ERRORS.inc(component="llm")
+        return fallback_analysis(metric_name, recent)
+    return _finish(parse_response(text), recent)
+
+async def analyze_async(metric_name: str, recent_points: Union[Series, List[Tuple[int, float]]], context: List[Dict[str, Any]], env_info: Dict[str, str] = None) -> Dict[str, Any]:
+    if env_info is None:
+        env_info = {}
+    recent = as_series(recent_points).tail(200)
+    prompt = build_prompt(metric_name, recent, context, env_info)
+    try:
+        text = await call_llm_async(prompt)
+    except Exception as e:
+        print(f"LLM Call Error: {e}")
+        ERRORS.inc(component="llm")
+        return fallback_analysis(metric_name, recent)
+    return _finish(parse_response(text), recent)
+
+async def analyze_stream(metric_name: str, recent_points: Union[Series, List[Tuple[int, float]]], context: List[Dict[str, Any]], env_info: Dict[str, str] = None) -> AsyncIterator[Tuple[str, Any]]:
+    """Streaming analyze_async(): yields ("field", (key, value)) as each field completes, then ("result", dict)"""
+    if env_info is None:
+        env_info = {}
+    recent = as_series(recent_points).tail(200)
+    prompt = build_prompt(metric_name, recent, context, env_info)
+    parser = JsonFieldStream()
+    pieces: List[str] = []
+    try:
+        async for piece in stream_llm_async(prompt):
+            pieces.append(piece)
+            for member in parser.feed(piece):
+                if member[0] == "prediction_points":
+                    member = (member[0], _finish({"prediction_points": member[1]}, recent)["prediction_points"])
+                yield "field", member
+    except Exception as e:
+        print(f"LLM Call Error: {e}")
+        ERRORS.inc(component="llm")
+        yield "result", fallback_analysis(metric_name, recent)
+        return
+    yield "result", _finish(parse_response("".join(pieces)), recent)
@@ -1,14 +1,36 @@
+import asyncio
+import gzip
+import json
 import os
 import time
-from typing import List, Dict, Any
-from fastapi import FastAPI, Query
-from fastapi.responses import FileResponse, JSONResponse
+from typing import List, Dict, Any, Optional, Tuple
+from fastapi import FastAPI, Query, Request
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from .config import DEFAULT_QUERY, INGEST_DAYS, RANGE_STEP
-from .prometheus_adapter import fetch_range, to_series, fetch_instant, fetch_targets, fetch_metric_names
-from .milvus_client import insert_segments, series_to_vector, search_similar
-from .llm import analyze
-from .alerts import send_wecom, send_dingtalk, send_email
+from .config import DEFAULT_QUERY, INGEST_DAYS, RANGE_STEP, OLLAMA_MODEL
+from .config import PRESCREEN_ENABLED
+from .config import MONITOR_ENABLED, MONITOR_METRICS, MONITOR_INTERVAL, MONITOR_JITTER, MONITOR_CONCURRENCY, MONITOR_TICK_BUDGET, MONITOR_ALERT_LEVELS
+from .config import CACHE_BACKEND, CACHE_PATH, ANALYSIS_CACHE_SIZE, ANALYSIS_CACHE_TTL, ANALYSIS_WINDOW_QUANTUM
+from .config import CATALOG_PAGE_SIZE, CATALOG_MAX_PAGE_SIZE
+from .config import WORKERS, WARMUP_ENABLED, LEADER_LOCK_PATH, OLLAMA_KEEPALIVE_INTERVAL
+from . import prometheus_adapter, llm, alerts, milvus_client, telemetry
+from .prometheus_adapter import fetch_range_series_async, fetch_metric_names
+from .range_cache import range_cache
+from .series import Series, labels_key, summarize
+from .cache import make_cache, SingleFlight, fingerprint
+from .milvus_client import series_to_vector, series_to_vectors, pack_segments
+from .vector_store import insert_segments, search_similar_async, search_similar_batch_async, store as vector_store
+from .llm import analyze_async, analyze_stream, PROMPT_VERSION
+from .prescreen import prescreen, verdict, stats as prescreen_stats
+from .scheduler import MonitorScheduler
+from .ingest import run_ingest, IngestInsertError
+from .alerts import dispatcher as alert_dispatcher
+from .catalog import catalog
+from .telemetry import HTTP_REQUESTS, HTTP_SECONDS, ERRORS
+from .workers import LeaderLock
+
+LEADER_RETRY_INTERVAL = 10
+METRICS_PUBLISH_INTERVAL = 15
 
 app = FastAPI()
 base_dir = os.path.dirname(os.path.dirname(__file__))
@@ -17,7 +39,82 @@ static_dir = os.path.join(web_dir, "static")
 if os.path.isdir(static_dir):
     app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
-last_analysis: Dict[str, Any] = {}
+analysis_cache = make_cache(CACHE_BACKEND, CACHE_PATH, ANALYSIS_CACHE_SIZE, ANALYSIS_CACHE_TTL, table="analysis")
+analysis_flight = SingleFlight()
+# One process per uvicorn worker: the leader runs the once-per-host jobs, and /metrics
+# merges the snapshots every worker publishes here
+leader = LeaderLock(LEADER_LOCK_PATH)
+worker_id = str(os.getpid())
+metrics_store = make_cache("sqlite", CACHE_PATH, 1024, METRICS_PUBLISH_INTERVAL * 4, table="metrics") if WORKERS > 1 else None
+background: List[asyncio.Task] = []
+
+@app.on_event("startup")
+async def startup():
+    loop = asyncio.get_running_loop()
+    # Connect to Milvus / map the local index once so requests don't pay for it; with warmup
+    # also fetch the catalog and load the Ollama model, so no request waits on a cold start
+    t0 = time.perf_counter()
+    jobs = [loop.run_in_executor(None, vector_store.start)]
+    if WARMUP_ENABLED:
+        jobs += [loop.run_in_executor(None, catalog.warm), llm.warmup()]
+    await asyncio.gather(*jobs)
+    if WARMUP_ENABLED:
+        print(f"Worker {worker_id} warmed up in {time.perf_counter() - t0:.1f}s")
+    alert_dispatcher.start()
+    background.append(loop.create_task(lead()))
+    if metrics_store is not None:
+        background.append(loop.create_task(publish_metrics()))
+
+async def lead():
+    """Become the leader worker (retrying while another worker holds the lock) and run the monitor,
+    catalog refresh and Ollama keep-alive"""
+    while not leader.acquire():
+        await asyncio.sleep(LEADER_RETRY_INTERVAL)
+    catalog.start()
+    if MONITOR_ENABLED:
+        monitor.start()
+    while OLLAMA_KEEPALIVE_INTERVAL > 0:
+        await asyncio.sleep(OLLAMA_KEEPALIVE_INTERVAL)
+        await llm.warmup()
+
+async def publish_metrics():
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, telemetry.publish, metrics_store, worker_id)
+        except Exception as e:
+            print(f"Metrics publish failed: {e}")
+        await asyncio.sleep(METRICS_PUBLISH_INTERVAL)
+
+@app.on_event("shutdown")
+async def shutdown():
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    background.clear()
+    await monitor.stop()
+    await alert_dispatcher.stop()
+    await asyncio.get_running_loop().run_in_executor(None, catalog.stop)
+    await asyncio.get_running_loop().run_in_executor(None, vector_store.stop)
+    await prometheus_adapter.aclose()
+    await llm.aclose()
+    await alerts.aclose()
+    leader.release()
+
+@app.middleware("http")
+async def record_request(request: Request, call_next):
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Route template, not the raw path, so ids and static files don't explode the label set
+        route = request.scope.get("route")
+        path = getattr(route, "path", None) or ("/static" if request.url.path.startswith("/static/") else "other")
+        HTTP_REQUESTS.inc(path=path, method=request.method, status=status)
+        HTTP_SECONDS.observe(time.perf_counter() - t0, path=path)
 
 @app.get("/")
 def index():
@@ -28,35 +125,75 @@ def index():
 def health():
     return {"ok": True}
 
+@app.get("/stats")
+def get_stats():
+    return {
+        "worker": {"pid": worker_id, "workers": WORKERS, "leader": leader.held},
+        "prescreen": dict(prescreen_stats),
+        "vector_store": vector_store.status(),
+        "alerts": alert_dispatcher.status(),
+        "catalog": catalog.status(),
+        "range_cache": range_cache.status() if range_cache is not None else None,
+        "analysis_cache": {
+            "hits": analysis_cache.hits,
+            "misses": analysis_cache.misses,
+            "coalesced": analysis_flight.coalesced,
+            "entries": len(analysis_cache)
+        }
+    }
+
+@telemetry.registry.collector
+def runtime_metrics():
+    """Cache, queue and component counters already kept for /stats, in /metrics form"""
+    alert_status = alert_dispatcher.status()
+    monitor_status = monitor.status()
+    yield "aiprom_analysis_cache_requests_total", "counter", "Analysis cache lookups", [
+        ({"result": "hit"}, analysis_cache.hits), ({"result": "miss"}, analysis_cache.misses)]
+    yield "aiprom_analysis_cache_entries", "gauge", "Cached analyses", [({}, len(analysis_cache))]
+    yield "aiprom_analysis_coalesced_total", "counter", "Requests that joined an in-flight analysis", [({}, analysis_flight.coalesced)]
+    yield "aiprom_analysis_inflight", "gauge", "Analyses currently running", [({}, len(analysis_flight))]
+    yield "aiprom_prescreen_total", "counter", "Pre-screen outcomes", [({"outcome": k}, v) for k, v in prescreen_stats.items()]
+    catalog_status = catalog.status()
+    yield "aiprom_catalog_requests_total", "counter", "Catalog lookups", [
+        ({"result": "hit"}, catalog_status["hits"]), ({"result": "miss"}, catalog_status["misses"])]
+    yield "aiprom_catalog_refreshes_total", "counter", "Catalog refreshes from Prometheus", [
+        ({"result": "ok"}, catalog_status["refreshes"]), ({"result": "error"}, catalog_status["errors"])]
+    if range_cache is not None:
+        rc = range_cache.status()
+        yield "aiprom_range_cache_requests_total", "counter", "Range fetches served fully, partly or not at all from the range cache", [
+            ({"result": "hit"}, rc["hits"]), ({"result": "partial"}, rc["partial"]), ({"result": "miss"}, rc["misses"])]
+        yield "aiprom_range_cache_points_total", "counter", "Samples returned by range fetches, by source", [
+            ({"source": "cache"}, rc["cached_points"]), ({"source": "prometheus"}, rc["fetched_points"])]
+        yield "aiprom_range_cache_points", "gauge", "Samples held in the range cache", [({}, rc["points"])]
+        yield "aiprom_range_cache_evictions_total", "counter", "Range cache blocks evicted to stay under max_points", [({}, rc["evictions"])]
+    yield "aiprom_alert_queue_depth", "gauge", "Alerts waiting for the dispatcher", [({}, alert_status["pending"])]
+    yield "aiprom_alerts_total", "counter", "Alert dispatcher events", [({"event": k}, v) for k, v in alert_status["stats"].items()]
+    yield "aiprom_monitor_total", "counter", "Monitor scheduler events", [({"event": k}, v) for k, v in monitor_status["stats"].items()]
+    yield "aiprom_monitor_deferred", "gauge", "Metrics deferred to the next monitor tick", [({}, len(monitor_status["deferred"]))]
+    vs = vector_store.status()
+    yield "aiprom_vector_searches_total", "counter", "Vector searches by backend", [
+        ({"backend": "milvus"}, vs["milvus_searches"]), ({"backend": "local"}, vs["local_searches"])]
+    yield "aiprom_vector_milvus_errors_total", "counter", "Milvus failures that fell back to the local index", [({}, vs["milvus_errors"])]
+    yield "aiprom_vector_local_size", "gauge", "Vectors in the local index", [({}, vs["local_vectors"])]
+    yield "aiprom_vector_milvus_pending", "gauge", "Segments written while Milvus was down, waiting to be copied there", [({}, vs["milvus_pending"])]
+    yield "aiprom_vector_executor_backlog", "gauge", "Vector store calls waiting for a worker thread", [({}, milvus_client.executor_backlog())]
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus exposition format; scrape this from Prometheus"""
+    body = telemetry.render(metrics_store, worker_id)
+    return Response(body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.post("/ingest")
-def ingest(metric: str = Query(DEFAULT_QUERY), step: str = Query(RANGE_STEP), demo: int = Query(0)):
+def ingest(metric: str = Query(DEFAULT_QUERY), step: str = Query(RANGE_STEP), demo: int = Query(0), full: int = Query(0)):
+    """Ingest history into the vector store; only the delta since the last run unless full=1"""
     try:
         end_ts = int(time.time())
         start_ts = end_ts - INGEST_DAYS * 24 * 3600
-        res = fetch_range(metric, start_ts, end_ts, step)
-        series = to_series(res)
-        segments: List[List[Any]] = []
-        for _, points in series:
-            if not points:
-                continue
-            win = 3600
-            seg = []
-            s = points[0][0]
-            for ts, val in points:
-                if ts - s <= win:
-                    seg.append((ts, val))
-                else:
-                    if len(seg) >= 4:
-                        segments.append(seg)
-                    seg = [(ts, val)]
-                    s = ts
-            if len(seg) >= 4:
-                segments.append(seg)
         try:
-            count = insert_segments(metric, segments)
-        except Exception as e2:
+            return run_ingest(metric, start_ts, end_ts, step, incremental=not full)
+        except IngestInsertError as e2:
             return JSONResponse({"ok": False, "error": str(e2), "milvus_unavailable": True, "inserted": 0}, status_code=500)
-        return {"inserted": count}
     except Exception as e:
         if demo == 1:
             now = int(time.time())
@@ -94,99 +231,330 @@ def get_env_info(metric_labels: Dict[str, str]) -> Dict[str, str]:
         
     return {"env": "未知环境", "service": instance}
 
+def catalog_response(request: Request, payload: Dict[str, Any], version: str) -> Response:
+    """JSON listing with an ETag (304 on If-None-Match) and gzip when the client accepts it"""
+    etag = f'"{version}-{fingerprint(str(request.url.query))[:8]}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if len(body) > 1024 and "gzip" in request.headers.get("accept-encoding", ""):
+        body = gzip.compress(body, compresslevel=5)
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def page_args(offset: int, limit: Optional[int]) -> Tuple[int, int]:
+    return max(0, offset), min(max(1, limit or CATALOG_PAGE_SIZE), CATALOG_MAX_PAGE_SIZE)
+
 @app.get("/targets")
-async def get_targets(instance: str = Query(None)):
-    """List Prometheus targets and common metrics, optionally filtered by instance"""
-    targets = []
+def get_targets(request: Request, instance: str = Query(None)):
+    """List Prometheus targets and common metrics, optionally filtered by instance (served from the catalog)"""
+    targets: List[Dict[str, Any]] = []
+    version = "0"
     if not instance:
-        targets = fetch_targets()
-    metrics = fetch_metric_names(instance)
-    return {"targets": targets, "metrics": metrics}
+        entry = catalog.get("targets")
+        if entry is not None:
+            targets, version = entry.items, entry.etag
+        metrics = fetch_metric_names(None)
+    else:
+        entry = catalog.get("metrics", instance)
+        metrics, version = (entry.items, entry.etag) if entry is not None else ([], "0")
+    return catalog_response(request, {"targets": targets, "metrics": metrics}, version)
+
+@app.get("/catalog/targets")
+def catalog_targets(request: Request, prefix: str = Query(""), offset: int = Query(0), limit: int = Query(None)):
+    """Page of targets whose instance starts with prefix"""
+    offset, limit = page_args(offset, limit)
+    entry = catalog.get("targets")
+    if entry is None:
+        return JSONResponse({"error": "Prometheus 不可用", "items": [], "total": 0}, status_code=503)
+    items, total = entry.search(prefix, offset, limit)
+    return catalog_response(request, {"items": items, "total": total, "offset": offset, "limit": limit}, entry.etag)
+
+@app.get("/catalog/metrics")
+def catalog_metrics(request: Request, instance: str = Query(None), prefix: str = Query(""), offset: int = Query(0), limit: int = Query(None)):
+    """Page of metric names starting with prefix, across Prometheus or for one instance"""
+    offset, limit = page_args(offset, limit)
+    entry = catalog.get("metrics", instance)
+    if entry is None:
+        return JSONResponse({"error": "Prometheus 不可用", "items": [], "total": 0}, status_code=503)
+    items, total = entry.search(prefix, offset, limit)
+    return catalog_response(request, {"items": items, "total": total, "offset": offset, "limit": limit}, entry.etag)
+
+async def fetch_context(hits: List[Dict[str, Any]], step: str) -> List[Dict[str, Any]]:
+    """Summarize the neighbor windows for the prompt.
+
+    Hits that carry a stored preview are used as-is; the rest are fetched from
+    Prometheus concurrently. Windows without data are dropped.
+    """
+    async def one(v: Dict[str, Any]):
+        summary = v.get("summary")
+        if summary is None:
+            try:
+                ctx_series = await fetch_range_series_async(v["metric_name"], v["start_ts"], v["end_ts"], step)
+            except Exception as e:
+                print(f"Error fetching context {v['metric_name']} {v['start_ts']}-{v['end_ts']}: {e}")
+                ERRORS.inc(component="context")
+                return None
+            if not ctx_series or not len(ctx_series[0]):
+                return None
+            summary = summarize(ctx_series[0])
+        return {
+            "metric_name": v["metric_name"],
+            "start_ts": v["start_ts"],
+            "end_ts": v["end_ts"],
+            "distance": v["distance"],
+            "summary": summary
+        }
+
+    done = await asyncio.gather(*(one(v) for v in hits))
+    return [c for c in done if c is not None]
+
+def analysis_key(metric: str, recent: Series, step: str) -> str:
+    window_end = int(recent.ts[-1]) // ANALYSIS_WINDOW_QUANTUM * ANALYSIS_WINDOW_QUANTUM if len(recent) else 0
+    return fingerprint(metric, labels_key(recent.labels), window_end, step, OLLAMA_MODEL, PROMPT_VERSION)
+
+async def analyze_series(metric: str, recent: Series, step: str, hits: List[Dict[str, Any]] = None,
+                         screen: Dict[str, Any] = None) -> Dict[str, Any]:
+    """Vector search, context and LLM analysis of one series.
+
+    Results are cached by window fingerprint, and concurrent requests for the
+    same fingerprint share one in-flight analysis. `hits` and `screen` are
+    reused when the caller already searched or pre-screened the window.
+    """
+    key = analysis_key(metric, recent, step)
+    cached = analysis_cache.get(key)
+    if cached is not None:
+        return dict(cached, cached=True)
+
+    async def run() -> Dict[str, Any]:
+        result = screen_window(metric, recent, key, screen)
+        if result is not None:
+            return result
+        context, env_info = await gather_context(recent, step, hits)
+        result = await analyze_async(metric, recent, context, env_info)
+        if not result.get("degraded"):
+            analysis_cache.set(key, result)
+        return result
+
+    return dict(await analysis_flight.do(key, run))
+
+def screen_window(metric: str, recent: Series, key: str, screen: Dict[str, Any] = None):
+    """Statistical verdict for an unremarkable window (cached), or None when the LLM is needed"""
+    if not PRESCREEN_ENABLED:
+        return None
+    if screen is None:
+        screen = prescreen(recent)
+    if screen["suspicious"]:
+        return None
+    result = verdict(metric, recent, screen)
+    analysis_cache.set(key, result)
+    return result
+
+async def gather_context(recent: Series, step: str, hits: List[Dict[str, Any]] = None):
+    # Vector search context (skipped when the caller already searched in batch)
+    if hits is None:
+        vec = series_to_vector(recent)
+        hits = await search_similar_async(vec, top_k=3)
+    context = await fetch_context(hits, step)
+
+    # Resolve Environment and Service info
+    env_info = get_env_info(recent.labels)
+    return context, env_info
+
+def sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def analyze_fleet(metric: str, series: List[Series], step: str, top_n: int) -> Dict[str, Any]:
+    """Analyze every series of a query.
+
+    All series are vectorized and searched in one batch and ranked by pre-screen
+    anomaly score (nearest-neighbor distance breaks ties); only the top_n
+    suspicious ones go to the LLM. The top-level fields are the analysis of the
+    highest-ranked series, so the response stays compatible with single-series mode.
+    """
+    series = [s for s in series if len(s)]
+    if not series:
+        return {"error": "No data found for metric", "series_count": 0, "series_scores": [], "analyses": []}
+    ts, vals, offsets = pack_segments(series)
+    vectors = series_to_vectors(ts, vals, offsets)
+    all_hits = await search_similar_batch_async(vectors, top_k=3)
+
+    scores = []
+    for i, s in enumerate(series):
+        screen = prescreen(s)
+        hits = all_hits[i] if i < len(all_hits) else []
+        scores.append({
+            "index": i,
+            "labels": s.labels,
+            "score": screen["score"],
+            "suspicious": screen["suspicious"],
+            "reasons": screen["reasons"],
+            "nn_distance": hits[0]["distance"] if hits else None,
+            "screen": screen,
+        })
+    scores.sort(key=lambda x: (x["score"], x["nn_distance"] or 0.0), reverse=True)
+
+    chosen = [x for x in scores if x["suspicious"] or not PRESCREEN_ENABLED][:max(0, top_n)]
+    analyses = await asyncio.gather(*(analyze_series(metric, series[x["index"]], step, all_hits[x["index"]], x["screen"]) for x in chosen))
+    analyses = [dict(a, labels=x["labels"]) for x, a in zip(chosen, analyses)]
+
+    # The top-level fields describe the first analyzed series, or the highest-ranked one when none was
+    top = chosen[0] if chosen else scores[0]
+    result = dict(analyses[0]) if analyses else verdict(metric, series[top["index"]], top["screen"])
+    result["recent_points"] = series[top["index"]].points
+    result["labels"] = top["labels"]
+    result["series_count"] = len(series)
+    result["series_scores"] = [{k: v for k, v in x.items() if k not in ("index", "screen")} for x in scores]
+    result["analyses"] = analyses
+    return result
 
 @app.get("/analyze")
-async def analyze_metric(metric: str = Query(DEFAULT_QUERY), step: str = Query(RANGE_STEP), demo: int = Query(0)):
+async def analyze_metric(metric: str = Query(DEFAULT_QUERY), step: str = Query(RANGE_STEP), demo: int = Query(0),
+                         all_series: int = Query(0), top_n: int = Query(3), timing: int = Query(0)):
     """
     1. Fetch recent data from Prometheus
     2. Search similar history in Milvus
     3. LLM analysis
+
+    all_series=1 analyzes every returned series instead of the first one (see analyze_fleet).
+    timing=1 adds a per-span time breakdown of this request under "timing".
     """
+    if not timing:
+        return await run_analysis(metric, step, demo, all_series, top_n)
+    t0 = time.perf_counter()
+    with telemetry.collect() as timings:
+        result = await run_analysis(metric, step, demo, all_series, top_n)
+    return dict(result, timing=telemetry.breakdown(timings, time.perf_counter() - t0))
+
+async def run_analysis(metric: str, step: str, demo: int, all_series: int, top_n: int) -> Dict[str, Any]:
     if demo:
         # Mock data for demo
         recent_points = [(int(time.time()) - i*60, 50 + i*0.1 + (10 if i>10 else 0)) for i in range(60)]
         context = []
         env_info = {"env": "测试环境", "service": "演示服务"}
-        result = analyze(metric, recent_points, context, env_info)
+        result = await analyze_async(metric, recent_points, context, env_info)
         return result
 
     end_ts = int(time.time())
     start_ts = end_ts - 3600 * 6  # Last 6 hours
     
-    res = fetch_range(metric, start_ts, end_ts, step)
-    series = to_series(res)
+    series = await fetch_range_series_async(metric, start_ts, end_ts, step)
     if not series:
         return {"error": "No data found for metric"}
+    if all_series:
+        return await analyze_fleet(metric, series, step, top_n)
     
     # Analyze the first series found
-    metric_labels, recent_points = series[0]
-    
-    # Vector search context
-    vec = series_to_vector(recent_points)
-    vectors = search_similar(vec, top_k=3)
-    context = []
-    for v in vectors:
-        # Fetch actual points for context
-        c_res = fetch_range(v["metric_name"], v["start_ts"], v["end_ts"], step)
-        ctx_series = to_series(c_res)
-        if ctx_series:
-            context.append({
-                "metric_name": v["metric_name"],
-                "start_ts": v["start_ts"],
-                "end_ts": v["end_ts"],
-                "distance": v["distance"]
-            })
-            
-    # Resolve Environment and Service info
-    env_info = get_env_info(metric_labels)
-
-    result = analyze(metric, recent_points, context, env_info)
+    recent = series[0]
+    result = await analyze_series(metric, recent, step)
     
     # Inject recent points for visualization
-    result["recent_points"] = recent_points
+    result["recent_points"] = recent.points
+    result["labels"] = recent.labels
     return result
 
+@app.get("/analyze/stream")
+async def analyze_metric_stream(metric: str = Query(DEFAULT_QUERY), step: str = Query(RANGE_STEP), timing: int = Query(0)):
+    """
+    Server-Sent Events version of /analyze:
+      meta   -> {"recent_points": [...]} as soon as the data is fetched
+      field  -> {"key": ..., "value": ...} for each completed field of the LLM answer
+      result -> the full analysis (same shape as /analyze)
+      error  -> {"error": ...}
+
+    timing=1 adds the per-span breakdown (see /analyze) to the result event.
+    """
+    async def events():
+        t0 = time.perf_counter()
+        with telemetry.collect() as timings:
+            end_ts = int(time.time())
+            start_ts = end_ts - 3600 * 6  # Last 6 hours
+            try:
+                series = await fetch_range_series_async(metric, start_ts, end_ts, step)
+            except Exception as e:
+                yield sse("error", {"error": str(e)})
+                return
+            if not series:
+                yield sse("error", {"error": "No data found for metric"})
+                return
+            recent = series[0]
+            recent_points = recent.points
+            yield sse("meta", {"recent_points": recent_points})
+
+            key = analysis_key(metric, recent, step)
+            result = analysis_cache.get(key)
+            if result is not None:
+                result = dict(result, cached=True)
+            else:
+                result = screen_window(metric, recent, key)
+            if result is None:
+                try:
+                    context, env_info = await gather_context(recent, step)
+                except Exception as e:
+                    yield sse("error", {"error": str(e)})
+                    return
+                async for kind, payload in analyze_stream(metric, recent, context, env_info):
+                    if kind == "field":
+                        yield sse("field", {"key": payload[0], "value": payload[1]})
+                    else:
+                        result = payload
+                if not result.get("degraded"):
+                    analysis_cache.set(key, result)
+            result = dict(result, recent_points=recent_points)
+            if timing:
+                result["timing"] = telemetry.breakdown(timings, time.perf_counter() - t0)
+            yield sse("result", result)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
 @app.post("/alert")
 async def trigger_alert(metric: str = Query(DEFAULT_QUERY)):
+    """Analyze and enqueue the alert; delivery happens in the background, see /alerts/{id}"""
     # Reuse analyze logic
-    res = await analyze_metric(metric, step=RANGE_STEP, demo=0)
+    res = await run_analysis(metric, RANGE_STEP, demo=0, all_series=0, top_n=3)
     if "error" in res:
         return res
-        
-    # Format message based on LLM result
-    title = res.get("title", "告警分析")
-    level = res.get("level", "未知")
-    status = res.get("current_status", "")
-    baseline = res.get("baseline", "")
-    analysis = res.get("analysis", "")
-    action = res.get("action", "")
-    
-    msg = (
-        f"{title}\n"
-        f"级别: {level}\n"
-        f"状态: {status}\n"
-        f"分析: {analysis}\n"
-        f"建议: {action}"
-    )
-    
-    # Send alerts
-    sent_wecom = send_wecom(msg)
-    sent_ding = send_dingtalk(msg)
-    sent_email = send_email(f"AIOps Alert: {title}", msg)
-    
     return {
         "analysis": res,
-        "alerts_sent": {
-            "wecom": sent_wecom,
-            "dingtalk": sent_ding,
-            "email": sent_email
-        }
+        "alert": alert_dispatcher.submit(res, metric, res.get("labels"))
     }
+
+@app.get("/alerts/{alert_id}")
+def alert_status(alert_id: str):
+    return alert_dispatcher.status(alert_id)
+
+async def monitor_metric(metric: str, last_keys: Optional[Dict[str, str]]) -> Tuple[Optional[Dict[str, str]], bool]:
+    """One scheduler evaluation of every series the selector matches.
+
+    Series whose window is unchanged since the last evaluation are skipped;
+    the rest go through analyze_fleet (one batched search, pre-screen, LLM for
+    the suspicious ones) and each alerting analysis is submitted for its own
+    series. The state is the window key per series.
+    """
+    end_ts = int(time.time())
+    start_ts = end_ts - 3600 * 6  # Last 6 hours
+    series = [s for s in await fetch_range_series_async(metric, start_ts, end_ts, RANGE_STEP) if len(s)]
+    if not series:
+        return None, False
+    last_keys = last_keys or {}
+    keys = {fingerprint(labels_key(s.labels)): analysis_key(metric, s, RANGE_STEP) for s in series}
+    changed = [s for s, (sid, key) in zip(series, keys.items()) if last_keys.get(sid) != key]
+    if not changed:
+        return keys, False
+    result = await analyze_fleet(metric, changed, RANGE_STEP, top_n=len(changed))
+    for analysis in result["analyses"]:
+        if analysis.get("level") in MONITOR_ALERT_LEVELS:
+            alert_dispatcher.submit(analysis, metric, analysis["labels"])
+    return keys, True
+
+monitor = MonitorScheduler(
+    MONITOR_METRICS, monitor_metric,
+    interval=MONITOR_INTERVAL, jitter=MONITOR_JITTER,
+    concurrency=MONITOR_CONCURRENCY, tick_budget=MONITOR_TICK_BUDGET,
+)
+
+@app.get("/monitor")
+def monitor_status():
+    return dict(monitor.status(), enabled=MONITOR_ENABLED)
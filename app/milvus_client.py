@@ -1,10 +1,93 @@
-from typing import List, Tuple, Dict, Any
+import asyncio
+import contextvars
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Dict, Any, Union, Callable
 import numpy as np
 from pymilvus import connections, FieldSchema, CollectionSchema, DataType, Collection, utility
-from .config import MILVUS_HOST, MILVUS_PORT
+from .config import MILVUS_HOST, MILVUS_PORT, MILVUS_FLUSH_INTERVAL, MILVUS_HEALTH_INTERVAL, MILVUS_THREADS, MILVUS_STORE_PREVIEW
+from .config import MILVUS_INDEX_PROFILE, MILVUS_INDEX_PARAMS, MILVUS_SEARCH_PARAMS
+from .config import EMBEDDING_DIM
+from .embedding import embed
+from .telemetry import timed
+from .series import Series, as_series, labels_key, summarize_segments
 
 COLLECTION_NAME = "metrics_segments"
-DIM = 128
+DIM = EMBEDDING_DIM
+PREVIEW_MAX_LEN = 2048
+
+# Index profiles: build params for create_index and the matching search params.
+# milvus.index in config.yaml selects a profile and may override either side.
+INDEX_PROFILES: Dict[str, Dict[str, Any]] = {
+    # Exact search; best for small collections (up to ~100k vectors)
+    "FLAT": {"index": {}, "search": {}},
+    "IVF_FLAT": {"index": {"nlist": 1024}, "search": {"nprobe": 16}},
+    # IVF with 8-bit scalar quantization: ~4x less memory, slightly lower recall
+    "IVF_SQ8": {"index": {"nlist": 1024}, "search": {"nprobe": 16}},
+    # Graph index; lowest latency on large collections at the cost of memory and build time
+    "HNSW": {"index": {"M": 16, "efConstruction": 200}, "search": {"ef": 64}},
+}
+
+def index_params(profile: str = None, params: Dict[str, Any] = None) -> Dict[str, Any]:
+    profile = (profile or MILVUS_INDEX_PROFILE).upper()
+    if profile not in INDEX_PROFILES:
+        raise ValueError(f"Unknown index profile {profile}, expected one of {sorted(INDEX_PROFILES)}")
+    merged = dict(INDEX_PROFILES[profile]["index"])
+    if profile == (MILVUS_INDEX_PROFILE or "").upper():
+        merged.update(MILVUS_INDEX_PARAMS)
+    merged.update(params or {})
+    return {"index_type": profile, "metric_type": "L2", "params": merged}
+
+def search_params(profile: str = None, params: Dict[str, Any] = None) -> Dict[str, Any]:
+    profile = (profile or MILVUS_INDEX_PROFILE).upper()
+    merged = dict(INDEX_PROFILES.get(profile, {}).get("search", {}))
+    if profile == (MILVUS_INDEX_PROFILE or "").upper():
+        merged.update(MILVUS_SEARCH_PARAMS)
+    merged.update(params or {})
+    return {"metric_type": "L2", "params": merged}
+
+_index_types: Dict[str, str] = {}
+
+def index_type(col: Collection) -> str:
+    """Index type actually built on the vector field (may predate the configured profile)"""
+    found = _index_types.get(col.name)
+    if found is None:
+        found = MILVUS_INDEX_PROFILE.upper()
+        for idx in col.indexes:
+            if idx.field_name == "vector":
+                found = str(idx.params.get("index_type", found)).upper()
+        _index_types[col.name] = found
+    return found
+
+def suggest_profile(num_vectors: int) -> Dict[str, Any]:
+    """Rule-of-thumb starting point by collection size; confirm with bench/tune_index.py"""
+    if num_vectors < 100_000:
+        return index_params("FLAT", {})
+    if num_vectors < 5_000_000:
+        nlist = int(min(65536, max(128, 4 * num_vectors ** 0.5)))
+        return index_params("IVF_FLAT", {"nlist": nlist})
+    return index_params("HNSW", {})
+
+def has_field(col: Collection, name: str) -> bool:
+    return any(f.name == name for f in col.schema.fields)
+
+def _id(raw: str) -> int:
+    return int.from_bytes(hashlib.blake2b(raw.encode("utf-8"), digest_size=8).digest(), "big") & ((1 << 63) - 1)
+
+def segment_ids(metric_name: str, segments: List[Series]) -> List[int]:
+    """Stable 63-bit id per (metric, label set, segment start)"""
+    return [_id(f"{metric_name}|{json.dumps(labels_key(seg.labels), ensure_ascii=False)}|{int(seg.ts[0]) if len(seg) else 0}")
+            for seg in segments]
+
+def window_ids(metric_name: str, segments: List[Series], windows: List[Tuple[int, int, int]]) -> List[int]:
+    """Stable 63-bit id per (metric, label set, window size, window index, piece) of grid-cut
+    segments (see ingest.Segmenter); unlike segment_ids it does not depend on where the samples
+    fall, so re-cutting a window at another sampling phase replaces it"""
+    return [_id(f"{metric_name}|{json.dumps(labels_key(seg.labels), ensure_ascii=False)}|w{size}|{k}|{piece}")
+            for seg, (size, k, piece) in zip(segments, windows)]
 
 def connect():
     try:
@@ -16,60 +99,204 @@ def connect():
 def ensure_collection() -> Collection:
     if not utility.has_collection(COLLECTION_NAME):
         fields = [
-            FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
+            # Deterministic ids (see segment_ids) make re-ingesting a segment an idempotent upsert
+            FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=False),
             FieldSchema(name="metric_name", dtype=DataType.VARCHAR, max_length=256),
             FieldSchema(name="start_ts", dtype=DataType.INT64),
             FieldSchema(name="end_ts", dtype=DataType.INT64),
             FieldSchema(name="vector", dtype=DataType.FLOAT_VECTOR, dim=DIM),
         ]
+        if MILVUS_STORE_PREVIEW:
+            # Downsampled copy of the segment so /analyze can skip re-fetching neighbor windows
+            fields.append(FieldSchema(name="preview", dtype=DataType.VARCHAR, max_length=PREVIEW_MAX_LEN))
         schema = CollectionSchema(fields=fields, description="Prometheus metric segments")
         col = Collection(name=COLLECTION_NAME, schema=schema)
-        col.create_index(field_name="vector", index_params={"index_type": "IVF_FLAT", "metric_type": "L2", "params": {"nlist": 1024}})
+        col.create_index(field_name="vector", index_params=index_params())
         col.load()
         return col
     col = Collection(COLLECTION_NAME)
     col.load()
     return col
 
-def series_to_vector(points: List[Tuple[int, float]], dim: int = DIM) -> List[float]:
-    if not points:
-        return [0.0] * dim
-    points = sorted(points, key=lambda x: x[0])
-    xs = np.array([p[0] for p in points], dtype=np.float64)
-    ys = np.array([p[1] for p in points], dtype=np.float64)
-    if xs.max() == xs.min():
-        return [float(ys.mean())] * dim
-    xs = (xs - xs.min()) / (xs.max() - xs.min() + 1e-9)
-    target = np.linspace(0.0, 1.0, dim)
-    vec = np.interp(target, xs, ys)
-    mu = vec.mean()
-    sigma = vec.std() + 1e-9
-    vec = (vec - mu) / sigma
-    return vec.astype(np.float32).tolist()
-
-def insert_segments(metric_name: str, segments: List[List[Tuple[int, float]]]) -> int:
-    connect()
-    col = ensure_collection()
+class MilvusManager:
+    """Long-lived Milvus connection and loaded collection handle shared across requests.
+
+    The connection is health-checked at most every `health_interval` seconds and
+    re-established only when the check (or an operation) fails. Inserts mark the
+    collection dirty and a background thread flushes it every `flush_interval`
+    seconds instead of flushing after every insert.
+    """
+
+    def __init__(self, flush_interval: float = MILVUS_FLUSH_INTERVAL, health_interval: float = MILVUS_HEALTH_INTERVAL):
+        self.flush_interval = flush_interval
+        self.health_interval = health_interval
+        self._lock = threading.Lock()
+        self._col = None
+        self._checked_at = 0.0
+        self._dirty = False
+        self._stop = threading.Event()
+        self._flusher = None
+
+    def start(self):
+        try:
+            self.collection()
+        except Exception as e:
+            print(f"Milvus warmup failed: {e}")
+        if self._flusher is None and self.flush_interval > 0:
+            self._stop.clear()
+            self._flusher = threading.Thread(target=self._flush_loop, name="milvus-flush", daemon=True)
+            self._flusher.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=5)
+            self._flusher = None
+        self.flush()
+
+    def _healthy(self) -> bool:
+        try:
+            utility.get_server_version()
+            return True
+        except Exception:
+            return False
+
+    def collection(self) -> Collection:
+        with self._lock:
+            now = time.time()
+            if self._col is not None:
+                if now - self._checked_at < self.health_interval or self._healthy():
+                    self._checked_at = now
+                    return self._col
+            connect()
+            self._col = ensure_collection()
+            self._checked_at = now
+            return self._col
+
+    def invalidate(self):
+        with self._lock:
+            self._col = None
+
+    def run(self, fn: Callable[[Collection], Any]) -> Any:
+        """Run fn against the cached collection, reconnecting once if it fails"""
+        try:
+            return fn(self.collection())
+        except Exception:
+            self.invalidate()
+            return fn(self.collection())
+
+    def mark_dirty(self):
+        self._dirty = True
+
+    def flush(self):
+        if not self._dirty or self._col is None:
+            return
+        self._dirty = False
+        try:
+            self._col.flush()
+        except Exception as e:
+            self._dirty = True
+            print(f"Milvus flush failed: {e}")
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+manager = MilvusManager()
+
+# pymilvus is blocking; async callers run it here so the event loop stays free
+# and at most MILVUS_THREADS calls hit Milvus at once.
+_executor = ThreadPoolExecutor(max_workers=MILVUS_THREADS, thread_name_prefix="milvus")
+
+async def run_blocking(fn: Callable, *args, **kwargs) -> Any:
+    loop = asyncio.get_running_loop()
+    # Carry the caller's context into the thread so its spans land in the request's timing breakdown
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, lambda: ctx.run(fn, *args, **kwargs))
+
+def executor_backlog() -> int:
+    """Calls waiting for a free MILVUS_THREADS slot"""
+    return _executor._work_queue.qsize()
+
+def pack_segments(segments: List[Union[Series, List[Tuple[int, float]]]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Concatenate segments into one ragged buffer: (ts, vals, offsets), segment i = [offsets[i], offsets[i+1])"""
+    segments = [as_series(seg) for seg in segments]
+    offsets = np.zeros(len(segments) + 1, dtype=np.int64)
+    np.cumsum([len(seg) for seg in segments], out=offsets[1:])
     if not segments:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64), offsets
+    ts = np.concatenate([seg.ts for seg in segments])
+    vals = np.concatenate([seg.vals for seg in segments])
+    return ts, vals, offsets
+
+@timed("series_to_vectors")
+def series_to_vectors(ts: np.ndarray, vals: np.ndarray, offsets: np.ndarray, dim: int = DIM) -> np.ndarray:
+    """Embed N time-sorted segments of a ragged buffer with the configured method; float32 (N, dim)"""
+    return embed(ts, vals, offsets, dim)
+
+def series_to_vector(points: Union[Series, List[Tuple[int, float]]], dim: int = DIM) -> List[float]:
+    ts, vals, offsets = pack_segments([points])
+    return series_to_vectors(ts, vals, offsets, dim)[0].tolist()
+
+def prepare_segments(metric_name: str, segments: List[Union[Series, List[Tuple[int, float]]]], ids: List[int] = None) -> Dict[str, Any]:
+    """Columns shared by every vector store: ids (segment_ids unless given), time ranges, vectors and JSON previews"""
+    segments = [as_series(seg) for seg in segments]
+    ts, vals, offsets = pack_segments(segments)
+    return {
+        "metric_name": metric_name,
+        "ids": segment_ids(metric_name, segments) if ids is None else ids,
+        "start_ts": [int(ts[i]) if j > i else 0 for i, j in zip(offsets[:-1], offsets[1:])],
+        "end_ts": [int(ts[j - 1]) if j > i else 0 for i, j in zip(offsets[:-1], offsets[1:])],
+        "vectors": series_to_vectors(ts, vals, offsets),
+        "previews": [json.dumps(p, separators=(",", ":"))[:PREVIEW_MAX_LEN] for p in summarize_segments(ts, vals, offsets)],
+    }
+
+def insert_prepared(batch: Dict[str, Any]) -> int:
+    n = len(batch["ids"])
+    if n == 0:
         return 0
-    vectors = [series_to_vector(seg) for seg in segments]
-    start_ts = [seg[0][0] if seg else 0 for seg in segments]
-    end_ts = [seg[-1][0] if seg else 0 for seg in segments]
-    metric_names = [metric_name] * len(segments)
-    col.insert([metric_names, start_ts, end_ts, vectors])
-    col.flush()
-    return len(segments)
-
-def search_similar(vector: List[float], top_k: int = 5) -> List[Dict[str, Any]]:
-    connect()
-    col = ensure_collection()
-    res = col.search(data=[vector], anns_field="vector", param={"metric_type": "L2", "params": {"nprobe": 16}}, limit=top_k, output_fields=["metric_name", "start_ts", "end_ts"])
-    hits = []
-    for h in res[0]:
-        hits.append({
-            "metric_name": h.entity.get("metric_name"),
-            "start_ts": h.entity.get("start_ts"),
-            "end_ts": h.entity.get("end_ts"),
-            "distance": float(h.distance)
-        })
-    return hits
+
+    def insert(col: Collection):
+        data = [[batch["metric_name"]] * n, batch["start_ts"], batch["end_ts"], batch["vectors"]]
+        if has_field(col, "preview"):
+            data.append(batch["previews"])
+        if col.schema.primary_field.auto_id:
+            # Collections created before deterministic ids cannot deduplicate re-ingested segments
+            return col.insert(data)
+        return col.upsert([batch["ids"]] + data)
+
+    manager.run(insert)
+    manager.mark_dirty()
+    return n
+
+def search_similar_batch(vectors: Union[np.ndarray, List[List[float]]], top_k: int = 5) -> List[List[Dict[str, Any]]]:
+    """One Milvus search for many query vectors; returns one hit list per vector"""
+    if len(vectors) == 0:
+        return []
+
+    def search(col: Collection):
+        output_fields = ["metric_name", "start_ts", "end_ts"]
+        if has_field(col, "preview"):
+            output_fields.append("preview")
+        return col.search(data=list(vectors), anns_field="vector", param=search_params(index_type(col)), limit=top_k, output_fields=output_fields)
+
+    res = manager.run(search)
+    out = []
+    for per_query in res:
+        hits = []
+        for h in per_query:
+            hit = {
+                "metric_name": h.entity.get("metric_name"),
+                "start_ts": h.entity.get("start_ts"),
+                "end_ts": h.entity.get("end_ts"),
+                "distance": float(h.distance)
+            }
+            preview = h.entity.get("preview")
+            if preview:
+                try:
+                    hit["summary"] = json.loads(preview)
+                except ValueError:
+                    pass
+            hits.append(hit)
+        out.append(hits)
+    return out
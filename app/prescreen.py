@@ -0,0 +1,123 @@
+from typing import Dict, Any
+import numpy as np
+from .config import (
+    PRESCREEN_RECENT_POINTS, PRESCREEN_ROBUST_Z,
+    PRESCREEN_EWMA_ALPHA, PRESCREEN_EWMA_Z, PRESCREEN_CUSUM_H
+)
+from .series import Series
+
+MIN_POINTS = 12
+CUSUM_K = 0.5
+SCORE_CAP = 1000.0
+
+# How many analyses were screened, answered statistically, or escalated to the LLM
+stats = {"screened": 0, "skipped": 0, "escalated": 0}
+
+def _robust_center_scale(a: np.ndarray):
+    med = float(np.median(a))
+    dev = np.abs(a - med)
+    scale = 1.4826 * float(np.median(dev))
+    if scale == 0:
+        # More than half the samples are identical; fall back to the mean deviation
+        scale = 1.2533 * float(dev.mean())
+    return med, scale
+
+def robust_z(vals: np.ndarray, recent_n: int) -> float:
+    """Largest |robust z| of the last `recent_n` points against the rest of the window (median/MAD)"""
+    base = vals[:-recent_n] if len(vals) > 2 * recent_n else vals
+    med, scale = _robust_center_scale(base)
+    dev = np.abs(vals[-recent_n:] - med)
+    if scale == 0:
+        return float("inf") if dev.max() > 0 else 0.0
+    return float(dev.max() / scale)
+
+def ewma_z(vals: np.ndarray, alpha: float) -> float:
+    """|z| of the last one-step EWMA forecast error, scaled by the robust spread of the earlier errors"""
+    forecast = np.empty(len(vals))
+    mean = float(vals[0])
+    for i, x in enumerate(vals.tolist()):
+        forecast[i] = mean
+        mean += alpha * (x - mean)
+    resid = (vals - forecast)[1:]
+    med, scale = _robust_center_scale(resid[:-1])
+    dev = abs(float(resid[-1]) - med)
+    if scale == 0:
+        return float("inf") if dev > 0 else 0.0
+    return dev / scale
+
+def cusum(vals: np.ndarray) -> float:
+    """Peak two-sided CUSUM statistic of the detrended, robust-standardized window (level-shift detector).
+
+    Metrics are strongly autocorrelated, so the statistic is deflated by the
+    AR(1) variance inflation factor to keep the false-alarm rate near the iid one.
+    """
+    x = np.arange(len(vals), dtype=np.float64)
+    vals = vals - np.polyval(np.polyfit(x, vals, 1), x)
+    med, scale = _robust_center_scale(vals)
+    if scale == 0:
+        return 0.0
+    z = (vals - med) / scale
+    rho = float(np.corrcoef(z[:-1], z[1:])[0, 1]) if z.std() > 0 else 0.0
+    rho = min(max(rho, 0.0), 0.95) if np.isfinite(rho) else 0.0
+    z = z / np.sqrt((1 + rho) / (1 - rho))
+    peak = 0.0
+    for x in (z - CUSUM_K, -z - CUSUM_K):
+        # S_t = max(0, S_{t-1} + x_t) == C_t - min(0, min_{j<=t} C_j) with C the running sum
+        c = np.cumsum(x)
+        s = c - np.minimum(np.minimum.accumulate(c), 0.0)
+        peak = max(peak, float(s.max()))
+    return peak
+
+def prescreen(series: Series) -> Dict[str, Any]:
+    """Cheap statistical checks over the recent window.
+
+    Returns {"suspicious": bool, "reasons": [...], "score": float, "checks": {...}};
+    only suspicious windows need the LLM.
+    """
+    stats["screened"] += 1
+    vals = series.vals[np.isfinite(series.vals)]
+    if len(vals) < MIN_POINTS:
+        stats["escalated"] += 1
+        return {"suspicious": True, "reasons": ["insufficient_data"], "score": 1.0, "checks": {"points": int(len(vals))}}
+
+    recent_n = max(1, min(PRESCREEN_RECENT_POINTS, len(vals) // 4))
+    checks = {
+        "robust_z": robust_z(vals, recent_n),
+        "ewma_z": ewma_z(vals, PRESCREEN_EWMA_ALPHA),
+        "cusum": cusum(vals),
+    }
+    limits = {"robust_z": PRESCREEN_ROBUST_Z, "ewma_z": PRESCREEN_EWMA_Z, "cusum": PRESCREEN_CUSUM_H}
+    reasons = [name for name, v in checks.items() if v > limits[name]]
+    # Anomaly score: worst check relative to its threshold (> 1 means suspicious)
+    score = min(max(v / limits[name] for name, v in checks.items()), SCORE_CAP)
+    if reasons:
+        stats["escalated"] += 1
+    else:
+        stats["skipped"] += 1
+    return {
+        "suspicious": bool(reasons),
+        "reasons": reasons,
+        "score": round(score, 3),
+        "checks": {k: (round(v, 3) if np.isfinite(v) else None) for k, v in checks.items()},
+    }
+
+def verdict(metric_name: str, series: Series, screen: Dict[str, Any]) -> Dict[str, Any]:
+    """Analysis result for a window the pre-screen found unremarkable, in the LLM result shape"""
+    a = series.vals[np.isfinite(series.vals)]
+    diff = float(a[-1] - a[0])
+    trend = "上涨" if diff > 0.05 else "下降" if diff < -0.05 else "稳定"
+    checks = screen["checks"]
+    return {
+        "title": f"【正常】{metric_name} 统计预筛",
+        "current_status": f"当前值 {a[-1]:.2f}, 趋势 {trend}",
+        "baseline": f"中位数 {float(np.median(a)):.2f}",
+        "level": "正常",
+        "prediction": "短期内预计保持平稳",
+        "analysis": (
+            f"统计预筛未发现异常 (稳健Z {checks['robust_z']}, EWMA偏离 {checks['ewma_z']}, "
+            f"CUSUM {checks['cusum']})，未调用LLM。"
+        ),
+        "action": "无需处理",
+        "thought": "统计预筛判定窗口平稳，跳过LLM分析",
+        "prescreen": screen,
+    }
@@ -1,7 +1,56 @@
+import asyncio
 import time
-from typing import List, Dict, Any, Tuple
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Tuple, Iterator
+import httpx
 import requests
-from .config import PROMETHEUS_URL
+from requests.adapters import HTTPAdapter
+from .series import Series, from_columnar, to_columnar
+from .range_cache import range_cache
+from .telemetry import timed, ERRORS
+from .config import PROMETHEUS_URL, FETCH_CONCURRENCY, FETCH_RETRIES, FETCH_BACKOFF, FETCH_CHUNK_POINTS
+
+_session = None
+_async_client = None
+_fetch_pool = None
+_init_lock = threading.Lock()
+
+def get_session() -> requests.Session:
+    """Shared keep-alive session, pooled for up to FETCH_CONCURRENCY parallel requests"""
+    global _session
+    if _session is None:
+        with _init_lock:
+            if _session is None:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(FETCH_CONCURRENCY, 10))
+                s.mount("http://", adapter)
+                s.mount("https://", adapter)
+                _session = s
+    return _session
+
+def get_async_client() -> httpx.AsyncClient:
+    """Shared keep-alive async client for the request path (analyze/alert)"""
+    global _async_client
+    if _async_client is None:
+        limits = httpx.Limits(max_connections=max(FETCH_CONCURRENCY, 10) * 4, max_keepalive_connections=max(FETCH_CONCURRENCY, 10))
+        _async_client = httpx.AsyncClient(base_url=PROMETHEUS_URL, limits=limits)
+    return _async_client
+
+async def aclose():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+def get_fetch_pool() -> ThreadPoolExecutor:
+    global _fetch_pool
+    if _fetch_pool is None:
+        with _init_lock:
+            if _fetch_pool is None:
+                _fetch_pool = ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY, thread_name_prefix="prom-fetch")
+    return _fetch_pool
 
 def parse_step(step: str) -> int:
     unit = step[-1]
@@ -14,84 +63,216 @@ def parse_step(step: str) -> int:
     if unit == 'd': return val * 86400
     return val
 
-def fetch_range(query: str, start_ts: int, end_ts: int, step: str) -> Dict[str, Any]:
-    step_sec = parse_step(step)
-    # Estimate points. If > 10000, chunk it. 
-    # Prometheus often limits to 11000 points per series.
+def _retryable(e: Exception) -> bool:
+    # Bad queries (4xx) will not get better on retry; throttling and server errors might.
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        code = e.response.status_code
+        return code == 429 or code >= 500
+    return isinstance(e, (requests.ConnectionError, requests.Timeout))
+
+def prom_get(path: str, params: Dict[str, Any] = None, timeout: int = 60) -> Dict[str, Any]:
+    """GET a Prometheus API path through the shared session, retrying with exponential backoff"""
+    url = f"{PROMETHEUS_URL}{path}"
+    attempt = 0
+    while True:
+        try:
+            r = get_session().get(url, params=params, timeout=timeout)
+            r.raise_for_status()
+            return r.json()
+        except Exception as e:
+            if attempt >= FETCH_RETRIES or not _retryable(e):
+                raise
+            time.sleep(FETCH_BACKOFF * (2 ** attempt))
+            attempt += 1
+
+def _retryable_async(e: Exception) -> bool:
+    if isinstance(e, httpx.HTTPStatusError):
+        code = e.response.status_code
+        return code == 429 or code >= 500
+    return isinstance(e, httpx.TransportError)
+
+async def prom_get_async(path: str, params: Dict[str, Any] = None, timeout: int = 60) -> Dict[str, Any]:
+    """Non-blocking prom_get() on the shared async client"""
+    attempt = 0
+    while True:
+        try:
+            r = await get_async_client().get(path, params=params, timeout=timeout)
+            r.raise_for_status()
+            return r.json()
+        except Exception as e:
+            if attempt >= FETCH_RETRIES or not _retryable_async(e):
+                raise
+            await asyncio.sleep(FETCH_BACKOFF * (2 ** attempt))
+            attempt += 1
+
+def plan_chunks(start_ts: int, end_ts: int, step_sec: int) -> List[Tuple[int, int]]:
+    # Prometheus often limits to 11000 points per series, so split the range
+    # into step-aligned chunks of at most FETCH_CHUNK_POINTS points.
     total_points = (end_ts - start_ts) / step_sec
-    
-    if total_points <= 10000:
-        params = {"query": query, "start": start_ts, "end": end_ts, "step": step}
-        r = requests.get(f"{PROMETHEUS_URL}/api/v1/query_range", params=params, timeout=60)
-        r.raise_for_status()
-        return r.json()
-    
-    # Chunking logic
-    chunk_size = 10000 * step_sec
-    # Align chunk_size to step to keep grid consistent (optional but good)
-    chunk_size = (chunk_size // step_sec) * step_sec
-    
-    combined_results = {}
-    
+    if total_points <= FETCH_CHUNK_POINTS:
+        return [(start_ts, end_ts)]
+    chunk_size = FETCH_CHUNK_POINTS * step_sec
+    chunks = []
     curr = start_ts
     while curr < end_ts:
         next_ts = min(curr + chunk_size, end_ts)
-        params = {"query": query, "start": curr, "end": next_ts, "step": step}
-        try:
-            r = requests.get(f"{PROMETHEUS_URL}/api/v1/query_range", params=params, timeout=60)
-            r.raise_for_status()
-            data = r.json().get("data", {}).get("result", [])
-            
-            for item in data:
-                # Create a unique key for the metric
-                metric = item.get("metric", {})
-                # Sort keys to ensure stable string representation
-                key = str(sorted(metric.items()))
-                
-                if key not in combined_results:
-                    combined_results[key] = item
-                else:
-                    # Merge values
-                    existing = combined_results[key].get("values", [])
-                    new_vals = item.get("values", [])
-                    # Simple deduplication based on timestamp (first element)
-                    if existing and new_vals:
-                        last_ts = existing[-1][0]
-                        for v in new_vals:
-                            if v[0] > last_ts:
-                                existing.append(v)
-                    elif new_vals:
-                         combined_results[key]["values"] = new_vals
-                         
-        except Exception as e:
-            print(f"Error fetching chunk {curr}-{next_ts}: {e}")
-            # Continue to next chunk to get partial data at least
-        
-        # Advance current time. 
-        # To avoid overlap issues, we could start next from next_ts + step_sec
-        # But simply using next_ts is safer if we handle deduplication.
+        chunks.append((curr, next_ts))
+        # Adjacent chunks share their boundary sample; merge_chunks deduplicates it.
         curr = next_ts
-        
+    return chunks
+
+def merge_chunks(chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Merge query_range responses per series, ordered and deduplicated by timestamp.
+
+    Chunks may be given in any order (e.g. completion order of parallel fetches).
+    """
+    combined: Dict[Any, Dict[str, Any]] = {}
+    samples: Dict[Any, Dict[float, Any]] = {}
+    for res in chunks:
+        for item in res.get("data", {}).get("result", []):
+            metric = item.get("metric", {})
+            # Sort keys to ensure stable identity of the label set
+            key = tuple(sorted(metric.items()))
+            if key not in combined:
+                combined[key] = {"metric": metric}
+                samples[key] = {}
+            by_ts = samples[key]
+            for v in item.get("values", []):
+                by_ts[v[0]] = v
+    result = []
+    for key, item in combined.items():
+        by_ts = samples[key]
+        item["values"] = [by_ts[ts] for ts in sorted(by_ts)]
+        result.append(item)
     return {
-        "status": "success", 
+        "status": "success",
         "data": {
             "resultType": "matrix",
-            "result": list(combined_results.values())
+            "result": result
         }
     }
 
+def _fetch_chunk(query: str, start_ts: int, end_ts: int, step: str) -> Dict[str, Any]:
+    params = {"query": query, "start": start_ts, "end": end_ts, "step": step}
+    return prom_get("/api/v1/query_range", params=params, timeout=60)
+
+def _fetch_range(query: str, start_ts: int, end_ts: int, step: str) -> Tuple[Dict[str, Any], bool]:
+    """(response, complete); complete is False when some chunks failed and only partial data came back"""
+    step_sec = parse_step(step)
+    chunks = plan_chunks(start_ts, end_ts, step_sec)
+    if len(chunks) == 1:
+        return _fetch_chunk(query, start_ts, end_ts, step), True
+
+    # Fetch chunks in parallel on the shared pool; wall-clock time scales with
+    # FETCH_CONCURRENCY rather than with the number of chunks.
+    pool = get_fetch_pool()
+    futures = {pool.submit(_fetch_chunk, query, s, e, step): (s, e) for s, e in chunks}
+    results = []
+    for fut in as_completed(futures):
+        s, e = futures[fut]
+        try:
+            results.append(fut.result())
+        except Exception as ex:
+            print(f"Error fetching chunk {s}-{e}: {ex}")
+            ERRORS.inc(component="prometheus")
+            # Continue with the other chunks to get partial data at least
+    return merge_chunks(results), len(results) == len(chunks)
+
+async def _fetch_range_async(query: str, start_ts: int, end_ts: int, step: str) -> Tuple[Dict[str, Any], bool]:
+    chunks = plan_chunks(start_ts, end_ts, parse_step(step))
+    if len(chunks) == 1:
+        params = {"query": query, "start": start_ts, "end": end_ts, "step": step}
+        return await prom_get_async("/api/v1/query_range", params=params, timeout=60), True
+
+    sem = asyncio.Semaphore(FETCH_CONCURRENCY)
+
+    async def fetch_chunk(s: int, e: int) -> Dict[str, Any]:
+        async with sem:
+            params = {"query": query, "start": s, "end": e, "step": step}
+            return await prom_get_async("/api/v1/query_range", params=params, timeout=60)
+
+    done = await asyncio.gather(*(fetch_chunk(s, e) for s, e in chunks), return_exceptions=True)
+    results = []
+    for (s, e), res in zip(chunks, done):
+        if isinstance(res, Exception):
+            print(f"Error fetching chunk {s}-{e}: {res}")
+            ERRORS.inc(component="prometheus")
+            continue
+        results.append(res)
+    return merge_chunks(results), len(results) == len(chunks)
+
+@timed("fetch_range")
+def fetch_range_series(query: str, start_ts: int, end_ts: int, step: str) -> List[Series]:
+    """query_range over [start_ts, end_ts] as columnar series, through the range cache when it
+    is enabled (timestamps then fall on multiples of step, see RangeCache)"""
+    plan = range_cache.plan(query, start_ts, end_ts, parse_step(step)) if range_cache is not None else None
+    if plan is None:
+        return to_columnar(_fetch_range(query, start_ts, end_ts, step)[0])
+    fetched = []
+    for s, e in plan.missing:
+        res, complete = _fetch_range(query, s, e, step)
+        fetched.append((s, e, to_columnar(res), complete))
+    return range_cache.complete(plan, fetched)
+
+@timed("fetch_range")
+async def fetch_range_series_async(query: str, start_ts: int, end_ts: int, step: str) -> List[Series]:
+    plan = range_cache.plan(query, start_ts, end_ts, parse_step(step)) if range_cache is not None else None
+    if plan is None:
+        return to_columnar((await _fetch_range_async(query, start_ts, end_ts, step))[0])
+    done = await asyncio.gather(*(_fetch_range_async(query, s, e, step) for s, e in plan.missing))
+    fetched = [(s, e, to_columnar(res), complete) for (s, e), (res, complete) in zip(plan.missing, done)]
+    return range_cache.complete(plan, fetched)
+
+def fetch_range(query: str, start_ts: int, end_ts: int, step: str) -> Dict[str, Any]:
+    """query_range response view over fetch_range_series(); prefer that on hot paths"""
+    return from_columnar(fetch_range_series(query, start_ts, end_ts, step))
+
+def iter_range_chunks(query: str, start_ts: int, end_ts: int, step: str, prefetch: int = FETCH_CONCURRENCY,
+                      errors: List[Tuple[int, int, str]] = None) -> Iterator[Dict[str, Any]]:
+    """Yield query_range responses chunk by chunk, in time order.
+
+    At most `prefetch` chunks are in flight, so a slow consumer throttles fetching
+    and memory stays bounded by the prefetch depth instead of the whole range.
+    Bypasses the range cache: an ingest reads each range once and would only
+    evict the windows that analyses reuse.
+
+    A failed chunk is skipped and appended to `errors` as (start, end, error);
+    if every chunk failed, the last error is raised.
+    """
+    chunks = plan_chunks(start_ts, end_ts, parse_step(step))
+    pool = get_fetch_pool()
+    pending = deque()
+    next_idx = 0
+    fetched = 0
+    last_error = None
+    while pending or next_idx < len(chunks):
+        while next_idx < len(chunks) and len(pending) < max(1, prefetch):
+            s, e = chunks[next_idx]
+            pending.append((s, e, pool.submit(_fetch_chunk, query, s, e, step)))
+            next_idx += 1
+        s, e, fut = pending.popleft()
+        try:
+            res = fut.result()
+        except Exception as ex:
+            print(f"Error fetching chunk {s}-{e}: {ex}")
+            ERRORS.inc(component="prometheus")
+            last_error = ex
+            if errors is not None:
+                errors.append((s, e, str(ex)))
+            continue
+        fetched += 1
+        yield res
+    if fetched == 0 and last_error is not None:
+        raise last_error
+
 def fetch_instant(query: str) -> Dict[str, Any]:
     params = {"query": query, "time": int(time.time())}
-    r = requests.get(f"{PROMETHEUS_URL}/api/v1/query", params=params, timeout=15)
-    r.raise_for_status()
-    return r.json()
+    return prom_get("/api/v1/query", params=params, timeout=15)
 
-def fetch_targets() -> List[Dict[str, Any]]:
-    """Fetch all active targets from Prometheus"""
+def fetch_targets(strict: bool = False) -> List[Dict[str, Any]]:
+    """Fetch all active targets from Prometheus; strict=True raises instead of returning []"""
     try:
-        r = requests.get(f"{PROMETHEUS_URL}/api/v1/targets", timeout=15)
-        r.raise_for_status()
-        data = r.json().get("data", {}).get("activeTargets", [])
+        data = prom_get("/api/v1/targets", timeout=15).get("data", {}).get("activeTargets", [])
         return [
             {
                 "instance": t.get("labels", {}).get("instance"),
@@ -103,9 +284,16 @@ def fetch_targets() -> List[Dict[str, Any]]:
             for t in data
         ]
     except Exception as e:
+        if strict:
+            raise
         print(f"Error fetching targets: {e}")
         return []
 
+def fetch_all_metric_names(instance: str = None) -> List[str]:
+    """Every metric name Prometheus knows, optionally only those with the given instance label; raises on errors"""
+    params = {"match[]": f'{{instance="{instance}"}}'} if instance else None
+    return prom_get("/api/v1/label/__name__/values", params=params, timeout=30).get("data", [])
+
 def fetch_metric_names(instance: str = None) -> List[str]:
     """Fetch metric names, optionally filtered by instance"""
     try:
@@ -115,9 +303,7 @@ def fetch_metric_names(instance: str = None) -> List[str]:
             # Using /api/v1/series is better but might be heavy.
             # Alternative: /api/v1/label/__name__/values?match[]={instance="xxx"}
             params = {"match[]": f'{{instance="{instance}"}}'}
-            r = requests.get(f"{PROMETHEUS_URL}/api/v1/label/__name__/values", params=params, timeout=15)
-            r.raise_for_status()
-            return r.json().get("data", [])
+            return prom_get("/api/v1/label/__name__/values", params=params, timeout=15).get("data", [])
         
         # Default common metrics
         return [
@@ -139,21 +325,5 @@ def fetch_metric_names(instance: str = None) -> List[str]:
         return []
 
 def to_series(result: Dict[str, Any]) -> List[Tuple[Dict[str, str], List[Tuple[int, float]]]]:
-    data = result.get("data", {}).get("result", [])
-    series = []
-    for item in data:
-        metric = item.get("metric", {})
-        values = item.get("values", []) or item.get("value", [])
-        points = []
-        for v in values:
-            if isinstance(v, list) and len(v) >= 2:
-                ts = int(float(v[0]))
-                val = float(v[1])
-                points.append((ts, val))
-            elif isinstance(values, list) and len(values) == 2:
-                ts = int(float(values[0]))
-                val = float(values[1])
-                points.append((ts, val))
-                break
-        series.append((metric, points))
-    return series
+    """Tuple-list view over to_columnar(); prefer to_columnar() on hot paths"""
+    return [(s.labels, s.points) for s in to_columnar(result)]
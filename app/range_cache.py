@@ -0,0 +1,201 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from .series import Series, labels_key, n_unsorted
+from .config import (
+    RANGE_CACHE_ENABLED, RANGE_CACHE_BLOCK_POINTS, RANGE_CACHE_MAX_POINTS,
+    RANGE_CACHE_HISTORY_TTL, RANGE_CACHE_RECENT_TTL, RANGE_CACHE_SETTLE
+)
+
+class Block:
+    """Samples of one (query, step) in [start, start + span), final from `lo` to `hi` inclusive.
+
+    Never modified after creation: a store builds a new block, so a plan that
+    still holds the old one reads a consistent copy.
+    """
+
+    __slots__ = ("lo", "hi", "series", "points", "expires")
+
+    def __init__(self, lo: int, hi: int, series: Dict[Tuple, Tuple[Dict[str, str], np.ndarray, np.ndarray]], expires: float):
+        self.lo = lo
+        self.hi = hi
+        self.series = series
+        self.points = sum(len(ts) for _, ts, _ in series.values())
+        self.expires = expires
+
+def _clip(ts: np.ndarray, vals: np.ndarray, lo: int, hi: int) -> Tuple[np.ndarray, np.ndarray]:
+    i, j = np.searchsorted(ts, [lo, hi + 1])
+    return ts[i:j], vals[i:j]
+
+def _concat(parts: List[Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+    ts = np.concatenate([p[0] for p in parts])
+    vals = np.concatenate([p[1] for p in parts])
+    if n_unsorted(ts):
+        order = np.argsort(ts, kind="stable")
+        ts, vals = ts[order], vals[order]
+    return ts, vals
+
+class Plan:
+    """What one fetch_range call can take from the cache and which ranges it still has to fetch"""
+
+    __slots__ = ("query", "step", "start", "end", "cached", "missing")
+
+    def __init__(self, query: str, step: int, start: int, end: int):
+        self.query = query
+        self.step = step
+        self.start = start
+        self.end = end
+        self.cached: List[Tuple[Block, int, int]] = []  # (block, from, to) served from memory
+        self.missing: List[Tuple[int, int]] = []
+
+class RangeCache:
+    """Step-aligned query_range results, stitched from fixed-size time blocks.
+
+    Requests are aligned to the step (start rounded up, end down, the same
+    grid Grafana uses) and split into blocks of `block_points` steps per
+    (query, step). Cached blocks are served from memory and only the ranges
+    no block covers are fetched, which for a sliding "last N hours" window is
+    just the newest minutes. Samples younger than `settle` seconds may still
+    change (late scrapes, rate() windows) and are never stored, so they are
+    fetched again next time.
+
+    A fully covered block older than `settle` is immutable and kept for
+    `history_ttl`; the head block, still filling up, for `recent_ttl`.
+    Memory is bounded by `max_points` samples across all blocks, evicting the
+    least recently used block first. The cache is per process; Prometheus
+    answers the same range for every worker anyway.
+    """
+
+    def __init__(self, block_points: int = RANGE_CACHE_BLOCK_POINTS, max_points: int = RANGE_CACHE_MAX_POINTS,
+                 history_ttl: float = RANGE_CACHE_HISTORY_TTL, recent_ttl: float = RANGE_CACHE_RECENT_TTL, settle: float = RANGE_CACHE_SETTLE):
+        self.block_points = max(1, block_points)
+        self.max_points = max_points
+        self.history_ttl = history_ttl
+        self.recent_ttl = recent_ttl
+        self.settle = settle
+        self._blocks: "OrderedDict[Tuple[str, int, int], Block]" = OrderedDict()
+        self._points = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "partial": 0, "misses": 0, "cached_points": 0, "fetched_points": 0, "evictions": 0}
+
+    def plan(self, query: str, start_ts: int, end_ts: int, step: int) -> Optional[Plan]:
+        """None when the aligned range is empty; the caller then asks Prometheus directly"""
+        start = -(-int(start_ts) // step) * step
+        end = int(end_ts) // step * step
+        if step <= 0 or start > end:
+            return None
+        plan = Plan(query, step, start, end)
+        span = self.block_points * step
+        now = time.time()
+        with self._lock:
+            for bstart in range(start // span * span, end + 1, span):
+                lo, hi = max(start, bstart), min(end, bstart + span - step)
+                key = (query, step, bstart)
+                block = self._blocks.get(key)
+                if block is not None and block.expires < now:
+                    self._drop(key)
+                    block = None
+                if block is not None and block.lo <= lo and block.hi >= lo:
+                    self._blocks.move_to_end(key)
+                    plan.cached.append((block, lo, min(hi, block.hi)))
+                    lo = block.hi + step
+                if lo <= hi:
+                    if plan.missing and plan.missing[-1][1] + step == lo:
+                        plan.missing[-1] = (plan.missing[-1][0], hi)
+                    else:
+                        plan.missing.append((lo, hi))
+            if not plan.missing:
+                self.stats["hits"] += 1
+            elif plan.cached:
+                self.stats["partial"] += 1
+            else:
+                self.stats["misses"] += 1
+        return plan
+
+    def complete(self, plan: Plan, fetched: List[Tuple[int, int, List[Series], bool]]) -> List[Series]:
+        """Stitch the cached blocks and the fetched ranges ((start, end, series, complete) per
+        plan.missing entry) into the series of the whole range; complete ranges are stored"""
+        parts: Dict[Tuple, Tuple[Dict[str, str], List[Tuple[np.ndarray, np.ndarray]]]] = {}
+        cached_points = 0
+        for block, lo, hi in plan.cached:
+            for key, (metric, ts, vals) in block.series.items():
+                part = _clip(ts, vals, lo, hi)
+                if len(part[0]):
+                    parts.setdefault(key, (metric, []))[1].append(part)
+                    cached_points += len(part[0])
+        fetched_points = 0
+        now = time.time()
+        for lo, hi, series, complete in fetched:
+            for s in series:
+                part = _clip(s.ts, s.vals, lo, hi)
+                if len(part[0]):
+                    parts.setdefault(labels_key(s.labels), (s.labels, []))[1].append(part)
+                    fetched_points += len(part[0])
+            if complete:
+                self._store(plan.query, plan.step, lo, hi, series, now)
+        self.stats["cached_points"] += cached_points
+        self.stats["fetched_points"] += fetched_points
+
+        # Prometheus returns range query series sorted by label set
+        result = []
+        for key in sorted(parts):
+            metric, chunks = parts[key]
+            result.append(Series(metric, *_concat(chunks)))
+        return result
+
+    def _store(self, query: str, step: int, lo: int, hi: int, series: List[Series], now: float):
+        # Only samples older than `settle` are final
+        hi = min(hi, int(now - self.settle) // step * step)
+        if hi < lo or self.max_points <= 0:
+            return
+        span = self.block_points * step
+        with self._lock:
+            for bstart in range(lo // span * span, hi + 1, span):
+                bend = bstart + span - step
+                sub_lo, sub_hi = max(lo, bstart), min(hi, bend)
+                new = {}
+                for s in series:
+                    ts, vals = _clip(s.ts, s.vals, sub_lo, sub_hi)
+                    if len(ts):
+                        new[labels_key(s.labels)] = (s.labels, ts, vals)
+                key = (query, step, bstart)
+                old = self._blocks.get(key)
+                if old is not None and old.expires >= now and old.lo <= sub_hi + step and sub_lo <= old.hi + step:
+                    # Overlapping or adjacent: keep the old samples outside the fetched range
+                    merged = {}
+                    for k in old.series.keys() | new.keys():
+                        chunks = []
+                        if k in old.series:
+                            metric, ts, vals = old.series[k]
+                            keep = (ts < sub_lo) | (ts > sub_hi)
+                            chunks.append((ts[keep], vals[keep]))
+                        if k in new:
+                            metric, ts, vals = new[k]
+                            chunks.append((ts, vals))
+                        ts, vals = _concat(chunks)
+                        if len(ts):
+                            merged[k] = (metric, ts, vals)
+                    new, sub_lo, sub_hi = merged, min(old.lo, sub_lo), max(old.hi, sub_hi)
+                ttl = self.history_ttl if sub_hi >= bend else self.recent_ttl
+                if old is not None:
+                    self._drop(key)
+                block = self._blocks[key] = Block(sub_lo, sub_hi, new, now + ttl)
+                self._points += block.points
+            while self._points > self.max_points and self._blocks:
+                self._drop(next(iter(self._blocks)))
+                self.stats["evictions"] += 1
+
+    def _drop(self, key: Tuple[str, int, int]):
+        self._points -= self._blocks.pop(key).points
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self._points = 0
+
+    def status(self) -> Dict[str, Any]:
+        return {"blocks": len(self._blocks), "points": self._points, "max_points": self.max_points, **self.stats}
+
+range_cache = RangeCache() if RANGE_CACHE_ENABLED else None
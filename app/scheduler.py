@@ -0,0 +1,94 @@
+import asyncio
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# evaluate(metric, last_window_state) -> (window_state, evaluated); evaluated is False
+# when nothing had changed since last_window_state and the metric was skipped. The
+# state is opaque to the scheduler (main.monitor_metric keeps a window key per series).
+Evaluate = Callable[[str, Any], Awaitable[Tuple[Any, bool]]]
+
+class MonitorScheduler:
+    """Evaluates a fixed list of metrics every `interval` seconds on a bounded worker pool.
+
+    Each tick gets a time budget; metrics not started within it are deferred and
+    go first on the next tick. Tick start is jittered so several instances (or a
+    restart) don't hit Prometheus/Ollama in lockstep.
+    """
+
+    def __init__(self, metrics: List[str], evaluate: Evaluate, interval: float = 300,
+                 jitter: float = 0.1, concurrency: int = 4, tick_budget: float = None):
+        self.metrics = list(dict.fromkeys(metrics))
+        self.evaluate = evaluate
+        self.interval = interval
+        self.jitter = jitter
+        self.concurrency = max(1, concurrency)
+        self.tick_budget = tick_budget if tick_budget else interval * 0.8
+        self.last_keys: Dict[str, Any] = {}
+        self.last_run: Dict[str, float] = {}
+        self.deferred: List[str] = []
+        self.stats = {"ticks": 0, "evaluated": 0, "unchanged": 0, "deferred": 0, "errors": 0}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None and self.metrics:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        # Random initial offset spreads the first tick of freshly started instances
+        await asyncio.sleep(random.uniform(0, self.interval * self.jitter))
+        while True:
+            started = time.monotonic()
+            try:
+                await self.tick()
+            except Exception as e:
+                print(f"Monitor tick error: {e}")
+            delay = self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+            await asyncio.sleep(max(0.0, delay - (time.monotonic() - started)))
+
+    async def tick(self):
+        self.stats["ticks"] += 1
+        deadline = time.monotonic() + self.tick_budget
+        order = self.deferred + [m for m in self.metrics if m not in self.deferred]
+        queue: "asyncio.Queue[str]" = asyncio.Queue()
+        for m in order:
+            queue.put_nowait(m)
+
+        async def worker():
+            while not queue.empty():
+                if time.monotonic() >= deadline:
+                    return
+                metric = queue.get_nowait()
+                try:
+                    key, evaluated = await self.evaluate(metric, self.last_keys.get(metric))
+                    self.last_keys[metric] = key
+                    self.last_run[metric] = time.time()
+                    self.stats["evaluated" if evaluated else "unchanged"] += 1
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    print(f"Monitor error for {metric}: {e}")
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(order)))))
+        self.deferred = []
+        while not queue.empty():
+            self.deferred.append(queue.get_nowait())
+        self.stats["deferred"] += len(self.deferred)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None,
+            "metrics": len(self.metrics),
+            "interval": self.interval,
+            "stats": dict(self.stats),
+            "deferred": list(self.deferred),
+            "last_run": dict(self.last_run),
+        }
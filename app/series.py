@@ -0,0 +1,127 @@
+from typing import List, Dict, Any, Tuple, Union
+import numpy as np
+
+# Label sets are interned so that every chunk/segment of the same series shares
+# one dict instead of carrying its own copy.
+_LABELS: Dict[Tuple, Dict[str, str]] = {}
+_LABELS_MAX = 100000
+
+def labels_key(labels: Dict[str, str]) -> Tuple:
+    return tuple(sorted(labels.items()))
+
+def intern_labels(labels: Dict[str, str]) -> Dict[str, str]:
+    key = labels_key(labels)
+    found = _LABELS.get(key)
+    if found is None:
+        if len(_LABELS) >= _LABELS_MAX:
+            _LABELS.clear()
+        _LABELS[key] = found = dict(labels)
+    return found
+
+class Series:
+    """Columnar series: contiguous int64 timestamps and float64 values, sorted by time"""
+
+    __slots__ = ("labels", "ts", "vals")
+
+    def __init__(self, labels: Dict[str, str], ts: np.ndarray, vals: np.ndarray):
+        self.labels = labels
+        self.ts = ts
+        self.vals = vals
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    @property
+    def points(self) -> List[Tuple[int, float]]:
+        """Tuple-list view for callers of the old to_series() API"""
+        return list(zip(self.ts.tolist(), self.vals.tolist()))
+
+    def slice(self, i: int, j: int) -> "Series":
+        return Series(self.labels, self.ts[i:j], self.vals[i:j])
+
+    def tail(self, n: int) -> "Series":
+        return self.slice(max(0, len(self) - n), len(self))
+
+def parse_values(values: List[List[Any]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Parse Prometheus [[ts, "val"], ...] pairs straight into arrays"""
+    n = len(values)
+    ts = np.fromiter((v[0] for v in values), dtype=np.float64, count=n).astype(np.int64)
+    vals = np.fromiter((v[1] for v in values), dtype=np.float64, count=n)
+    return ts, vals
+
+def from_points(points: List[Tuple[int, float]], labels: Dict[str, str] = None) -> Series:
+    ts, vals = parse_values(points)
+    if n_unsorted(ts):
+        order = np.argsort(ts, kind="stable")
+        ts, vals = ts[order], vals[order]
+    return Series(intern_labels(labels or {}), ts, vals)
+
+def n_unsorted(ts: np.ndarray) -> int:
+    return int(np.count_nonzero(ts[1:] < ts[:-1])) if len(ts) > 1 else 0
+
+def as_series(obj: Union[Series, List[Tuple[int, float]]]) -> Series:
+    return obj if isinstance(obj, Series) else from_points(obj)
+
+def to_columnar(result: Dict[str, Any]) -> List[Series]:
+    data = result.get("data", {}).get("result", [])
+    series = []
+    for item in data:
+        metric = intern_labels(item.get("metric", {}))
+        values = item.get("values")
+        if not values:
+            # Instant vector: a single [ts, "val"] pair
+            value = item.get("value")
+            values = [value] if isinstance(value, list) and len(value) == 2 else []
+        ts, vals = parse_values(values)
+        series.append(Series(metric, ts, vals))
+    return series
+
+def from_columnar(series: List[Series]) -> Dict[str, Any]:
+    """query_range response (matrix) holding `series`; the inverse of to_columnar()"""
+    result = [{"metric": s.labels, "values": [[t, repr(v)] for t, v in zip(s.ts.tolist(), s.vals.tolist())]} for s in series]
+    return {"status": "success", "data": {"resultType": "matrix", "result": result}}
+
+def _round(x: float) -> float:
+    return float(f"{x:.4g}")
+
+def summarize_segments(ts: np.ndarray, vals: np.ndarray, offsets: np.ndarray, shape_points: int = 16) -> List[Dict[str, Any]]:
+    """Compact per-segment summaries of a ragged (ts, vals, offsets) buffer.
+
+    Each summary carries count/min/max/mean/first/last and a `shape_points`-long
+    piecewise-aggregate (bucket mean) shape, rounded to 4 significant digits.
+    """
+    n = len(offsets) - 1
+    lengths = np.diff(offsets)
+    nonempty = np.flatnonzero(lengths > 0)
+    out: List[Dict[str, Any]] = [{"n": 0} for _ in range(n)]
+    if not len(nonempty):
+        return out
+    starts = offsets[:-1][nonempty]
+    mins = np.minimum.reduceat(vals, starts)
+    maxs = np.maximum.reduceat(vals, starts)
+    sums = np.add.reduceat(vals, starts)
+
+    # Bucket every sample by its relative position in its segment, then average per (segment, bucket)
+    seg_id = np.repeat(np.arange(n), lengths)
+    pos = np.arange(len(vals)) - offsets[:-1][seg_id]
+    k = np.minimum(lengths, shape_points)
+    bucket = seg_id * shape_points + (pos * k[seg_id]) // lengths[seg_id]
+    bsum = np.bincount(bucket, weights=vals, minlength=n * shape_points)
+    bcnt = np.bincount(bucket, minlength=n * shape_points)
+    shape = (bsum / np.maximum(bcnt, 1)).reshape(n, shape_points)
+
+    for j, i in enumerate(nonempty.tolist()):
+        out[i] = {
+            "n": int(lengths[i]),
+            "min": _round(mins[j]),
+            "max": _round(maxs[j]),
+            "mean": _round(sums[j] / lengths[i]),
+            "first": _round(vals[offsets[i]]),
+            "last": _round(vals[offsets[i + 1] - 1]),
+            "shape": [_round(v) for v in shape[i, :k[i]]],
+        }
+    return out
+
+def summarize(series: Series, shape_points: int = 16) -> Dict[str, Any]:
+    offsets = np.array([0, len(series)], dtype=np.int64)
+    return summarize_segments(series.ts, series.vals, offsets, shape_points)[0]
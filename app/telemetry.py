@@ -0,0 +1,231 @@
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Self-instrumentation in the Prometheus text exposition format (0.0.4), so the
+# Prometheus we analyze can also scrape us. Counters and histograms are kept
+# here; gauges (cache sizes, queue depths) are read at scrape time from
+# collector callbacks instead of being updated on every change. With several
+# worker processes each one publishes a snapshot to a shared cache and /metrics
+# renders all of them, one `worker` label value per process.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+Labels = Tuple[Tuple[str, str], ...]
+# (sample name, labels, value); a family is (name, type, help, samples)
+Sample = Tuple[str, Labels, float]
+
+def _key(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _fmt_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    inner = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return "{" + inner + "}" if inner else ""
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_key(labels), 0)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name, k, v) for k, v in items]
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Labels, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    row[i] += 1
+                    break
+            else:
+                row[len(self.buckets)] += 1
+            row[-1] += value
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        out = []
+        for key, row in items:
+            cumulative = 0
+            for b, n in zip(self.buckets + (float("inf"),), row[:-1]):
+                cumulative += n
+                out.append((f"{self.name}_bucket", key + (("le", _fmt_value(b)),), cumulative))
+            out.append((f"{self.name}_sum", key, row[-1]))
+            out.append((f"{self.name}_count", key, cumulative))
+        return out
+
+# Collector: returns (name, type, help, [(labels, value), ...]) families, read at scrape time
+Family = Tuple[str, str, str, List[Tuple[Dict[str, Any], float]]]
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Any] = []
+        self.collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def counter(self, name: str, help: str) -> Counter:
+        m = Counter(name, help)
+        self.metrics.append(m)
+        return m
+
+    def histogram(self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        m = Histogram(name, help, buckets)
+        self.metrics.append(m)
+        return m
+
+    def collector(self, fn: Callable[[], Iterable[Family]]) -> Callable[[], Iterable[Family]]:
+        self.collectors.append(fn)
+        return fn
+
+    def snapshot(self) -> List[Tuple[str, str, str, List[Sample]]]:
+        """Every family with its current samples (JSON-serializable, for sharing between workers)"""
+        out = []
+        for m in self.metrics:
+            samples = m.samples()
+            if samples:
+                out.append((m.name, m.kind, m.help, samples))
+        for fn in self.collectors:
+            try:
+                families = list(fn())
+            except Exception as e:
+                print(f"Metrics collector {getattr(fn, '__name__', fn)} failed: {e}")
+                continue
+            for name, kind, help, samples in families:
+                out.append((name, kind, help, [(name, _key(labels), v) for labels, v in samples if v is not None]))
+        return out
+
+    def render(self, workers: Dict[str, list] = None) -> str:
+        """Text exposition of this process, or of every worker snapshot in `workers` labelled by worker"""
+        sources = {None: self.snapshot()} if workers is None else workers
+        families: Dict[str, Tuple[str, str, list]] = {}
+        for worker, snapshot in sorted(sources.items(), key=lambda kv: str(kv[0])):
+            for name, kind, help, samples in snapshot:
+                extra = () if worker is None else (("worker", str(worker)),)
+                families.setdefault(name, (kind, help, []))[2].extend(
+                    (sample, tuple(map(tuple, labels)) + extra, v) for sample, labels, v in samples)
+        out = []
+        for name, (kind, help, samples) in families.items():
+            out += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+            out += [f"{sample}{_fmt_labels(labels)} {_fmt_value(v)}" for sample, labels, v in samples]
+        return "\n".join(out) + "\n"
+
+registry = Registry()
+
+SPAN_SECONDS = registry.histogram("aiprom_span_seconds", "Time spent in instrumented hot-path operations")
+SPAN_ERRORS = registry.counter("aiprom_span_errors_total", "Instrumented operations that raised")
+ERRORS = registry.counter("aiprom_errors_total", "Errors handled (logged and degraded) instead of raised")
+HTTP_REQUESTS = registry.counter("aiprom_http_requests_total", "HTTP requests by route and status")
+HTTP_SECONDS = registry.histogram("aiprom_http_request_seconds", "HTTP request latency until the response starts")
+LLM_FIRST_TOKEN = registry.histogram("aiprom_llm_first_token_seconds", "Time from sending a streaming prompt to the first response text")
+
+# Per-request breakdown: span name -> [seconds, calls], shared by the tasks and
+# executor threads of one request (see run_blocking, which copies the context)
+_breakdown: contextvars.ContextVar[Optional[Dict[str, List[float]]]] = contextvars.ContextVar("aiprom_breakdown", default=None)
+_breakdown_lock = threading.Lock()
+
+def record(name: str, seconds: float, error: bool = False, **labels):
+    SPAN_SECONDS.observe(seconds, span=name, **labels)
+    if error:
+        SPAN_ERRORS.inc(span=name, **labels)
+    timings = _breakdown.get()
+    if timings is not None:
+        with _breakdown_lock:
+            row = timings.setdefault(name, [0.0, 0])
+            row[0] += seconds
+            row[1] += 1
+
+@contextmanager
+def span(name: str, **labels) -> Iterator[None]:
+    t0 = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        record(name, time.perf_counter() - t0, error, **labels)
+
+def timed(name: str, **labels):
+    """Decorator: run the (sync or async) function inside span(name)"""
+    def wrap(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_inner(*args, **kwargs):
+                with span(name, **labels):
+                    return await fn(*args, **kwargs)
+            return async_inner
+
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with span(name, **labels):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+@contextmanager
+def collect() -> Iterator[Dict[str, List[float]]]:
+    """Gather the spans of the current request (and the tasks/threads it starts) into a dict"""
+    timings: Dict[str, List[float]] = {}
+    token = _breakdown.set(timings)
+    try:
+        yield timings
+    finally:
+        _breakdown.reset(token)
+
+def breakdown(timings: Dict[str, List[float]], total: float) -> Dict[str, Any]:
+    """Response form of collect(): milliseconds and call count per span. Spans nest and
+    run concurrently, so they need not add up to total_ms."""
+    with _breakdown_lock:
+        spans = {k: {"ms": round(v[0] * 1000, 2), "calls": int(v[1])} for k, v in sorted(timings.items())}
+    return {"total_ms": round(total * 1000, 2), "spans": spans}
+
+def render(shared=None, worker: str = None) -> str:
+    """/metrics body. With `shared` (a cache shared by the workers) this process's snapshot is
+    published under `worker` first and every live worker's snapshot is rendered."""
+    if shared is None:
+        return registry.render()
+    publish(shared, worker)
+    return registry.render(shared.items())
+
+def publish(shared, worker: str):
+    shared.set(worker, registry.snapshot())
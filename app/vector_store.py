@@ -0,0 +1,455 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Dict, Any, Tuple, Union, Optional
+import numpy as np
+from .config import VECTOR_STORE_BACKEND, VECTOR_STORE_PATH, LOCAL_IVF_MIN_VECTORS, LOCAL_IVF_NPROBE, MILVUS_HEALTH_INTERVAL
+from .series import Series
+from . import milvus_client
+from .milvus_client import DIM, prepare_segments, run_blocking
+from .telemetry import timed
+
+INITIAL_CAPACITY = 4096
+KMEANS_ITERS = 10
+KMEANS_SAMPLE = 65536
+BACKFILL_BATCH = 1000
+
+class LocalVectorStore:
+    """Embedded vector index persisted under `path`.
+
+    Vectors live in a memory-mapped float32 file (vectors.f32) that grows by
+    doubling; ids, time ranges and previews live next to it in sqlite. Rows are
+    append-only and an upsert of a known id overwrites its row in place, so the
+    row count is the segment count and a restart only maps the file and
+    recomputes the norms. Up to `ivf_min` vectors search is exact brute force;
+    above it a k-means IVF (trained lazily, retrained when the store doubles)
+    scans only the `nprobe` nearest lists. Distances are squared L2 like Milvus.
+
+    Several worker processes can open the same store: inserts run inside a
+    sqlite write transaction (one writer at a time across processes) and bump a
+    version in `meta`; every operation first compares that version and maps in
+    the rows other processes wrote.
+
+    Ids in `pending` were inserted while Milvus was unavailable and still have
+    to be copied there (see VectorStore).
+    """
+
+    def __init__(self, path: str, dim: int = DIM, ivf_min: int = LOCAL_IVF_MIN_VECTORS, nprobe: int = LOCAL_IVF_NPROBE):
+        self.path = path
+        self.dim = dim
+        self.ivf_min = ivf_min
+        self.nprobe = max(1, nprobe)
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(path, "segments.db"), timeout=10, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS segments (id INTEGER PRIMARY KEY, row INTEGER UNIQUE, "
+            "metric_name TEXT, start_ts INTEGER, end_ts INTEGER, preview TEXT)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS pending (id INTEGER PRIMARY KEY)")
+        found = self._db.execute("SELECT v FROM meta WHERE k = 'dim'").fetchone()
+        if found is None:
+            self._db.execute("INSERT INTO meta (k, v) VALUES ('dim', ?)", (str(dim),))
+        elif int(found[0]) != dim:
+            raise ValueError(f"Local vector store at {path} has dim {found[0]}, expected {dim}")
+        self._db.commit()
+        (self.count,) = self._db.execute("SELECT COUNT(*) FROM segments").fetchone()
+        self._version = self._read_version()
+        self._file = os.path.join(path, "vectors.f32")
+        self._open(max(INITIAL_CAPACITY, self.count))
+        self._norms = np.einsum("ij,ij->i", self._mm[:self.count], self._mm[:self.count]).astype(np.float32)
+        self._centroids: Optional[np.ndarray] = None
+        self._assign = np.empty(0, dtype=np.int32)
+        self._lists: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._trained_at = 0
+
+    def _open(self, capacity: int):
+        size = capacity * self.dim * 4
+        if not os.path.exists(self._file) or os.path.getsize(self._file) < size:
+            with open(self._file, "ab") as f:
+                f.truncate(size)
+        capacity = os.path.getsize(self._file) // (self.dim * 4)
+        self._mm = np.memmap(self._file, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+
+    def _reserve(self, n: int):
+        if n <= len(self._mm):
+            return
+        self._mm.flush()
+        del self._mm
+        self._open(max(n, 2 * self.count, INITIAL_CAPACITY))
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _read_version(self) -> int:
+        found = self._db.execute("SELECT v FROM meta WHERE k = 'version'").fetchone()
+        return int(found[0]) if found else 0
+
+    def _sync(self):
+        """Pick up rows written by other processes since our last look (caller holds self._lock)"""
+        version = self._read_version()
+        if version == self._version:
+            return
+        (count,) = self._db.execute("SELECT COUNT(*) FROM segments").fetchone()
+        self._reserve(count)
+        old = self.count
+        self.count = count
+        # Upserts may have rewritten old rows too, so all norms are recomputed; IVF
+        # assignments are only added for new rows until the next retrain
+        self._norms = np.einsum("ij,ij->i", self._mm[:count], self._mm[:count]).astype(np.float32)
+        if self._centroids is not None and count > old:
+            self._assign = np.concatenate([self._assign, self._nearest(np.asarray(self._mm[old:count]), 1)[:, 0].astype(np.int32)])
+            self._lists = None
+        self._version = version
+
+    def insert(self, batch: Dict[str, Any], pending: bool = False) -> int:
+        """Upsert a prepared batch; pending=True also queues its ids for Milvus"""
+        ids = batch["ids"]
+        if not ids:
+            return 0
+        vectors = np.asarray(batch["vectors"], dtype=np.float32).reshape(len(ids), self.dim)
+        with self._lock:
+            # BEGIN IMMEDIATE takes sqlite's write lock: other processes' inserts wait here
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                n = self._insert_locked(ids, vectors, batch)
+                if pending:
+                    self._db.executemany("INSERT OR IGNORE INTO pending (id) VALUES (?)", ((i,) for i in ids))
+                self._db.execute("INSERT OR REPLACE INTO meta (k, v) VALUES ('version', ?)", (str(self._version + 1),))
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+            self._version += 1
+            return n
+
+    def _insert_locked(self, ids: List[int], vectors: np.ndarray, batch: Dict[str, Any]) -> int:
+        self._sync()
+        known = {}
+        for i in range(0, len(ids), 900):  # stay under sqlite's bound-parameter limit
+            chunk = ids[i:i + 900]
+            q = f"SELECT id, row FROM segments WHERE id IN ({','.join('?' * len(chunk))})"
+            known.update(self._db.execute(q, chunk).fetchall())
+        rows = np.empty(len(ids), dtype=np.int64)
+        nxt = self.count
+        for i, sid in enumerate(ids):
+            row = known.get(sid)
+            if row is None:
+                # Duplicate ids within one batch share the row of the first occurrence
+                row = known[sid] = nxt
+                nxt += 1
+            rows[i] = row
+        self._reserve(nxt)
+        self._mm[rows] = vectors
+        self._mm.flush()
+        self._db.executemany(
+            "INSERT OR REPLACE INTO segments (id, row, metric_name, start_ts, end_ts, preview) VALUES (?, ?, ?, ?, ?, ?)",
+            zip(ids, rows.tolist(), [batch["metric_name"]] * len(ids), batch["start_ts"], batch["end_ts"], batch["previews"]),
+        )
+        norms = np.einsum("ij,ij->i", vectors, vectors).astype(np.float32)
+        self._norms = np.concatenate([self._norms, np.zeros(nxt - self.count, dtype=np.float32)])
+        self._norms[rows] = norms
+        if self._centroids is not None:
+            self._assign = np.concatenate([self._assign, np.zeros(nxt - self.count, dtype=np.int32)])
+            self._assign[rows] = self._nearest(vectors, 1)[:, 0]
+            self._lists = None
+        self.count = nxt
+        return len(ids)
+
+    def _nearest(self, x: np.ndarray, k: int) -> np.ndarray:
+        d = (self._centroids * self._centroids).sum(axis=1)[None, :] - 2.0 * x @ self._centroids.T
+        k = min(k, len(self._centroids))
+        idx = np.argpartition(d, k - 1, axis=1)[:, :k]
+        return np.take_along_axis(idx, np.take_along_axis(d, idx, axis=1).argsort(axis=1), axis=1)
+
+    def _train(self):
+        n = self.count
+        nlist = int(min(4096, max(16, 4 * n ** 0.5)))
+        rng = np.random.default_rng(0)
+        sample = np.asarray(self._mm[np.sort(rng.choice(n, min(n, KMEANS_SAMPLE), replace=False))])
+        # A small ivf_min can train on fewer vectors than the minimum list count
+        nlist = min(nlist, len(sample))
+        self._centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(KMEANS_ITERS):
+            a = self._nearest(sample, 1)[:, 0]
+            counts = np.bincount(a, minlength=nlist)
+            sums = np.zeros_like(self._centroids)
+            np.add.at(sums, a, sample)
+            filled = counts > 0
+            self._centroids[filled] = sums[filled] / counts[filled, None]
+        self._assign = np.concatenate([
+            self._nearest(np.asarray(self._mm[i:min(i + KMEANS_SAMPLE, n)]), 1)[:, 0] for i in range(0, n, KMEANS_SAMPLE)
+        ]).astype(np.int32)
+        self._lists = None
+        self._trained_at = n
+
+    def _inverted_lists(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._lists is None:
+            order = np.argsort(self._assign, kind="stable")
+            bounds = np.searchsorted(self._assign[order], np.arange(len(self._centroids) + 1))
+            self._lists = (order, bounds)
+        return self._lists
+
+    def _candidates(self, q: np.ndarray) -> Optional[np.ndarray]:
+        if self.count < self.ivf_min:
+            return None
+        if self._centroids is None or self.count >= 2 * self._trained_at:
+            self._train()
+        order, bounds = self._inverted_lists()
+        probe = self._nearest(q[None, :], self.nprobe)[0]
+        return np.concatenate([order[bounds[c]:bounds[c + 1]] for c in probe])
+
+    def search(self, vectors: Union[np.ndarray, List[List[float]]], top_k: int = 5) -> List[List[Dict[str, Any]]]:
+        queries = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            self._sync()
+            n = self.count
+            if n == 0:
+                return [[] for _ in range(len(queries))]
+            base = self._mm[:n]
+            found: List[List[Tuple[int, float]]] = []
+            if n < self.ivf_min:
+                d = self._norms[None, :n] - 2.0 * (queries @ base.T)
+                k = min(top_k, n)
+                idx = np.argpartition(d, k - 1, axis=1)[:, :k]
+                for qi in range(len(queries)):
+                    row = idx[qi][np.argsort(d[qi, idx[qi]])]
+                    found.append([(int(r), float(d[qi, r])) for r in row])
+            else:
+                for q in queries:
+                    cand = self._candidates(q)
+                    d = self._norms[cand] - 2.0 * (base[cand] @ q)
+                    k = min(top_k, len(cand))
+                    pick = np.argpartition(d, k - 1)[:k] if k else np.empty(0, dtype=np.int64)
+                    pick = pick[np.argsort(d[pick])]
+                    found.append([(int(cand[p]), float(d[p])) for p in pick])
+            qnorm = (queries * queries).sum(axis=1)
+            rows = sorted({r for hits in found for r, _ in hits})
+            meta = {}
+            for i in range(0, len(rows), 900):
+                chunk = rows[i:i + 900]
+                q = f"SELECT row, metric_name, start_ts, end_ts, preview FROM segments WHERE row IN ({','.join('?' * len(chunk))})"
+                meta.update({r[0]: r[1:] for r in self._db.execute(q, chunk).fetchall()})
+        out = []
+        for qi, hits in enumerate(found):
+            res = []
+            for row, dist in hits:
+                metric_name, start_ts, end_ts, preview = meta.get(row, (None, None, None, None))
+                hit = {
+                    "metric_name": metric_name,
+                    "start_ts": start_ts,
+                    "end_ts": end_ts,
+                    "distance": max(0.0, dist + float(qnorm[qi])),
+                }
+                if preview:
+                    try:
+                        hit["summary"] = json.loads(preview)
+                    except ValueError:
+                        pass
+                res.append(hit)
+            out.append(res)
+        return out
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+
+    def pending_batches(self, limit: int = BACKFILL_BATCH) -> List[Dict[str, Any]]:
+        """Up to `limit` queued segments as prepared batches, one per metric"""
+        with self._lock:
+            self._sync()
+            rows = self._db.execute(
+                "SELECT s.id, s.row, s.metric_name, s.start_ts, s.end_ts, s.preview FROM pending p JOIN segments s ON s.id = p.id LIMIT ?",
+                (limit,)).fetchall()
+            vectors = np.asarray(self._mm[[r[1] for r in rows]]) if rows else None
+        batches: Dict[str, Dict[str, Any]] = {}
+        for i, (sid, _, metric_name, start_ts, end_ts, preview) in enumerate(rows):
+            b = batches.setdefault(metric_name, {"metric_name": metric_name, "ids": [], "start_ts": [], "end_ts": [], "rows": [], "previews": []})
+            b["ids"].append(sid)
+            b["start_ts"].append(start_ts)
+            b["end_ts"].append(end_ts)
+            b["rows"].append(i)
+            b["previews"].append(preview or "")
+        for b in batches.values():
+            b["vectors"] = vectors[b.pop("rows")]
+        return list(batches.values())
+
+    def clear_pending(self, ids: List[int]):
+        with self._lock:
+            for i in range(0, len(ids), 900):
+                chunk = ids[i:i + 900]
+                self._db.execute(f"DELETE FROM pending WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._mm.flush()
+            self._db.close()
+
+class VectorStore:
+    """Routes inserts and searches to Milvus, the local index, or both.
+
+    backend "milvus" and "local" use one store. "auto" writes every batch to the
+    local index and to Milvus (when reachable), and searches Milvus first,
+    answering from the local index while Milvus is down; after a failure Milvus
+    is skipped for `retry_interval` seconds so requests don't each wait out a
+    connection timeout.
+
+    Batches Milvus missed are queued in the local index and copied to Milvus by
+    a background backfill once it answers again; until the queue is empty,
+    Milvus results are merged with the local index's so those segments are
+    still found.
+    """
+
+    def __init__(self, backend: str = VECTOR_STORE_BACKEND, path: str = VECTOR_STORE_PATH, retry_interval: float = MILVUS_HEALTH_INTERVAL):
+        self.backend = backend if backend in ("milvus", "local", "auto") else "auto"
+        self.path = path
+        self.retry_interval = retry_interval
+        self._local: Optional[LocalVectorStore] = None
+        self._local_lock = threading.Lock()
+        self._milvus_down_until = 0.0
+        self._pending = False
+        self._backfill_lock = threading.Lock()
+        self._backfilling = False
+        self.stats = {"milvus_errors": 0, "local_searches": 0, "milvus_searches": 0, "backfilled": 0}
+
+    def local(self) -> LocalVectorStore:
+        with self._local_lock:
+            if self._local is None:
+                self._local = LocalVectorStore(self.path)
+            return self._local
+
+    def _milvus_ok(self) -> bool:
+        return self.backend != "local" and time.time() >= self._milvus_down_until
+
+    def _milvus_failed(self, e: Exception):
+        self.stats["milvus_errors"] += 1
+        self._milvus_down_until = time.time() + self.retry_interval
+        print(f"Milvus unavailable, using local vector index: {e}")
+
+    def start(self):
+        if self.backend != "milvus":
+            self.local()
+        if self.backend != "local":
+            milvus_client.manager.start()
+        if self.backend == "auto" and self.local().pending_count():
+            self._pending = True
+            self._start_backfill()
+
+    def _start_backfill(self):
+        with self._backfill_lock:
+            if self._backfilling or not self._milvus_ok():
+                return
+            self._backfilling = True
+        threading.Thread(target=self._backfill, name="milvus-backfill", daemon=True).start()
+
+    def _backfill(self):
+        local = self.local()
+        try:
+            while True:
+                batches = local.pending_batches()
+                if not batches:
+                    with self._backfill_lock:
+                        # An insert may have queued more since the read
+                        self._pending = local.pending_count() > 0
+                        if not self._pending:
+                            return
+                    continue
+                for batch in batches:
+                    milvus_client.insert_prepared(batch)
+                    local.clear_pending(batch["ids"])
+                    self.stats["backfilled"] += len(batch["ids"])
+        except Exception as e:
+            self._milvus_failed(e)
+        finally:
+            with self._backfill_lock:
+                self._backfilling = False
+
+    def stop(self):
+        if self.backend != "local":
+            milvus_client.manager.stop()
+        if self._local is not None:
+            self._local.close()
+            self._local = None
+
+    def insert(self, batch: Dict[str, Any]) -> int:
+        if self.backend == "milvus":
+            return milvus_client.insert_prepared(batch)
+        if self.backend == "local":
+            return self.local().insert(batch)
+        missed = True
+        if self._milvus_ok():
+            try:
+                milvus_client.insert_prepared(batch)
+                missed = False
+            except Exception as e:
+                self._milvus_failed(e)
+        n = self.local().insert(batch, pending=missed)
+        if missed:
+            with self._backfill_lock:
+                self._pending = True
+        elif self._pending:
+            self._start_backfill()
+        return n
+
+    def search(self, vectors: Union[np.ndarray, List[List[float]]], top_k: int = 5) -> List[List[Dict[str, Any]]]:
+        if len(vectors) == 0:
+            return []
+        if self.backend == "milvus":
+            return milvus_client.search_similar_batch(vectors, top_k)
+        if self._milvus_ok():
+            try:
+                res = milvus_client.search_similar_batch(vectors, top_k)
+                self.stats["milvus_searches"] += 1
+                if self._pending:
+                    self._start_backfill()
+                    return merge_hits(res, self.local().search(vectors, top_k), top_k)
+                return res
+            except Exception as e:
+                self._milvus_failed(e)
+        self.stats["local_searches"] += 1
+        return self.local().search(vectors, top_k)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "milvus_available": self.backend != "local" and time.time() >= self._milvus_down_until,
+            "local_vectors": len(self._local) if self._local is not None else None,
+            "milvus_pending": self._local.pending_count() if self._local is not None and self.backend == "auto" else 0,
+            **self.stats,
+        }
+
+def merge_hits(a: List[List[Dict[str, Any]]], b: List[List[Dict[str, Any]]], top_k: int) -> List[List[Dict[str, Any]]]:
+    """Per query, the top_k nearest of both result lists, each segment once"""
+    out = []
+    for hits_a, hits_b in zip(a, b):
+        seen = {}
+        for hit in sorted(hits_a + hits_b, key=lambda h: h["distance"]):
+            seen.setdefault((hit["metric_name"], hit["start_ts"], hit["end_ts"]), hit)
+        out.append(list(seen.values())[:top_k])
+    return out
+
+store = VectorStore()
+
+@timed("insert_segments")
+def insert_segments(metric_name: str, segments: List[Union[Series, List[Tuple[int, float]]]], ids: List[int] = None) -> int:
+    if not segments:
+        return 0
+    return store.insert(prepare_segments(metric_name, segments, ids))
+
+@timed("search_similar")
+def search_similar_batch(vectors: Union[np.ndarray, List[List[float]]], top_k: int = 5) -> List[List[Dict[str, Any]]]:
+    return store.search(vectors, top_k)
+
+def search_similar(vector: List[float], top_k: int = 5) -> List[Dict[str, Any]]:
+    return search_similar_batch([vector], top_k)[0]
+
+async def search_similar_async(vector: List[float], top_k: int = 5) -> List[Dict[str, Any]]:
+    return await run_blocking(search_similar, vector, top_k)
+
+async def search_similar_batch_async(vectors: Union[np.ndarray, List[List[float]]], top_k: int = 5) -> List[List[Dict[str, Any]]]:
+    return await run_blocking(search_similar_batch, vectors, top_k)
@@ -0,0 +1,51 @@
+import os
+from typing import Optional
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, every process acts as leader
+    fcntl = None
+
+class LeaderLock:
+    """Non-blocking exclusive flock on `path`, held for the life of the process.
+
+    With several uvicorn workers exactly one holds it and runs the once-per-host
+    jobs (monitor scheduler, catalog refresh, Ollama keep-alive). The OS drops
+    the lock when the holder exits, so another worker can take over by calling
+    acquire() again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self) -> bool:
+        if self._fd is not None:
+            return True
+        if fcntl is None:
+            self._fd = -1
+            return True
+        d = os.path.dirname(self.path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        if self._fd >= 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+        self._fd = None
@@ -0,0 +1,92 @@
+"""Prompt size and LLM latency before/after prompt compaction.
+
+    python -m bench.bench_prompt [--points 200] [--llm] [--repeat 3]
+
+Builds the analysis prompt for the same window with the raw JSON points and
+with each compaction strategy, and reports characters, estimated tokens and
+how well the kept points reconstruct the window (RMSE of the linear
+reconstruction as a share of the value range). With --llm every prompt is
+also sent to the configured Ollama model; prompt tokens, prompt-eval time and
+total latency come from Ollama's own counters (median of --repeat runs).
+"""
+import argparse
+import statistics
+import sys
+import time
+from typing import Dict, List
+import numpy as np
+import requests
+from app.compact import STRATEGIES, downsample, estimate_tokens
+from app.config import OLLAMA_HOST, OLLAMA_MODEL, PROMPT_MAX_POINTS
+from app.llm import build_prompt
+from app.series import Series
+import app.llm as llm
+
+def make_window(points: int, seed: int) -> Series:
+    rng = np.random.default_rng(seed)
+    t = np.arange(points)
+    ts = 1_700_000_000 + t * 60
+    vals = 40 + 5 * np.sin(t / 15) + rng.normal(0, 0.8, points) + np.where(t > points * 0.8, 25.0, 0.0)
+    vals[int(points * 0.6)] += 30
+    return Series({}, ts.astype(np.int64), vals)
+
+def fidelity(window: Series, strategy: str, max_points: int) -> float:
+    small = downsample(window, max_points, strategy)
+    approx = np.interp(window.ts, small.ts, small.vals)
+    return float(np.sqrt(np.mean((approx - window.vals) ** 2)) / (np.ptp(window.vals) or 1.0))
+
+def ollama(prompt: str) -> Dict[str, float]:
+    t0 = time.perf_counter()
+    r = requests.post(f"{OLLAMA_HOST}/api/generate", json={"model": OLLAMA_MODEL, "prompt": prompt, "stream": False}, timeout=600)
+    r.raise_for_status()
+    data = r.json()
+    return {
+        "latency": time.perf_counter() - t0,
+        "prompt_tokens": data.get("prompt_eval_count", 0),
+        "prompt_eval": data.get("prompt_eval_duration", 0) / 1e9,
+    }
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--points", type=int, default=200)
+    ap.add_argument("--max-points", type=int, default=PROMPT_MAX_POINTS)
+    ap.add_argument("--llm", action="store_true", help="also measure latency against the configured Ollama")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    window = make_window(args.points, args.seed)
+    context = [{"metric_name": "demo", "start_ts": 1_699_000_000 + i * 3600, "end_ts": 1_699_003_540 + i * 3600, "distance": 3.14159 * i,
+                "summary": {"n": 60, "min": 38.1, "max": 71.9, "mean": 45.2, "first": 40.0, "last": 66.3,
+                            "shape": [round(40 + 5 * np.sin(j / 3), 4) for j in range(16)]}} for i in range(3)]
+
+    variants: List = [("raw json", "-", False)]
+    for strategy in STRATEGIES:
+        variants.append((f"compact/{strategy}", strategy, True))
+
+    print(f"window={args.points} points  max_points={args.max_points}  model={OLLAMA_MODEL if args.llm else '-'}")
+    print(f"{'variant':16s} {'chars':>7s} {'~tokens':>8s} {'rmse':>8s}" + ("  prompt_tok  eval_s  total_s" if args.llm else ""))
+    base_tokens = None
+    for name, strategy, compact in variants:
+        if compact:
+            llm.PROMPT_STRATEGY = strategy
+            llm.PROMPT_MAX_POINTS = args.max_points
+        prompt = build_prompt("demo_metric", window, context, {"env": "bench", "service": "bench"}, compact=compact)
+        tokens = estimate_tokens(prompt)
+        base_tokens = base_tokens or tokens
+        err = fidelity(window, strategy, args.max_points) if compact else 0.0
+        line = f"{name:16s} {len(prompt):7d} {tokens:8d} {err:8.1%}"
+        if args.llm:
+            try:
+                runs = [ollama(prompt) for _ in range(max(1, args.repeat))]
+            except requests.RequestException as e:
+                print(f"Ollama at {OLLAMA_HOST} unavailable: {e}")
+                return 1
+            line += (f"  {int(statistics.median(r['prompt_tokens'] for r in runs)):10d}"
+                     f"  {statistics.median(r['prompt_eval'] for r in runs):6.2f}"
+                     f"  {statistics.median(r['latency'] for r in runs):7.2f}")
+        print(line + ("" if not compact else f"   ({tokens / base_tokens:.0%} of raw)"))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+"""End-to-end benchmark against local stand-ins, no live services needed.
+
+    python -m bench.bench_suite [--series 50] [--ingest-hours 72] [--requests 200] [--concurrency 16]
+                                [--llm-latency 0.2] [--prescreen] [--save out.json] [--baseline out.json]
+
+Starts bench.fakes Prometheus and Ollama in child processes, writes a config
+pointing at them (vector_store.backend=local in a temp dir, memory cache, no
+monitor or alert channels) and loads the app with AIPROM_CONFIG, then measures:
+
+  ingest   run_ingest over --ingest-hours of --series series: points/s and segments/s
+  analyze  --requests /analyze calls (distinct metrics, so no cache hits) at
+           --concurrency through uvicorn: p50/p99 latency, requests/s and the
+           mean per-span time from timing=1
+  catalog  /catalog/metrics prefix searches: p50/p99
+  rss      peak resident memory of the app process after each phase
+
+Pre-screen is off unless --prescreen, so every analysis reaches the LLM.
+--save writes the numbers as JSON; --baseline compares against a saved run
+and exits 1 when a throughput drops or a latency/RSS grows by more than
+--tolerance, so it can gate a CI job.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import socket
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+import numpy as np
+import requests
+import yaml
+from bench.fakes import FakeOllama, FakePrometheus, aligned, serve
+
+# metric -> True when higher is better
+DIRECTIONS = {
+    "ingest.points_per_s": True,
+    "ingest.segments_per_s": True,
+    "analyze.rps": True,
+    "analyze.p50_ms": False,
+    "analyze.p99_ms": False,
+    "catalog.p50_ms": False,
+    "catalog.p99_ms": False,
+    "rss.peak_mb": False,
+}
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_fake(handler: type, **attrs) -> Tuple[multiprocessing.Process, str]:
+    port = free_port()
+    proc = multiprocessing.Process(target=serve, args=(handler, port), kwargs=attrs, daemon=True)
+    proc.start()
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return proc, url
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"{handler.__name__} did not start on {url}")
+
+def write_config(workdir: str, prom_url: str, ollama_url: str, prescreen: bool) -> str:
+    base_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config.yaml")
+    with open(base_path, encoding="utf-8") as f:
+        cfg = yaml.safe_load(f) or {}
+    overrides = {
+        "prometheus": {"url": prom_url},
+        "ollama": {"host": ollama_url},
+        "vector_store": {"backend": "local", "path": os.path.join(workdir, "vectors")},
+        "ingest": {"state_path": os.path.join(workdir, "ingest_state.db")},
+        "cache": {"backend": "memory"},
+        "server": {"leader_lock": os.path.join(workdir, "leader.lock")},
+        "prescreen": {"enabled": prescreen},
+        "monitor": {"enabled": False},
+        "catalog": {"refresh_interval": 0},
+        "alerts": {"wecom": {"enabled": False}, "dingtalk": {"enabled": False}, "email": {"enabled": False}},
+    }
+    for section, values in overrides.items():
+        cfg.setdefault(section, {}).update(values)
+    path = os.path.join(workdir, "config.yaml")
+    with open(path, "w", encoding="utf-8") as f:
+        yaml.safe_dump(cfg, f, allow_unicode=True)
+    return path
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0  # KiB on Linux
+
+def percentiles(latencies: List[float]) -> Dict[str, float]:
+    a = np.array(latencies) * 1000
+    return {"p50_ms": float(np.percentile(a, 50)), "p99_ms": float(np.percentile(a, 99)), "mean_ms": float(a.mean())}
+
+def start_app() -> Tuple[Any, str]:
+    import uvicorn
+    from app.main import app
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="bench-uvicorn", daemon=True).start()
+    deadline = time.time() + 30
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("app did not start")
+        time.sleep(0.05)
+    return server, f"http://127.0.0.1:{port}"
+
+def bench_ingest(series: int, hours: int, step: str) -> Dict[str, float]:
+    from app.ingest import run_ingest
+    from app.prometheus_adapter import parse_step
+    end_ts = int(time.time()) // 3600 * 3600
+    start_ts = end_ts - hours * 3600
+    points = series * len(aligned(start_ts, end_ts, parse_step(step)))
+    t0 = time.perf_counter()
+    res = run_ingest("bench_ingest", start_ts, end_ts, step, incremental=False)
+    elapsed = time.perf_counter() - t0
+    return {
+        "points": points,
+        "segments": res["inserted"],
+        "pruned": res["segments"]["redundant"],
+        "seconds": elapsed,
+        "points_per_s": points / elapsed,
+        "segments_per_s": res["inserted"] / elapsed,
+    }
+
+async def bench_analyze(base_url: str, n: int, concurrency: int) -> Dict[str, Any]:
+    import httpx
+    sem = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    spans: Dict[str, List[float]] = {}
+    errors = 0
+    async with httpx.AsyncClient(base_url=base_url, timeout=600, limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def one(i: int):
+            nonlocal errors
+            async with sem:
+                t0 = time.perf_counter()
+                r = await client.get("/analyze", params={"metric": f"bench_query_{i}", "timing": 1})
+                latencies.append(time.perf_counter() - t0)
+            body = r.json() if r.status_code == 200 else {}
+            if r.status_code != 200 or "error" in body:
+                errors += 1
+                return
+            for name, s in body.get("timing", {}).get("spans", {}).items():
+                spans.setdefault(name, []).append(s["ms"])
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(n)))
+        elapsed = time.perf_counter() - t0
+    out = {"requests": n, "concurrency": concurrency, "errors": errors, "rps": n / elapsed, **percentiles(latencies)}
+    out["span_mean_ms"] = {k: round(float(np.mean(v)), 2) for k, v in sorted(spans.items())}
+    return out
+
+def bench_catalog(base_url: str, n: int) -> Dict[str, float]:
+    session = requests.Session()
+    session.get(f"{base_url}/catalog/metrics", params={"limit": 1}).raise_for_status()  # warm the cache
+    latencies = []
+    for i in range(n):
+        t0 = time.perf_counter()
+        r = session.get(f"{base_url}/catalog/metrics", params={"prefix": f"bench_metric_{i % 50:02d}", "limit": 200})
+        latencies.append(time.perf_counter() - t0)
+        r.raise_for_status()
+    return percentiles(latencies)
+
+def flatten(results: Dict[str, Any]) -> Dict[str, float]:
+    return {f"{section}.{k}": v for section, values in results.items() if isinstance(values, dict)
+            for k, v in values.items() if isinstance(v, (int, float))}
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    now, before = flatten(results), flatten(baseline)
+    regressions = []
+    for key, higher_is_better in DIRECTIONS.items():
+        if key not in now or not before.get(key):
+            continue
+        change = now[key] / before[key] - 1
+        worse = -change if higher_is_better else change
+        mark = "REGRESSION" if worse > tolerance else ""
+        print(f"  {key:24s} {before[key]:12.2f} -> {now[key]:12.2f} ({change:+.1%}) {mark}")
+        if mark:
+            regressions.append(key)
+    return regressions
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--series", type=int, default=50, help="series per query returned by the fake Prometheus")
+    ap.add_argument("--targets", type=int, default=2000)
+    ap.add_argument("--metric-names", type=int, default=5000)
+    ap.add_argument("--ingest-hours", type=int, default=72)
+    ap.add_argument("--step", default="60s")
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--catalog-requests", type=int, default=500)
+    ap.add_argument("--llm-latency", type=float, default=0.2, help="seconds the fake Ollama waits before answering")
+    ap.add_argument("--prom-delay", type=float, default=0.0, help="extra seconds per fake Prometheus request")
+    ap.add_argument("--prescreen", action="store_true", help="keep the statistical pre-screen on")
+    ap.add_argument("--save", help="write results as JSON")
+    ap.add_argument("--baseline", help="JSON from an earlier --save to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.2)
+    args = ap.parse_args()
+
+    prom, prom_url = start_fake(FakePrometheus, series=args.series, targets=args.targets,
+                                metric_names=args.metric_names, delay=args.prom_delay)
+    ollama, ollama_url = start_fake(FakeOllama, latency=args.llm_latency)
+    workdir = tempfile.mkdtemp(prefix="aiprom-bench-")
+    os.environ["AIPROM_CONFIG"] = write_config(workdir, prom_url, ollama_url, args.prescreen)
+    results: Dict[str, Any] = {"params": {k: v for k, v in vars(args).items() if k not in ("save", "baseline")}}
+    server = None
+    try:
+        server, base_url = start_app()
+        results["rss"] = {"startup_mb": peak_rss_mb()}
+
+        ing = results["ingest"] = bench_ingest(args.series, args.ingest_hours, args.step)
+        results["rss"]["after_ingest_mb"] = peak_rss_mb()
+        print(f"ingest   {ing['points']:,} points, {ing['segments']:,} segments in {ing['seconds']:.2f}s: "
+              f"{ing['points_per_s']:,.0f} points/s, {ing['segments_per_s']:,.0f} segments/s ({ing['pruned']:,} redundant skipped)")
+
+        an = results["analyze"] = asyncio.run(bench_analyze(base_url, args.requests, args.concurrency))
+        results["rss"]["after_analyze_mb"] = peak_rss_mb()
+        print(f"analyze  {an['requests']} requests @ {an['concurrency']}: p50 {an['p50_ms']:.0f}ms p99 {an['p99_ms']:.0f}ms "
+              f"{an['rps']:.1f} req/s, {an['errors']} errors (fake LLM {args.llm_latency * 1000:.0f}ms)")
+        print("         spans (mean ms): " + ", ".join(f"{k}={v}" for k, v in an["span_mean_ms"].items()))
+
+        cat = results["catalog"] = bench_catalog(base_url, args.catalog_requests)
+        print(f"catalog  p50 {cat['p50_ms']:.2f}ms p99 {cat['p99_ms']:.2f}ms")
+
+        results["rss"]["peak_mb"] = peak_rss_mb()
+        print(f"rss      peak {results['rss']['peak_mb']:.0f} MB (startup {results['rss']['startup_mb']:.0f} MB)")
+    finally:
+        if server is not None:
+            server.should_exit = True
+            time.sleep(0.5)
+        prom.terminate()
+        ollama.terminate()
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\nvs {args.baseline} (tolerance {args.tolerance:.0%}):")
+        changed = {k: v for k, v in results["params"].items() if baseline.get("params", {}).get(k) != v}
+        if changed:
+            print(f"  note: parameters differ from the baseline run: {changed}")
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0 if not results["analyze"]["errors"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""Batch vs per-segment vectorization.
+
+    python -m bench.bench_vectorize [--segments 20000] [--points 60]
+
+Compares the legacy per-segment series_to_vector loop (sort tuples, build
+arrays, interp, tolist per segment) against embedding.resample on
+one ragged buffer, checks both produce the same vectors and reports the speedup.
+"""
+import argparse
+import sys
+import time
+from typing import List, Tuple
+import numpy as np
+from app.embedding import resample
+from app.milvus_client import DIM, pack_segments
+from app.series import Series
+
+def legacy_series_to_vector(points: List[Tuple[int, float]], dim: int = DIM) -> List[float]:
+    if not points:
+        return [0.0] * dim
+    points = sorted(points, key=lambda x: x[0])
+    xs = np.array([p[0] for p in points], dtype=np.float64)
+    ys = np.array([p[1] for p in points], dtype=np.float64)
+    if xs.max() == xs.min():
+        return [float(ys.mean())] * dim
+    xs = (xs - xs.min()) / (xs.max() - xs.min() + 1e-9)
+    target = np.linspace(0.0, 1.0, dim)
+    vec = np.interp(target, xs, ys)
+    vec = (vec - vec.mean()) / (vec.std() + 1e-9)
+    return vec.astype(np.float32).tolist()
+
+def make_segments(n: int, points: int, seed: int = 0) -> List[Series]:
+    rng = np.random.default_rng(seed)
+    segs = []
+    for i in range(n):
+        k = int(rng.integers(max(4, points // 2), points * 2))
+        ts = 1_700_000_000 + i * 3600 + np.cumsum(rng.integers(30, 90, size=k)).astype(np.int64)
+        vals = np.sin(np.linspace(0, rng.uniform(1, 10), k)) + rng.normal(0, 0.1, k)
+        segs.append(Series({}, ts, vals))
+    return segs
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--segments", type=int, default=20000)
+    ap.add_argument("--points", type=int, default=60)
+    ap.add_argument("--repeat", type=int, default=3, help="best of N runs")
+    ap.add_argument("--min-speedup", type=float, default=10.0)
+    args = ap.parse_args()
+
+    segs = make_segments(args.segments, args.points)
+    tuple_segs = [s.points for s in segs]
+
+    t_legacy = t_batch = float("inf")
+    for _ in range(max(1, args.repeat)):
+        t0 = time.perf_counter()
+        legacy = np.array([legacy_series_to_vector(p) for p in tuple_segs], dtype=np.float32)
+        t_legacy = min(t_legacy, time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        ts, vals, offsets = pack_segments(segs)
+        batch = resample(ts, vals, offsets, DIM)
+        t_batch = min(t_batch, time.perf_counter() - t0)
+
+    err = float(np.abs(batch - legacy).max())
+    speedup = t_legacy / t_batch
+    print(f"segments={args.segments} points~{args.points} dim={DIM}")
+    print(f"per-segment loop: {t_legacy * 1000:9.1f} ms  ({args.segments / t_legacy:,.0f} seg/s)")
+    print(f"batch:            {t_batch * 1000:9.1f} ms  ({args.segments / t_batch:,.0f} seg/s)")
+    print(f"speedup: {speedup:.1f}x  max abs diff: {err:.2e}")
+    if err > 1e-3:
+        print("FAIL: batch vectors differ from per-segment vectors")
+        return 1
+    if speedup < args.min_speedup:
+        print(f"FAIL: speedup below {args.min_speedup}x")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
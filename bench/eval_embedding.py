@@ -0,0 +1,106 @@
+"""Neighbor quality of the segment embeddings on labeled anomaly windows.
+
+    python -m bench.eval_embedding [--windows labeled.npz] [--methods resample,paa,sax,fft,multiscale]
+                                   [--dims 32,64,128] [--k 5]
+
+Every window is used as a query against all the others (leave-one-out, exact
+L2). precision@k is the share of the k nearest windows that carry the query's
+label, mrr the mean reciprocal rank of the first same-label neighbor; this is
+what decides whether /analyze shows the LLM relevant history.
+
+--windows takes an .npz with int64 `ts`, float64 `vals`, int64 `offsets`
+(ragged buffer, see milvus_client.pack_segments) and a `labels` array with one
+entry per window. Without it a synthetic set is generated: spikes, level
+shifts, ramps, oscillation bursts, dropouts and quiet windows, each at two
+magnitudes (e.g. load 0.5 vs 50) and with random scrape gaps.
+"""
+import argparse
+import sys
+import time
+from typing import Dict, List, Tuple
+import numpy as np
+from app.embedding import METHODS, SIDE_CHANNELS
+
+KINDS = ["quiet", "spike", "level_shift", "ramp", "oscillation", "dropout"]
+
+def synthetic(per_label: int, points: int, gap_rate: float, seed: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    ts_parts, val_parts, labels = [], [], []
+    for kind in KINDS:
+        for magnitude in ("low", "high"):
+            level = 0.5 if magnitude == "low" else 50.0
+            for _ in range(per_label):
+                t = np.arange(points, dtype=np.float64)
+                v = level * (1 + 0.05 * rng.normal(size=points)) + level * 0.1 * np.sin(t / rng.uniform(5, 20))
+                at = int(rng.integers(points // 4, 3 * points // 4))
+                if kind == "spike":
+                    v[at:at + 3] += level * rng.uniform(2, 4)
+                elif kind == "level_shift":
+                    v[at:] += level * rng.uniform(0.8, 1.5)
+                elif kind == "ramp":
+                    v += level * rng.uniform(1, 2) * np.clip((t - at) / (points - at), 0, None)
+                elif kind == "oscillation":
+                    v[at:] += level * 0.8 * np.sin((t[at:] - at) * rng.uniform(0.8, 1.5))
+                elif kind == "dropout":
+                    v[at:at + points // 8] = 0.0
+                ts = 1_700_000_000 + (t * 60).astype(np.int64)
+                keep = rng.random(points) >= gap_rate
+                keep[[0, -1]] = True
+                ts_parts.append(ts[keep])
+                val_parts.append(v[keep])
+                labels.append(f"{kind}/{magnitude}")
+    offsets = np.zeros(len(ts_parts) + 1, dtype=np.int64)
+    np.cumsum([len(p) for p in ts_parts], out=offsets[1:])
+    return np.concatenate(ts_parts), np.concatenate(val_parts), offsets, np.array(labels)
+
+def neighbor_quality(vecs: np.ndarray, labels: np.ndarray, k: int) -> Dict[str, float]:
+    v = vecs.astype(np.float64)
+    sq = (v * v).sum(axis=1)
+    d = sq[:, None] + sq[None, :] - 2.0 * v @ v.T
+    np.fill_diagonal(d, np.inf)
+    order = np.argsort(d, axis=1)
+    same = labels[order] == labels[:, None]
+    first = np.argmax(same, axis=1)
+    rr = np.where(same.any(axis=1), 1.0 / (first + 1), 0.0)
+    return {"precision": float(same[:, :k].mean()), "mrr": float(rr.mean())}
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--windows", help="labeled .npz (ts, vals, offsets, labels)")
+    ap.add_argument("--methods", default=",".join(METHODS))
+    ap.add_argument("--dims", default="32,64,128")
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--per-label", type=int, default=40, help="synthetic windows per label")
+    ap.add_argument("--points", type=int, default=60, help="synthetic samples per window")
+    ap.add_argument("--gap-rate", type=float, default=0.1, help="synthetic share of dropped scrapes")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    if args.windows:
+        data = np.load(args.windows, allow_pickle=False)
+        ts, vals, offsets, labels = data["ts"], data["vals"], data["offsets"], data["labels"]
+    else:
+        ts, vals, offsets, labels = synthetic(args.per_label, args.points, args.gap_rate, args.seed)
+    print(f"windows={len(offsets) - 1} labels={len(set(labels.tolist()))} k={args.k}")
+    print(f"{'method':12s} {'dim':>5s} {'p@k':>7s} {'mrr':>7s} {'seg/s':>10s}")
+
+    rows: List[Dict] = []
+    for method in [m.strip() for m in args.methods.split(",") if m.strip()]:
+        for dim in [int(x) for x in args.dims.split(",") if x.strip()]:
+            if method == "multiscale" and dim < SIDE_CHANNELS + 4:
+                continue
+            t0 = time.perf_counter()
+            vecs = METHODS[method](ts, vals, offsets, dim)
+            rate = (len(offsets) - 1) / max(time.perf_counter() - t0, 1e-9)
+            q = neighbor_quality(vecs, labels, args.k)
+            rows.append({"method": method, "dim": dim, **q})
+            print(f"{method:12s} {dim:5d} {q['precision']:7.3f} {q['mrr']:7.3f} {rate:10,.0f}")
+
+    if not rows:
+        return 1
+    best = max(rows, key=lambda r: (round(r["precision"], 3), -r["dim"]))
+    print(f"\nbest: embedding.method={best['method']} embedding.dim={best['dim']} (p@{args.k}={best['precision']:.3f})")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""Local stand-ins for Prometheus and Ollama, for benchmarks and offline runs.
+
+    python -m bench.fakes prometheus [--port 9090] [--series 200] [--targets 2000] [--metric-names 5000]
+    python -m bench.fakes ollama [--port 11434] [--latency 0.5] [--token-delay 0.005]
+
+FakePrometheus answers query_range, query, targets and the __name__ label
+values API with synthetic data: every query returns `series` series (one per
+instance) of a daily sine with noise, occasional spikes and level shifts,
+aligned to the requested step and deterministic for a given query, so repeated
+runs fetch the same points. FakeOllama answers /api/generate (plain and
+streaming) with a fixed analysis after `latency` seconds.
+"""
+import argparse
+import json
+import sys
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+
+MAX_POINTS = 11000  # Prometheus rejects longer query_range responses per series
+
+def parse_step(step: str) -> int:
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    return int(float(step[:-1]) * units[step[-1]]) if step[-1] in units else int(float(step))
+
+def aligned(start: float, end: float, step: int) -> np.ndarray:
+    first = -(-int(start) // step) * step
+    return np.arange(first, int(end) + 1, step, dtype=np.int64)
+
+def synthetic_values(query: str, idx: int, ts: np.ndarray) -> np.ndarray:
+    """Values of series idx of a query at ts; the same (query, idx, ts) always gives the same values"""
+    seed = zlib.crc32(f"{query}/{idx}".encode())
+    level = 1.0 + seed % 1000
+    phase = (seed % 86400) / 86400.0 * 2 * np.pi
+    t = ts.astype(np.float64)
+    v = level * (1 + 0.2 * np.sin(2 * np.pi * t / 86400 + phase))
+    # Per-point noise from a hash of the timestamp so any sub-range matches the full range
+    noise = ((ts * 2654435761 + seed) % 10007) / 10007.0 - 0.5
+    v += level * 0.05 * noise
+    hour = ts // 3600
+    spike = (hour * 31 + seed) % 97 == 0
+    v[spike & (ts % 3600 < 300)] += level * 2.0
+    shift = (hour // 6 * 17 + seed) % 53 == 0
+    v[shift] += level * 0.8
+    return v
+
+class FakePrometheus(BaseHTTPRequestHandler):
+    series = 200
+    targets = 2000
+    metric_names = 5000
+    delay = 0.0
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, body: Dict[str, Any], code: int = 200):
+        data = json.dumps(body, separators=(",", ":")).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        q = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if self.delay:
+            time.sleep(self.delay)
+        if url.path == "/api/v1/query_range":
+            self.query_range(q)
+        elif url.path == "/api/v1/query":
+            self.instant(q)
+        elif url.path == "/api/v1/targets":
+            self.reply({"status": "success", "data": {"activeTargets": [
+                {"labels": {"instance": f"host-{i:05d}:9100", "job": f"job-{i % 20}"}, "health": "up" if i % 50 else "down",
+                 "lastScrape": "2024-01-01T00:00:00Z"} for i in range(self.targets)]}})
+        elif url.path.startswith("/api/v1/label/") and url.path.endswith("/values"):
+            n = self.metric_names if "match[]" not in q else max(1, self.metric_names // 20)
+            self.reply({"status": "success", "data": [f"bench_metric_{i:05d}" for i in range(n)]})
+        else:
+            self.reply({"status": "error", "error": f"unsupported path {url.path}"}, 404)
+
+    def query_range(self, q: Dict[str, str]):
+        ts = aligned(float(q["start"]), float(q["end"]), parse_step(q.get("step", "60s")))
+        if len(ts) > MAX_POINTS:
+            self.reply({"status": "error", "errorType": "bad_data", "error": "exceeded maximum resolution of 11,000 points per timeseries"}, 400)
+            return
+        query = q.get("query", "")
+        stamps = ts.tolist()
+        result: List[Dict[str, Any]] = []
+        for i in range(self.series):
+            vals = synthetic_values(query, i, ts)
+            result.append({
+                "metric": {"__name__": query, "instance": f"host-{i:05d}:9100", "job": f"job-{i % 20}"},
+                "values": [[t, repr(v)] for t, v in zip(stamps, vals.tolist())],
+            })
+        self.reply({"status": "success", "data": {"resultType": "matrix", "result": result}})
+
+    def instant(self, q: Dict[str, str]):
+        now = np.array([int(float(q.get("time", time.time())))], dtype=np.int64)
+        query = q.get("query", "")
+        result = [{"metric": {"__name__": query, "instance": f"host-{i:05d}:9100"},
+                   "value": [int(now[0]), repr(float(synthetic_values(query, i, now)[0]))]} for i in range(self.series)]
+        self.reply({"status": "success", "data": {"resultType": "vector", "result": result}})
+
+ANALYSIS = {
+    "thought": "基准测试",
+    "title": "基准测试分析",
+    "level": "正常",
+    "current_status": "指标平稳",
+    "analysis": "离线基准测试返回的固定分析结果",
+    "action": "无需处理",
+    "prediction_points": [],
+}
+
+class FakeOllama(BaseHTTPRequestHandler):
+    latency = 0.5
+    token_delay = 0.005
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        prompt_tokens = len(body.get("prompt", "")) // 3
+        time.sleep(self.latency)
+        text = json.dumps(ANALYSIS, ensure_ascii=False)
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i in range(0, len(text), 8):
+                self.chunk({"response": text[i:i + 8], "done": False})
+                if self.token_delay:
+                    time.sleep(self.token_delay)
+            self.chunk({"response": "", "done": True, "prompt_eval_count": prompt_tokens})
+            self.wfile.write(b"0\r\n\r\n")
+            return
+        data = json.dumps({"response": text, "done": True, "prompt_eval_count": prompt_tokens,
+                           "prompt_eval_duration": int(self.latency * 1e9)}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def chunk(self, obj: Dict[str, Any]):
+        line = (json.dumps(obj, ensure_ascii=False) + "\n").encode()
+        self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+        self.wfile.flush()
+
+def serve(handler: type, port: int, **attrs):
+    """Run handler (with class attributes overridden by attrs) on 127.0.0.1:port until killed"""
+    cls = type(handler.__name__, (handler,), attrs)
+    server = ThreadingHTTPServer(("127.0.0.1", port), cls)
+    server.daemon_threads = True
+    server.serve_forever()
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="kind", required=True)
+    p = sub.add_parser("prometheus")
+    p.add_argument("--port", type=int, default=9090)
+    p.add_argument("--series", type=int, default=FakePrometheus.series)
+    p.add_argument("--targets", type=int, default=FakePrometheus.targets)
+    p.add_argument("--metric-names", type=int, default=FakePrometheus.metric_names)
+    p.add_argument("--delay", type=float, default=0.0, help="extra seconds per request")
+    o = sub.add_parser("ollama")
+    o.add_argument("--port", type=int, default=11434)
+    o.add_argument("--latency", type=float, default=FakeOllama.latency)
+    o.add_argument("--token-delay", type=float, default=FakeOllama.token_delay)
+    args = ap.parse_args()
+    if args.kind == "prometheus":
+        print(f"fake Prometheus on http://127.0.0.1:{args.port}")
+        serve(FakePrometheus, args.port, series=args.series, targets=args.targets, metric_names=args.metric_names, delay=args.delay)
+    else:
+        print(f"fake Ollama on http://127.0.0.1:{args.port}")
+        serve(FakeOllama, args.port, latency=args.latency, token_delay=args.token_delay)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
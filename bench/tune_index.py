@@ -0,0 +1,164 @@
+"""Milvus index profile / search-parameter tuning.
+
+    python -m bench.tune_index [--synthetic 50000 | --vectors vecs.npy | --from-collection]
+                               [--profiles FLAT,IVF_FLAT,IVF_SQ8,HNSW] [--queries 200] [--top-k 5]
+
+Builds a scratch collection per candidate profile on the same vectors, sweeps
+the search-time knob (nprobe for IVF_*, ef for HNSW), and reports recall@k
+against exact NumPy top-k together with p50/p99 single-query latency. The
+recommendation is the fastest setting that reaches --min-recall; copy it into
+milvus.index in config.yaml. Needs a reachable Milvus (milvus.host/port).
+"""
+import argparse
+import sys
+import time
+from typing import Dict, List, Tuple
+import numpy as np
+from pymilvus import Collection, CollectionSchema, DataType, FieldSchema, utility
+from app.milvus_client import COLLECTION_NAME, DIM, INDEX_PROFILES, connect, index_params, search_params, suggest_profile
+
+SCRATCH_PREFIX = "tune_index_"
+INSERT_BATCH = 10000
+SWEEPS = {
+    "FLAT": [None],
+    "IVF_FLAT": [1, 4, 8, 16, 32, 64, 128],
+    "IVF_SQ8": [1, 4, 8, 16, 32, 64, 128],
+    "HNSW": [16, 32, 64, 128, 256],
+}
+KNOB = {"IVF_FLAT": "nprobe", "IVF_SQ8": "nprobe", "HNSW": "ef"}
+
+def load_vectors(args) -> np.ndarray:
+    if args.vectors:
+        return np.load(args.vectors).astype(np.float32)
+    if args.from_collection:
+        col = Collection(COLLECTION_NAME)
+        col.load()
+        if not hasattr(col, "query_iterator"):
+            # Older pymilvus: a single query is capped at 16384 rows
+            rows = col.query(expr="id >= 0", output_fields=["vector"], limit=min(args.limit, 16384))
+            return np.asarray([r["vector"] for r in rows], dtype=np.float32)
+        it = col.query_iterator(batch_size=INSERT_BATCH, expr="id >= 0", output_fields=["vector"])
+        rows = []
+        while len(rows) < args.limit:
+            batch = it.next()
+            if not batch:
+                break
+            rows.extend(r["vector"] for r in batch)
+        it.close()
+        return np.asarray(rows[:args.limit], dtype=np.float32)
+    # Synthetic: clustered, z-normalized curves resemble stored segment vectors better than iid noise
+    rng = np.random.default_rng(args.seed)
+    centers = rng.normal(size=(max(1, args.synthetic // 500), DIM))
+    vecs = centers[rng.integers(0, len(centers), args.synthetic)] + rng.normal(0, 0.5, (args.synthetic, DIM))
+    vecs = (vecs - vecs.mean(axis=1, keepdims=True)) / (vecs.std(axis=1, keepdims=True) + 1e-9)
+    return vecs.astype(np.float32)
+
+def exact_topk(base: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    # ||q - b||^2 = ||q||^2 - 2 q.b + ||b||^2; ||q||^2 does not change the ranking
+    d = (base * base).sum(axis=1)[None, :] - 2.0 * queries @ base.T
+    idx = np.argpartition(d, k, axis=1)[:, :k]
+    order = np.take_along_axis(d, idx, axis=1).argsort(axis=1)
+    return np.take_along_axis(idx, order, axis=1)
+
+def build(profile: str, vecs: np.ndarray, params: Dict) -> Tuple[Collection, float]:
+    name = SCRATCH_PREFIX + profile.lower()
+    if utility.has_collection(name):
+        utility.drop_collection(name)
+    schema = CollectionSchema(fields=[
+        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name="vector", dtype=DataType.FLOAT_VECTOR, dim=DIM),
+    ])
+    col = Collection(name=name, schema=schema)
+    for i in range(0, len(vecs), INSERT_BATCH):
+        col.insert([list(range(i, min(i + INSERT_BATCH, len(vecs)))), vecs[i:i + INSERT_BATCH].tolist()])
+    col.flush()
+    t0 = time.perf_counter()
+    col.create_index(field_name="vector", index_params=index_params(profile, params))
+    utility.wait_for_index_building_complete(name)
+    col.load()
+    return col, time.perf_counter() - t0
+
+def measure(col: Collection, profile: str, knob_value, queries: np.ndarray, truth: np.ndarray, k: int) -> Dict:
+    params = search_params(profile, {KNOB[profile]: knob_value} if knob_value is not None else {})
+    lat: List[float] = []
+    found = 0
+    for q, t in zip(queries, truth):
+        t0 = time.perf_counter()
+        res = col.search(data=[q.tolist()], anns_field="vector", param=params, limit=k)
+        lat.append(time.perf_counter() - t0)
+        found += len(set(h.id for h in res[0]) & set(t.tolist()))
+    lat_ms = np.array(lat) * 1000
+    return {
+        "profile": profile,
+        "knob": f"{KNOB[profile]}={knob_value}" if knob_value is not None else "-",
+        "params": params["params"],
+        "recall": found / (len(queries) * k),
+        "p50": float(np.percentile(lat_ms, 50)),
+        "p99": float(np.percentile(lat_ms, 99)),
+    }
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    src = ap.add_mutually_exclusive_group()
+    src.add_argument("--synthetic", type=int, default=50000, help="number of synthetic vectors")
+    src.add_argument("--vectors", help=".npy file of shape (N, DIM)")
+    src.add_argument("--from-collection", action="store_true", help=f"sample vectors stored in {COLLECTION_NAME}")
+    ap.add_argument("--limit", type=int, default=200000, help="max vectors read with --from-collection")
+    ap.add_argument("--profiles", default=",".join(INDEX_PROFILES))
+    ap.add_argument("--nlist", type=int, default=0, help="IVF nlist (default: suggest_profile for N)")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--top-k", type=int, default=5)
+    ap.add_argument("--min-recall", type=float, default=0.95)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--keep", action="store_true", help="keep scratch collections")
+    args = ap.parse_args()
+
+    connect()
+    vecs = load_vectors(args)
+    if len(vecs) <= args.top_k:
+        print(f"Need more than {args.top_k} vectors, got {len(vecs)}")
+        return 1
+    rng = np.random.default_rng(args.seed + 1)
+    # Queries are perturbed stored vectors, like a fresh window close to a known one
+    queries = vecs[rng.integers(0, len(vecs), args.queries)] + rng.normal(0, 0.1, (args.queries, DIM)).astype(np.float32)
+    truth = exact_topk(vecs, queries, args.top_k)
+    suggested = suggest_profile(len(vecs))
+    nlist = args.nlist or suggested["params"].get("nlist") or int(min(65536, max(128, 4 * len(vecs) ** 0.5)))
+    print(f"vectors={len(vecs)} dim={DIM} queries={args.queries} top_k={args.top_k}")
+    print(f"suggested by size: {suggested['index_type']} {suggested['params']}")
+
+    rows = []
+    for profile in [p.strip().upper() for p in args.profiles.split(",") if p.strip()]:
+        build_params = {"nlist": nlist} if profile.startswith("IVF") else {}
+        col, build_s = build(profile, vecs, build_params)
+        print(f"{profile:9s} built in {build_s:.1f}s {index_params(profile, build_params)['params']}")
+        try:
+            for v in SWEEPS.get(profile, [None]):
+                if profile.startswith("IVF") and v is not None and v > nlist:
+                    continue
+                row = measure(col, profile, v, queries, truth, args.top_k)
+                row["build_s"] = build_s
+                rows.append(row)
+                print(f"  {row['knob']:12s} recall@{args.top_k}={row['recall']:.3f}  p50={row['p50']:.2f}ms  p99={row['p99']:.2f}ms")
+        finally:
+            if not args.keep:
+                utility.drop_collection(col.name)
+
+    ok = [r for r in rows if r["recall"] >= args.min_recall]
+    if not ok:
+        print(f"No setting reached recall {args.min_recall}")
+        return 1
+    best = min(ok, key=lambda r: r["p99"])
+    print(f"\nrecommended (recall >= {args.min_recall}, lowest p99):")
+    print("  milvus:\n    index:")
+    print(f"      profile: \"{best['profile']}\"")
+    if best["profile"].startswith("IVF"):
+        print(f"      params:\n        nlist: {nlist}")
+    if best["params"]:
+        print("      search_params:")
+        for k, v in best["params"].items():
+            print(f"        {k}: {v}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
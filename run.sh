@@ -1,2 +1,4 @@
 #!/bin/bash
+# WORKERS=4 ./run.sh starts 4 worker processes (uvicorn reads WEB_CONCURRENCY as --workers)
+export WEB_CONCURRENCY="${WORKERS:-${WEB_CONCURRENCY:-1}}"
 python  -m  uvicorn app.main:app --host 127.0.0.1 --port 8000
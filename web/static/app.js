@@ -46,22 +46,38 @@ async function init() {
   }
 }
 
+const METRIC_PAGE = 500;
+const metricFilter = document.getElementById('metric-filter');
+
+function fillMetrics(names, total) {
+  metricSelect.innerHTML = '';
+  names.forEach(m => {
+    const opt = document.createElement('option');
+    opt.value = m;
+    opt.textContent = m;
+    metricSelect.appendChild(opt);
+  });
+  if (total > names.length) {
+    const opt = document.createElement('option');
+    opt.disabled = true;
+    opt.textContent = `... 共 ${total} 个，请输入前缀缩小范围`;
+    metricSelect.appendChild(opt);
+  }
+}
+
 async function updateMetrics(instance) {
-    if (!instance) return;
+    const prefix = metricFilter ? metricFilter.value.trim() : '';
+    if (!instance && !prefix) return;
     metricSelect.innerHTML = '<option>Loading...</option>';
     try {
-        const res = await fetch(`/targets?instance=${encodeURIComponent(instance)}`);
+        const params = new URLSearchParams({ prefix, limit: METRIC_PAGE });
+        if (instance) params.set('instance', instance);
+        const res = await fetch(`/catalog/metrics?${params}`);
         const data = await res.json();
-        metricSelect.innerHTML = '';
-        if (data.metrics && data.metrics.length > 0) {
-            data.metrics.forEach(m => {
-                const opt = document.createElement('option');
-                opt.value = m;
-                opt.textContent = m;
-                metricSelect.appendChild(opt);
-            });
+        if (data.items && data.items.length > 0) {
+            fillMetrics(data.items, data.total);
             // Select 'up' if available by default
-            if (data.metrics.includes('up')) {
+            if (data.items.includes('up')) {
                 metricSelect.value = 'up';
             }
         } else {
@@ -74,6 +90,15 @@ async function updateMetrics(instance) {
     }
 }
 
+let filterTimer = null;
+if (metricFilter) {
+  metricFilter.oninput = () => {
+    // Debounce: search on the server once typing pauses
+    clearTimeout(filterTimer);
+    filterTimer = setTimeout(() => updateMetrics(instanceSelect.value), 250);
+  };
+}
+
 function updateQuery() {
   const instance = instanceSelect.value;
   const metric = metricSelect.value;
@@ -177,27 +202,85 @@ document.getElementById('ingest').onclick = async () => {
   r.textContent = JSON.stringify(data, null, 2);
 };
 
-document.getElementById('analyze').onclick = async () => {
-  r.textContent = '分析中...';
-  t.textContent = '思考中...';
-  const res = await fetch(`/analyze?metric=${encodeURIComponent(q.value)}&step=${encodeURIComponent(s.value)}`);
+const allSeries = document.getElementById('all-series');
+
+async function analyzeAllSeries() {
+  const res = await fetch(`/analyze?metric=${encodeURIComponent(q.value)}&step=${encodeURIComponent(s.value)}&all_series=1`);
   const data = await res.json();
-  
-  // Extract thought if present
-  if (data.thought) {
-    t.textContent = data.thought;
-  } else {
-    t.textContent = '无思考过程';
-  }
-  
+  t.textContent = data.thought || '无思考过程';
   renderReport(data);
-  
-  // Render Chart if data available
-  if (data.recent_points) {
-    // Check if LLM returned prediction_points
-    const predictionPoints = data.prediction_points || [];
-    renderChart(data.recent_points, predictionPoints);
+  if (data.series_scores) renderSeriesScores(data.series_scores);
+  if (data.recent_points) renderChart(data.recent_points, data.prediction_points || []);
+}
+
+function escapeHtml(str) {
+  return String(str).replace(/[&<>"']/g, c => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[c]));
+}
+
+function renderSeriesScores(scores) {
+  const rows = scores.slice(0, 50).map(x => {
+    const labels = Object.entries(x.labels || {}).filter(([k]) => k !== '__name__').map(([k, v]) => `${k}="${v}"`).join(', ');
+    const color = x.suspicious ? '#dc3545' : '#28a745';
+    return `<tr><td>${escapeHtml(labels || '-')}</td><td style="color:${color}">${x.score}</td><td>${(x.reasons || []).join(', ') || '-'}</td></tr>`;
+  }).join('');
+  r.innerHTML += `
+    <div style="margin-top:15px; border-top:1px dashed #ccc; padding-top:10px;">
+      <strong>序列异常分数 (共 ${scores.length} 条):</strong>
+      <table style="width:100%; margin-top:5px; font-size:0.9em;">
+        <tr><th align="left">标签</th><th align="left">分数</th><th align="left">触发检测</th></tr>
+        ${rows}
+      </table>
+    </div>
+  `;
+}
+
+document.getElementById('analyze').onclick = () => {
+  r.textContent = '分析中...';
+  t.textContent = '思考中...';
+  if (allSeries && allSeries.checked) {
+    analyzeAllSeries().catch(e => { r.textContent = 'Analyze Error: ' + e; });
+    return;
   }
+  // Stream the analysis: fields are rendered as soon as the model finishes each one
+  const url = `/analyze/stream?metric=${encodeURIComponent(q.value)}&step=${encodeURIComponent(s.value)}`;
+  const es = new EventSource(url);
+  const partial = {};
+  let recentPoints = null;
+
+  es.addEventListener('meta', (ev) => {
+    recentPoints = JSON.parse(ev.data).recent_points;
+    if (recentPoints) renderChart(recentPoints, []);
+  });
+
+  es.addEventListener('field', (ev) => {
+    const f = JSON.parse(ev.data);
+    partial[f.key] = f.value;
+    if (f.key === 'thought') t.textContent = f.value;
+    if (partial.title || partial.analysis) renderReport(partial);
+    if (f.key === 'prediction_points' && recentPoints) renderChart(recentPoints, f.value || []);
+  });
+
+  es.addEventListener('result', (ev) => {
+    es.close();
+    const data = JSON.parse(ev.data);
+    t.textContent = data.thought || '无思考过程';
+    renderReport(data);
+    if (data.recent_points) {
+      // Check if LLM returned prediction_points
+      renderChart(data.recent_points, data.prediction_points || []);
+    }
+  });
+
+  es.addEventListener('error', (ev) => {
+    es.close();
+    // Server-sent error events carry data; connection failures do not
+    if (ev.data) {
+      renderReport(JSON.parse(ev.data));
+    } else if (!partial.title) {
+      r.textContent = '分析连接中断';
+    }
+    if (!partial.thought) t.textContent = '无思考过程';
+  });
 };
 
 function renderReport(data) {
@@ -251,6 +334,45 @@ function getLevelColor(level) {
     return '#17a2b8'; // Blue
 }
 
+function renderAlertStatus(alert, state) {
+  let body;
+  if (alert.deduplicated) {
+    body = '<div>相同告警近期已推送，本次已忽略</div>';
+  } else if (!state || state.state !== 'done') {
+    body = '<div>已加入推送队列，发送中...</div>';
+  } else {
+    const sent = state.sent || {};
+    body = `
+      <ul style="margin:5px 0; padding-left:20px;">
+          <li>企业微信: ${sent.wecom ? '✅' : '❌'}</li>
+          <li>钉钉: ${sent.dingtalk ? '✅' : '❌'}</li>
+          <li>邮件: ${sent.email ? '✅' : '❌'}</li>
+      </ul>
+      ${state.digest ? '<div style="color:#666">与其他告警合并为汇总消息发送</div>' : ''}`;
+  }
+  let box = document.getElementById('alert-status');
+  if (!box) {
+    box = document.createElement('div');
+    box.id = 'alert-status';
+    box.style.cssText = 'margin-top:15px; border-top:1px dashed #ccc; padding-top:10px;';
+    r.appendChild(box);
+  }
+  box.innerHTML = `<strong>推送结果:</strong>${body}`;
+}
+
+async function pollAlert(alert) {
+  // Delivery runs in the background queue; poll until every channel has an outcome
+  for (let i = 0; i < 60; i++) {
+    await new Promise(resolve => setTimeout(resolve, 1000));
+    const res = await fetch(`/alerts/${alert.id}`);
+    const state = await res.json();
+    if (state.state === 'done' || state.state === 'unknown') {
+      renderAlertStatus(alert, state.state === 'done' ? state : null);
+      return;
+    }
+  }
+}
+
 document.getElementById('alert').onclick = async () => {
   r.textContent = '推送中...';
   try {
@@ -259,18 +381,9 @@ document.getElementById('alert').onclick = async () => {
     
     if (data.analysis) {
         renderReport(data.analysis);
-        // Append alert status
-        const statusHtml = `
-          <div style="margin-top:15px; border-top:1px dashed #ccc; padding-top:10px;">
-              <strong>推送结果:</strong>
-              <ul style="margin:5px 0; padding-left:20px;">
-                  <li>企业微信: ${data.alerts_sent && data.alerts_sent.wecom ? '✅' : '❌'}</li>
-                  <li>钉钉: ${data.alerts_sent && data.alerts_sent.dingtalk ? '✅' : '❌'}</li>
-                  <li>邮件: ${data.alerts_sent && data.alerts_sent.email ? '✅' : '❌'}</li>
-              </ul>
-          </div>
-        `;
-        r.innerHTML += statusHtml;
+        const alert = data.alert || {};
+        renderAlertStatus(alert, null);
+        if (alert.queued) await pollAlert(alert);
     } else {
         r.textContent = JSON.stringify(data, null, 2);
     }